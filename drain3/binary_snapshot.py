@@ -0,0 +1,209 @@
+# SPDX-License-Identifier: MIT
+# This file implements a compact binary snapshot format of the clusters and prefix tree of a Drain model.
+#
+# A snapshot starts with a header of the magic bytes, the format version and flags, followed by the (optionally
+# compressed) body. The lowest 3 bits of the flags are the ID of the compression codec, 0 for none. The body is a
+# sequence of sections, each preceded by its length in bytes:
+# - meta: clusters counter, string count
+# - string lengths: the length in characters of each string in the string table
+# - strings: the UTF-8 encoded strings of the string table, concatenated
+# - clusters: for each cluster - ID, size, token count and string table indices of the template tokens
+# - LRU order: cluster IDs, least recently used first (empty for unlimited clusters)
+# - tree: for each node in pre-order - string table index of its key (-1 for the root), child count,
+#   cluster ID count and cluster IDs
+# Integer sections are arrays of little endian signed 64-bit integers.
+
+import array
+import struct
+import sys
+from typing import Any, Dict, Iterable, List, MutableMapping, Optional, Sequence, Tuple
+
+from drain3.compression import CompressionCodec, DEFAULT_CODECS
+from drain3.drain import DrainBase, LogCluster, LogClusterCache, Node
+
+MAGIC = b"\x93D3S"
+VERSION = 1
+
+_FLAGS_CODEC_ID = 7
+
+_HEADER = struct.Struct("<4sBB")
+_SECTION_LENGTH = struct.Struct("<Q")
+
+
+def is_binary_snapshot(state: bytes) -> bool:
+    return state[:len(MAGIC)] == MAGIC
+
+
+def _ints_to_bytes(ints: "array.array[int]") -> bytes:
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return ints.tobytes()
+
+
+def _bytes_to_ints(data: bytes) -> List[int]:
+    ints = array.array("q")
+    ints.frombytes(data)
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return ints.tolist()
+
+
+def dump_binary_state(drain: DrainBase, codec: Optional[CompressionCodec] = None,
+                      compression_level: Optional[int] = None) -> bytes:
+    """
+    Create a binary snapshot of the clusters and prefix tree of a model.
+
+    :param drain: the model
+    :param codec: the codec to compress the snapshot with, or None to not compress it
+    :param compression_level: the compression level, or None for the default level of the codec
+    """
+    string_to_index: Dict[str, int] = {}
+
+    def get_string_index(s: str) -> int:
+        index = string_to_index.get(s)
+        if index is None:
+            index = len(string_to_index)
+            string_to_index[s] = index
+        return index
+
+    id_to_cluster = drain.id_to_cluster
+    cluster_ints = array.array("q")
+    for cluster_id in id_to_cluster:
+        cluster = id_to_cluster.get(cluster_id)
+        if cluster is None:
+            continue
+        tokens = cluster.log_template_tokens
+        cluster_ints.extend((cluster_id, cluster.size, len(tokens)))
+        cluster_ints.extend([get_string_index(token) for token in tokens])
+
+    lru_order_ints = array.array("q")
+    if isinstance(id_to_cluster, LogClusterCache):
+        lru_order_ints.extend(id_to_cluster.get_lru_order())
+
+    tree_ints = array.array("q")
+    nodes: List[Tuple[int, Node]] = [(-1, drain.root_node)]
+    while nodes:
+        key_index, node = nodes.pop()
+        key_to_child_node = node.key_to_child_node
+        tree_ints.extend((key_index, len(key_to_child_node), len(node.cluster_ids)))
+        tree_ints.extend(node.cluster_ids)
+        # reversed, so that children are popped in order
+        for key, child_node in reversed(list(key_to_child_node.items())):
+            nodes.append((get_string_index(key), child_node))
+
+    strings = list(string_to_index)
+    meta_ints = array.array("q", (drain.clusters_counter, len(strings)))
+    sections = [
+        _ints_to_bytes(meta_ints),
+        _ints_to_bytes(array.array("q", [len(s) for s in strings])),
+        "".join(strings).encode("utf-8", "surrogatepass"),
+        _ints_to_bytes(cluster_ints),
+        _ints_to_bytes(lru_order_ints),
+        _ints_to_bytes(tree_ints),
+    ]
+    body = b"".join(_SECTION_LENGTH.pack(len(section)) + section for section in sections)
+
+    flags = 0
+    if codec is not None:
+        body = codec.compress(body, compression_level)
+        flags |= codec.codec_id
+    return _HEADER.pack(MAGIC, VERSION, flags) + body
+
+
+def _read_sections(body: bytes) -> List[bytes]:
+    sections = []
+    pos = 0
+    while pos < len(body):
+        length, = _SECTION_LENGTH.unpack_from(body, pos)
+        pos += _SECTION_LENGTH.size
+        sections.append(body[pos:pos + length])
+        pos += length
+    return sections
+
+
+def _decode_strings(lengths: Sequence[int], data: bytes) -> List[str]:
+    text = data.decode("utf-8", "surrogatepass")
+    strings = []
+    pos = 0
+    for length in lengths:
+        strings.append(text[pos:pos + length])
+        pos += length
+    return strings
+
+
+def _decode_tree(tree_ints: List[int], strings: Sequence[str]) -> Node:
+    root_node: Optional[Node] = None
+    # [node, number of children not decoded yet] for each node on the path to the current node
+    parents: List[List[Any]] = []
+    pos = 0
+    while pos < len(tree_ints):
+        key_index, child_count, cluster_id_count = tree_ints[pos:pos + 3]
+        pos += 3
+        node = Node()
+        node.cluster_ids = tree_ints[pos:pos + cluster_id_count]
+        pos += cluster_id_count
+        if parents:
+            parent = parents[-1]
+            parent[0].key_to_child_node[strings[key_index]] = node
+            parent[1] -= 1
+            if parent[1] == 0:
+                parents.pop()
+        else:
+            root_node = node
+        if child_count > 0:
+            parents.append([node, child_count])
+    if root_node is None:
+        raise ValueError("Binary snapshot has no prefix tree")
+    return root_node
+
+
+def restore_binary_state(drain: DrainBase, state: bytes,
+                         codecs: Iterable[CompressionCodec] = DEFAULT_CODECS) -> None:
+    """
+    Replace the clusters and prefix tree of a model with a snapshot created by `dump_binary_state()`.
+    The clusters are kept in an LRU cache if the model has `max_clusters`, regardless of the model the snapshot
+    was created from.
+
+    :param drain: the model
+    :param state: the snapshot
+    :param codecs: the codecs the snapshot may be compressed with
+    """
+    magic, version, flags = _HEADER.unpack_from(state)
+    if magic != MAGIC:
+        raise ValueError("Not a binary snapshot")
+    if version > VERSION:
+        raise ValueError(f"Binary snapshot version {version} is not supported, max supported version is {VERSION}")
+
+    body = state[_HEADER.size:]
+    codec_id = flags & _FLAGS_CODEC_ID
+    if codec_id != 0:
+        codec = next((codec for codec in codecs if codec.codec_id == codec_id), None)
+        if codec is None:
+            raise ValueError(f"Binary snapshot is compressed with an unknown codec {codec_id}")
+        body = codec.decompress(body)
+    meta_data, string_lengths_data, strings_data, clusters_data, lru_order_data, tree_data = _read_sections(body)
+
+    clusters_counter, string_count = _bytes_to_ints(meta_data)
+    strings = _decode_strings(_bytes_to_ints(string_lengths_data), strings_data)
+    if len(strings) != string_count:
+        raise ValueError("Binary snapshot is corrupt")
+
+    id_to_cluster: MutableMapping[int, Optional[LogCluster]] = \
+        {} if drain.max_clusters is None else LogClusterCache(maxsize=drain.max_clusters)
+    cluster_ints = _bytes_to_ints(clusters_data)
+    pos = 0
+    while pos < len(cluster_ints):
+        cluster_id, size, token_count = cluster_ints[pos:pos + 3]
+        pos += 3
+        cluster = LogCluster([strings[index] for index in cluster_ints[pos:pos + token_count]], cluster_id)
+        cluster.size = size
+        pos += token_count
+        id_to_cluster[cluster_id] = cluster
+    if isinstance(id_to_cluster, LogClusterCache):
+        for cluster_id in _bytes_to_ints(lru_order_data):
+            if cluster_id in id_to_cluster:
+                # noinspection PyStatementEffect
+                id_to_cluster[cluster_id]
+
+    root_node = _decode_tree(_bytes_to_ints(tree_data), strings)
+    drain.restore_state(id_to_cluster, clusters_counter, root_node)
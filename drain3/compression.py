@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: MIT
+
+import base64
+import bz2
+import lzma
+import zlib
+from typing import Callable, Iterable, List, Optional
+
+
+class CompressionCodec:
+    def __init__(self,
+                 name: str,
+                 codec_id: int,
+                 magic: bytes,
+                 compress: Callable[[bytes, Optional[int]], bytes],
+                 decompress: Callable[[bytes], bytes]) -> None:
+        """
+        A compression algorithm for snapshots.
+
+        :param name: the name used in `[SNAPSHOT]/compression`
+        :param codec_id: identifies the codec in binary snapshots, between 1 and 7 (0 means no compression)
+        :param magic: the bytes every compressed snapshot starts with, to identify the codec when loading
+        :param compress: compresses data with a level, or the default level of the codec if None
+        :param decompress: decompresses data
+        """
+        self.name = name
+        self.codec_id = codec_id
+        self.magic = magic
+        self.compress = compress
+        self.decompress = decompress
+
+
+ZLIB_CODEC = CompressionCodec("zlib", 1, b"\x78",
+                              lambda data, level: zlib.compress(data, -1 if level is None else level),
+                              zlib.decompress)
+LZMA_CODEC = CompressionCodec("lzma", 2, b"\xfd7zXZ\x00",
+                              lambda data, level: lzma.compress(data, preset=level),
+                              lzma.decompress)
+BZ2_CODEC = CompressionCodec("bz2", 3, b"BZh",
+                             lambda data, level: bz2.compress(data, 9 if level is None else level),
+                             bz2.decompress)
+
+DEFAULT_CODECS: List[CompressionCodec] = [ZLIB_CODEC, LZMA_CODEC, BZ2_CODEC]
+
+
+def decompress_snapshot(data: bytes, codecs: Iterable[CompressionCodec]) -> bytes:
+    """
+    Decompress data compressed by any of the codecs, and optionally base64 encoded.
+    The codec is identified by the magic bytes the compressed data starts with.
+    """
+    codecs = list(codecs)
+    for codec in codecs:
+        if data.startswith(codec.magic):
+            return codec.decompress(data)
+
+    # the first byte of base64 encoded data is never the first byte of the magic of the built-in codecs
+    decoded_data = base64.b64decode(data)
+    for codec in codecs:
+        if decoded_data.startswith(codec.magic):
+            return codec.decompress(decoded_data)
+    raise ValueError("Snapshot is compressed with an unknown codec")
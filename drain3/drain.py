@@ -2,9 +2,12 @@
 # This file implements the Drain algorithm for log parsing.
 # Based on https://github.com/logpai/logparser/blob/master/logparser/Drain/Drain.py by LogPAI team
 
+import operator
+import sys
 from abc import ABC, abstractmethod
-from typing import cast, Collection, IO, Iterable, MutableMapping, MutableSequence, Optional, Sequence, Tuple, \
-    TYPE_CHECKING, TypeVar, Union
+from collections import OrderedDict
+from typing import Any, cast, Collection, Dict, IO, Iterable, Iterator, List, MutableMapping, MutableSequence, \
+    Optional, Sequence, Set, Tuple, TYPE_CHECKING, TypeVar, Union, ValuesView
 
 from cachetools import LRUCache, Cache
 
@@ -22,6 +25,11 @@ class LogCluster:
     def get_template(self) -> str:
         return ' '.join(self.log_template_tokens)
 
+    def copy(self) -> "LogCluster":
+        cluster = LogCluster(self.log_template_tokens, self.cluster_id)
+        cluster.size = self.size
+        return cluster
+
     def __str__(self) -> str:
         return f"ID={str(self.cluster_id).ljust(5)} : size={str(self.size).ljust(10)}: {self.get_template()}"
 
@@ -50,6 +58,46 @@ class LogClusterCache(_LRUCache):
         """
         return Cache.__getitem__(self, key)
 
+    def values(self) -> ValuesView[Optional[LogCluster]]:
+        """
+        Returns a view of the values which does not update the cache eviction algorithm when iterated.
+        """
+        return _LogClusterCacheValuesView(self)
+
+    def get_lru_order(self) -> List[int]:
+        """
+        Returns the keys, least recently used first.
+        """
+        # the order is internal to cachetools, fall back to the order of insertion if it is not available
+        order = getattr(self, "_LRUCache__order", None)
+        return list(order if order is not None else self)
+
+    def copy(self) -> "LogClusterCache":
+        """
+        Returns a copy with copies of the clusters, in the same order of insertion and of use.
+        """
+        cache = LogClusterCache(maxsize=self.maxsize)
+        for key in self:
+            cluster = self.get(key)
+            if cluster is not None:
+                cache[key] = cluster.copy()
+        for key in self.get_lru_order():
+            # noinspection PyStatementEffect
+            cache[key]
+        return cache
+
+
+class _LogClusterCacheValuesView(ValuesView[Optional[LogCluster]]):
+
+    def __init__(self, cache: LogClusterCache) -> None:
+        super().__init__(cache)
+        self.cache = cache
+
+    def __iter__(self) -> Iterator[Optional[LogCluster]]:
+        cache = self.cache
+        for key in cache:
+            yield cache.get(key)
+
 
 class Node:
     __slots__ = ["key_to_child_node", "cluster_ids"]
@@ -60,6 +108,13 @@ class Node:
 
 
 class DrainBase(ABC):
+    # attributes which are derived from the model state at runtime, and are not included in snapshots
+    transient_attributes: Sequence[str] = ("repeat_cache", "first_layer_generations",
+                                           "repeat_cache_hits", "repeat_cache_misses",
+                                           "template_change_count", "evicted_cluster_count",
+                                           "first_layer_cluster_ids", "cluster_id_to_first_layer_key",
+                                           "changed_cluster_ids", "removed_cluster_ids", "changed_node_paths")
+
     def __init__(self,
                  depth: int = 4,
                  sim_th: float = 0.4,
@@ -68,7 +123,10 @@ class DrainBase(ABC):
                  extra_delimiters: Sequence[str] = (),
                  profiler: Profiler = NullProfiler(),
                  param_str: str = "<*>",
-                 parametrize_numeric_tokens: bool = True) -> None:
+                 parametrize_numeric_tokens: bool = True,
+                 intern_tokens: bool = False,
+                 repeat_cache_size: int = 0,
+                 track_changes: bool = False) -> None:
         """
         Create a new Drain instance.
 
@@ -86,6 +144,12 @@ class DrainBase(ABC):
         :param extra_delimiters: delimiters to apply when splitting log message into words (in addition to whitespace).
         :param parametrize_numeric_tokens: whether to treat tokens that contains at least one digit
             as template parameters.
+        :param intern_tokens: whether to intern template tokens, so that each distinct token is stored once
+            and shared by all clusters and prefix tree nodes, instead of once per cluster.
+        :param repeat_cache_size: max number of previously seen log messages to remember, so that exact
+            repeats of a message are added to their cluster without searching the prefix tree (disabled by default).
+        :param track_changes: whether to keep track of the clusters and prefix tree nodes that changed,
+            to be collected with `pop_changes()` for delta snapshots.
         """
         if depth < 3:
             raise ValueError("depth argument must be at least 3")
@@ -98,13 +162,212 @@ class DrainBase(ABC):
         self.profiler = profiler
         self.extra_delimiters = extra_delimiters
         self.max_clusters = max_clusters
-        self.param_str = param_str
+        self.intern_tokens = intern_tokens
+        self.param_str = sys.intern(param_str) if intern_tokens else param_str
         self.parametrize_numeric_tokens = parametrize_numeric_tokens
+        self.repeat_cache_size = repeat_cache_size
+        self.track_changes = track_changes
 
         self.id_to_cluster: MutableMapping[int, Optional[LogCluster]] = \
             {} if max_clusters is None else LogClusterCache(maxsize=max_clusters)
         self.clusters_counter = 0
 
+        self.reset_transient_state()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        for name in self.transient_attributes:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.reset_transient_state()
+
+    def reset_transient_state(self) -> None:
+        """
+        Reset all state that is derived from the clusters and the prefix tree at runtime.
+        """
+        # masked log message -> (cluster_id, first layer key, first layer generation) for exact repeats
+        self.repeat_cache: "OrderedDict[str, Tuple[int, str, int]]" = OrderedDict()
+        # first layer key -> generation, which changes whenever a cluster under that key is created or changed
+        self.first_layer_generations: Dict[str, int] = {}
+        self.repeat_cache_hits = 0
+        self.repeat_cache_misses = 0
+        # number of times the template of a cluster changed, and of clusters evicted by max_clusters
+        self.template_change_count = 0
+        self.evicted_cluster_count = 0
+        # first layer key -> IDs of the clusters below it (values are unused), in ascending ID order
+        self.first_layer_cluster_ids: Dict[str, Dict[int, None]] = {}
+        # cluster ID -> its first layer key, to remove evicted clusters from first_layer_cluster_ids
+        self.cluster_id_to_first_layer_key: Dict[int, str] = {}
+        self.index_first_layer_cluster_ids()
+        self.reset_changes()
+
+    def reset_changes(self) -> None:
+        """
+        Forget the changes tracked so far, e.g. after saving a full snapshot.
+        """
+        # IDs of clusters which were created or added to (values are unused), least recently used first
+        self.changed_cluster_ids: Dict[int, None] = {}
+        # IDs of clusters which were evicted
+        self.removed_cluster_ids: Set[int] = set()
+        # keys of the prefix tree nodes from the root to each node whose cluster IDs changed (values are unused),
+        # in the order the nodes were first changed, so that new nodes are added in the same order
+        self.changed_node_paths: Dict[Tuple[str, ...], None] = {}
+
+    def copy_for_snapshot(self) -> "DrainBase":
+        """
+        Return a copy of the model for creating a snapshot while this model keeps changing, e.g. in another thread.
+        Only the clusters and prefix tree nodes are copied, which is much faster than creating the snapshot.
+        The copy has no transient state and no profiler, and is not meant to be used for anything but creating the
+        snapshot.
+        """
+        id_to_cluster = self.id_to_cluster
+        id_to_cluster_copy: MutableMapping[int, Optional[LogCluster]]
+        if isinstance(id_to_cluster, LogClusterCache):
+            id_to_cluster_copy = id_to_cluster.copy()
+        else:
+            id_to_cluster_copy = {cluster_id: cluster.copy() for cluster_id, cluster in id_to_cluster.items()
+                                  if cluster is not None}
+
+        def copy_node(node: Node) -> Node:
+            node_copy = Node()
+            # the cluster IDs of a node are replaced rather than changed, so they can be shared
+            node_copy.cluster_ids = node.cluster_ids
+            node_copy.key_to_child_node = {key: copy_node(child_node)
+                                           for key, child_node in node.key_to_child_node.items()}
+            return node_copy
+
+        drain: DrainBase = object.__new__(type(self))
+        drain.__dict__.update(self.__getstate__())
+        drain.id_to_cluster = id_to_cluster_copy
+        drain.root_node = copy_node(self.root_node)
+        # the profiler keeps changing while the copy is saved
+        drain.profiler = NullProfiler()
+        return drain
+
+    def mark_cluster_changed(self, cluster_id: int) -> None:
+        changed_cluster_ids = self.changed_cluster_ids
+        # move to the end, to keep the order of the LRU cache
+        changed_cluster_ids.pop(cluster_id, None)
+        changed_cluster_ids[cluster_id] = None
+
+    def pop_changes(self) -> Dict[str, Any]:
+        """
+        Return the changes since the model was restored or `pop_changes()` or `reset_changes()` was last called,
+        and start tracking changes anew. Requires `track_changes`.
+
+        :return: a dictionary of JSON serializable values, to be applied with `apply_changes()`.
+        """
+        clusters: List[Any] = []
+        for cluster_id in self.changed_cluster_ids:
+            cluster = self.id_to_cluster.get(cluster_id)
+            if cluster is not None:
+                clusters.append([cluster_id, list(cluster.log_template_tokens), cluster.size])
+        nodes: List[Any] = []
+        for path in self.changed_node_paths:
+            node = self.root_node
+            for key in path:
+                node = node.key_to_child_node[key]
+            nodes.append([list(path), list(node.cluster_ids)])
+        changes = {
+            "clusters_counter": self.clusters_counter,
+            "removed_cluster_ids": sorted(self.removed_cluster_ids),
+            "clusters": clusters,
+            "nodes": nodes,
+        }
+        self.reset_changes()
+        return changes
+
+    def get_all_changes(self) -> Dict[str, Any]:
+        """
+        Return all clusters and prefix tree nodes in the format of `pop_changes()`, as changes that restore the model
+        when applied to an empty model. Tracked changes are not affected.
+        """
+        id_to_cluster = self.id_to_cluster
+        cluster_ids = id_to_cluster.get_lru_order() if isinstance(id_to_cluster, LogClusterCache) else id_to_cluster
+        clusters: List[Any] = []
+        for cluster_id in cluster_ids:
+            cluster = id_to_cluster.get(cluster_id)
+            if cluster is not None:
+                clusters.append([cluster_id, list(cluster.log_template_tokens), cluster.size])
+        nodes: List[Any] = []
+        # in pre-order, so that nodes are added in the same order
+        path_nodes: List[Tuple[List[str], Node]] = [([], self.root_node)]
+        while path_nodes:
+            path, node = path_nodes.pop()
+            nodes.append([path, list(node.cluster_ids)])
+            for key, child_node in reversed(list(node.key_to_child_node.items())):
+                path_nodes.append((path + [key], child_node))
+        return {
+            "clusters_counter": self.clusters_counter,
+            "removed_cluster_ids": [],
+            "clusters": clusters,
+            "nodes": nodes,
+        }
+
+    def apply_changes(self, changes_list: Iterable[Dict[str, Any]]) -> None:
+        """
+        Apply changes returned by `pop_changes()`, in order, to the model they were collected from, as it was
+        before they were made.
+        """
+        for changes in changes_list:
+            self.clusters_counter = changes["clusters_counter"]
+            for cluster_id in changes["removed_cluster_ids"]:
+                self.id_to_cluster.pop(cluster_id, None)
+            # add new clusters in the order they were created, then touch them in the order they were last used
+            for cluster_id, log_template_tokens, size in sorted(changes["clusters"]):
+                cluster = LogCluster(log_template_tokens, cluster_id)
+                cluster.size = size
+                self.id_to_cluster[cluster_id] = cluster
+            for cluster_id, _, _ in changes["clusters"]:
+                # noinspection PyStatementEffect
+                self.id_to_cluster[cluster_id]
+            for path, cluster_ids in changes["nodes"]:
+                node = self.root_node
+                for key in path:
+                    child_node = node.key_to_child_node.get(key)
+                    if child_node is None:
+                        child_node = Node()
+                        node.key_to_child_node[key] = child_node
+                    node = child_node
+                node.cluster_ids = cluster_ids
+        self.reset_transient_state()
+        if self.intern_tokens:
+            self.intern_state()
+
+    def index_first_layer_cluster_ids(self) -> None:
+        """
+        Index the IDs of the clusters below each first layer node of the prefix tree.
+        """
+
+        def append_clusters_recursive(node: Node, id_list_to_fill: MutableSequence[int]) -> None:
+            id_list_to_fill.extend(node.cluster_ids)
+            for child_node in node.key_to_child_node.values():
+                append_clusters_recursive(child_node, id_list_to_fill)
+
+        for key, first_layer_node in self.root_node.key_to_child_node.items():
+            cluster_ids: MutableSequence[int] = []
+            append_clusters_recursive(first_layer_node, cluster_ids)
+            # leaf nodes may still hold IDs of evicted clusters
+            cluster_ids = sorted(set(cluster_id for cluster_id in cluster_ids if cluster_id in self.id_to_cluster))
+            for cluster_id in cluster_ids:
+                self.add_first_layer_cluster_id(key, cluster_id)
+
+    def add_first_layer_cluster_id(self, first_layer_key: str, cluster_id: int) -> None:
+        self.first_layer_cluster_ids.setdefault(first_layer_key, {})[cluster_id] = None
+        self.cluster_id_to_first_layer_key[cluster_id] = first_layer_key
+
+    def remove_first_layer_cluster_id(self, cluster_id: int) -> None:
+        first_layer_key = self.cluster_id_to_first_layer_key.pop(cluster_id, None)
+        if first_layer_key is None:
+            return
+        cluster_ids = self.first_layer_cluster_ids[first_layer_key]
+        del cluster_ids[cluster_id]
+        if not cluster_ids:
+            del self.first_layer_cluster_ids[first_layer_key]
+
     @property
     def clusters(self) -> Collection[LogCluster]:
         return cast(Collection[LogCluster], self.id_to_cluster.values())
@@ -131,6 +394,7 @@ class DrainBase(ABC):
         max_sim: Union[int, float] = -1
         max_param_count = -1
         max_cluster = None
+        full_sim_max_param_count = self.get_full_sim_max_param_count(tokens, include_params)
 
         for cluster_id in cluster_ids:
             # Try to retrieve cluster from cache with bypassing eviction
@@ -138,17 +402,50 @@ class DrainBase(ABC):
             cluster = self.id_to_cluster.get(cluster_id)
             if cluster is None:
                 continue
-            cur_sim, param_count = self.get_seq_distance(cluster.log_template_tokens, tokens, include_params)
+            template_tokens = cluster.log_template_tokens
+            # after a full similarity match, only a match with more parameters can win
+            if max_sim >= 1.0 and template_tokens.count(self.param_str) <= max_param_count:
+                continue
+            # a cluster below both sim_th and the best similarity so far can not change the result
+            min_sim = max_sim if max_sim > sim_th else sim_th
+            seq_distance = self.get_seq_distance_bounded(template_tokens, tokens, include_params, min_sim)
+            if seq_distance is None:
+                continue
+            cur_sim, param_count = seq_distance
             if cur_sim > max_sim or (cur_sim == max_sim and param_count > max_param_count):
                 max_sim = cur_sim
                 max_param_count = param_count
                 max_cluster = cluster
+                if max_sim >= 1.0 and full_sim_max_param_count is not None \
+                        and max_param_count >= full_sim_max_param_count:
+                    break
 
         if max_sim >= sim_th:
             match_cluster = max_cluster
 
         return match_cluster
 
+    def get_seq_distance_bounded(self,
+                                 seq1: Sequence[str],
+                                 seq2: Sequence[str],
+                                 include_params: bool,
+                                 min_sim: float) -> Optional[Tuple[float, int]]:
+        """
+        Same as `get_seq_distance()`, but may stop early and return None once the similarity
+        is known to be below min_sim.
+        """
+        sim, param_count = self.get_seq_distance(seq1, seq2, include_params)
+        if sim < min_sim:
+            return None
+        return sim, param_count
+
+    def get_full_sim_max_param_count(self, tokens: Sequence[str], include_params: bool) -> Optional[int]:
+        """
+        Return the max parameter count of a template with a similarity of 1.0 to tokens,
+        or None if it is not known. Used to stop searching once a match can not be improved on.
+        """
+        return None
+
     def print_tree(self, file: Optional[IO[str]] = None, max_clusters: int = 5) -> None:
         self.print_node("root", self.root_node, 0, file, max_clusters)
 
@@ -186,6 +483,20 @@ class DrainBase(ABC):
         return content_tokens
 
     def add_log_message(self, content: str) -> Tuple[LogCluster, str]:
+        if self.repeat_cache_size > 0:
+            repeated_cluster = self.get_repeated_cluster(content)
+            if repeated_cluster is not None:
+                if self.profiler:
+                    self.profiler.start_section("repeat_cache_hit")
+                repeated_cluster.size += 1
+                # noinspection PyStatementEffect
+                self.id_to_cluster[repeated_cluster.cluster_id]
+                if self.track_changes:
+                    self.mark_cluster_changed(repeated_cluster.cluster_id)
+                if self.profiler:
+                    self.profiler.end_section()
+                return repeated_cluster, "none"
+
         content_tokens = self.get_content_as_tokens(content)
 
         if self.profiler:
@@ -198,33 +509,188 @@ class DrainBase(ABC):
         if match_cluster is None:
             if self.profiler:
                 self.profiler.start_section("create_cluster")
-            self.clusters_counter += 1
-            cluster_id = self.clusters_counter
-            match_cluster = LogCluster(content_tokens, cluster_id)
-            self.id_to_cluster[cluster_id] = match_cluster
-            self.add_seq_to_prefix_tree(self.root_node, match_cluster)
+            match_cluster = self.create_cluster(content_tokens)
             update_type = "cluster_created"
 
         # Add the new log message to the existing cluster
         else:
             if self.profiler:
                 self.profiler.start_section("cluster_exist")
-            new_template_tokens = self.create_template(content_tokens, match_cluster.log_template_tokens)
-            if tuple(new_template_tokens) == match_cluster.log_template_tokens:
-                update_type = "none"
-            else:
-                match_cluster.log_template_tokens = tuple(new_template_tokens)
-                update_type = "cluster_template_changed"
-            match_cluster.size += 1
-            # Touch cluster to update its state in the cache.
-            # noinspection PyStatementEffect
-            self.id_to_cluster[match_cluster.cluster_id]
+            update_type = self.update_cluster(match_cluster, content_tokens)
+            if update_type == "none" and self.repeat_cache_size > 0:
+                self.add_repeated_cluster(content, content_tokens, match_cluster)
 
         if self.profiler:
             self.profiler.end_section()
 
         return match_cluster, update_type
 
+    def add_log_messages(self, contents: Iterable[str]) -> List[Tuple[int, str]]:
+        """
+        Add a batch of log messages to the model.
+
+        Equivalent to calling `add_log_message()` for each message in order, but runs in a single loop
+        without per-message profiling and without keeping a reference to the matched clusters.
+
+        :param contents: log messages to add, as a list or any other iterable.
+        :return: a (cluster_id, change_type) tuple for each message, in input order.
+        """
+        results: List[Tuple[int, str]] = []
+        append_result = results.append
+        root_node = self.root_node
+        sim_th = self.sim_th
+        use_repeat_cache = self.repeat_cache_size > 0
+        for content in contents:
+            if use_repeat_cache:
+                repeated_cluster = self.get_repeated_cluster(content)
+                if repeated_cluster is not None:
+                    repeated_cluster.size += 1
+                    # noinspection PyStatementEffect
+                    self.id_to_cluster[repeated_cluster.cluster_id]
+                    if self.track_changes:
+                        self.mark_cluster_changed(repeated_cluster.cluster_id)
+                    append_result((repeated_cluster.cluster_id, "none"))
+                    continue
+
+            content_tokens = self.get_content_as_tokens(content)
+            match_cluster = self.tree_search(root_node, content_tokens, sim_th, False)
+            if match_cluster is None:
+                match_cluster = self.create_cluster(content_tokens)
+                update_type = "cluster_created"
+            else:
+                update_type = self.update_cluster(match_cluster, content_tokens)
+                if update_type == "none" and use_repeat_cache:
+                    self.add_repeated_cluster(content, content_tokens, match_cluster)
+            append_result((match_cluster.cluster_id, update_type))
+        return results
+
+    def get_repeated_cluster(self, content: str) -> Optional[LogCluster]:
+        """
+        Look up a log message in the repeat cache.
+
+        :return: the cluster the same message was last added to, provided that no cluster it competes with
+            was created or changed since, or None.
+        """
+        entry = self.repeat_cache.get(content)
+        if entry is not None:
+            cluster_id, first_layer_key, generation = entry
+            if self.first_layer_generations.get(first_layer_key, 0) == generation:
+                cluster = self.id_to_cluster.get(cluster_id)
+                if cluster is not None:
+                    self.repeat_cache.move_to_end(content)
+                    self.repeat_cache_hits += 1
+                    return cluster
+            # cluster was evicted, or its template may no longer be the best match
+            del self.repeat_cache[content]
+        self.repeat_cache_misses += 1
+        return None
+
+    def add_repeated_cluster(self, content: str, content_tokens: Sequence[str], cluster: LogCluster) -> None:
+        """
+        Remember that a log message was added to a cluster without changing it.
+        """
+        first_layer_key = self.get_first_layer_key(content_tokens)
+        generation = self.first_layer_generations.get(first_layer_key, 0)
+        repeat_cache = self.repeat_cache
+        repeat_cache[content] = (cluster.cluster_id, first_layer_key, generation)
+        if len(repeat_cache) > self.repeat_cache_size:
+            repeat_cache.popitem(last=False)
+
+    def invalidate_repeated_clusters(self, tokens: Sequence[str]) -> None:
+        """
+        Invalidate repeat cache entries that may be affected by a change in the clusters matching tokens.
+        """
+        first_layer_key = self.get_first_layer_key(tokens)
+        self.first_layer_generations[first_layer_key] = self.first_layer_generations.get(first_layer_key, 0) + 1
+
+    def get_first_layer_key(self, tokens: Sequence[str]) -> str:
+        """
+        Return the key of the first layer prefix tree node below which clusters for tokens are stored.
+        """
+        return str(len(tokens))
+
+    def create_cluster(self, content_tokens: Sequence[str]) -> LogCluster:
+        """
+        Create a new cluster for a log message that did not match any existing cluster,
+        and add it to the prefix tree.
+        """
+        self.clusters_counter += 1
+        cluster_id = self.clusters_counter
+        if self.intern_tokens:
+            content_tokens = [sys.intern(token) for token in content_tokens]
+        cluster = LogCluster(content_tokens, cluster_id)
+        # evict the least recently used cluster here rather than in the cache, to remove it from the index
+        if isinstance(self.id_to_cluster, LogClusterCache) and len(self.id_to_cluster) >= self.id_to_cluster.maxsize:
+            evicted_cluster_id, _ = self.id_to_cluster.popitem()
+            self.evicted_cluster_count += 1
+            self.remove_first_layer_cluster_id(evicted_cluster_id)
+            if self.track_changes:
+                self.changed_cluster_ids.pop(evicted_cluster_id, None)
+                self.removed_cluster_ids.add(evicted_cluster_id)
+        self.id_to_cluster[cluster_id] = cluster
+        self.add_seq_to_prefix_tree(self.root_node, cluster)
+        self.add_first_layer_cluster_id(self.get_first_layer_key(content_tokens), cluster_id)
+        if self.track_changes:
+            self.changed_cluster_ids[cluster_id] = None
+            self.changed_node_paths[self.get_prefix_tree_path(content_tokens)] = None
+        if self.repeat_cache_size > 0:
+            self.invalidate_repeated_clusters(content_tokens)
+        return cluster
+
+    def update_cluster(self, cluster: LogCluster, content_tokens: Sequence[str]) -> str:
+        """
+        Add a log message to an existing cluster, updating its template if required.
+
+        :return: the change type - either "none" or "cluster_template_changed".
+        """
+        new_template_tokens = tuple(self.create_template(content_tokens, cluster.log_template_tokens))
+        if new_template_tokens == cluster.log_template_tokens:
+            update_type = "none"
+        else:
+            if self.intern_tokens:
+                new_template_tokens = tuple(sys.intern(token) for token in new_template_tokens)
+            if self.repeat_cache_size > 0:
+                self.invalidate_repeated_clusters(content_tokens)
+            cluster.log_template_tokens = new_template_tokens
+            self.template_change_count += 1
+            update_type = "cluster_template_changed"
+        cluster.size += 1
+        # Touch cluster to update its state in the cache.
+        # noinspection PyStatementEffect
+        self.id_to_cluster[cluster.cluster_id]
+        if self.track_changes:
+            self.mark_cluster_changed(cluster.cluster_id)
+        return update_type
+
+    def restore_state(self,
+                      id_to_cluster: MutableMapping[int, Optional[LogCluster]],
+                      clusters_counter: int,
+                      root_node: Node) -> None:
+        """
+        Replace the clusters and prefix tree of this model, e.g. with the ones of a loaded snapshot.
+        """
+        self.id_to_cluster = id_to_cluster
+        self.clusters_counter = clusters_counter
+        self.root_node = root_node
+        self.reset_transient_state()
+
+        if self.intern_tokens:
+            self.intern_state()
+
+    def intern_state(self) -> None:
+        """
+        Intern the tokens of all cluster templates and prefix tree keys.
+        """
+        intern = sys.intern
+        for cluster in self.clusters:
+            cluster.log_template_tokens = tuple(intern(token) for token in cluster.log_template_tokens)
+
+        nodes = [self.root_node]
+        while nodes:
+            node = nodes.pop()
+            node.key_to_child_node = {intern(key): child for key, child in node.key_to_child_node.items()}
+            nodes.extend(node.key_to_child_node.values())
+
     def get_total_cluster_size(self) -> int:
         size = 0
         for c in self.id_to_cluster.values():
@@ -234,23 +700,10 @@ class DrainBase(ABC):
     def get_clusters_ids_for_seq_len(self, seq_fir: Union[int, str]) -> Collection[int]:
         """
         seq_fir: int/str - the first token of the sequence
-        Return all clusters with the specified count of tokens
+        Return all clusters with the specified count of tokens, in ascending ID order.
+        The returned collection is a view of an index which changes when clusters are created.
         """
-
-        def append_clusters_recursive(node: Node, id_list_to_fill: MutableSequence[int]) -> None:
-            id_list_to_fill.extend(node.cluster_ids)
-            for child_node in node.key_to_child_node.values():
-                append_clusters_recursive(child_node, id_list_to_fill)
-
-        cur_node = self.root_node.key_to_child_node.get(str(seq_fir))
-
-        # no template with same token count
-        if cur_node is None:
-            return []
-
-        target: MutableSequence[int] = []
-        append_clusters_recursive(cur_node, target)
-        return target
+        return self.first_layer_cluster_ids.get(str(seq_fir), {}).keys()
 
     @abstractmethod
     def tree_search(self,
@@ -264,6 +717,14 @@ class DrainBase(ABC):
     def add_seq_to_prefix_tree(self, root_node: Node, cluster: LogCluster) -> None:
         ...
 
+    @abstractmethod
+    def get_prefix_tree_path(self, tokens: Sequence[str]) -> Tuple[str, ...]:
+        """
+        Return the keys of the prefix tree nodes from the root to the node where `tree_search()` looks for clusters
+        matching tokens, which must exist.
+        """
+        ...
+
     @abstractmethod
     def get_seq_distance(self, seq1: Sequence[str], seq2: Sequence[str], include_params: bool) -> Tuple[float, int]:
         ...
@@ -278,6 +739,35 @@ class DrainBase(ABC):
 
 
 class Drain(DrainBase):
+    def get_backtrack_cluster_ids(self, tokens: Sequence[str]) -> Collection[int]:
+        """
+        Return the clusters with the same token count that can match tokens perfectly (with include_params),
+        in ascending ID order, same as `get_clusters_ids_for_seq_len()`.
+        At every depth, both the child node of the exact token and the wildcard child node are visited.
+        Other child nodes can be skipped: a cluster is only updated with log messages that reach it by a tree search,
+        so its template tokens are the same as the keys in its path, unless the key is the wildcard.
+        """
+        param_str = self.param_str
+        target: MutableSequence[int] = []
+
+        def append_clusters_recursive(node: Node, depth: int) -> None:
+            target.extend(node.cluster_ids)
+            key_to_child_node = node.key_to_child_node
+            if not key_to_child_node:
+                return
+            token = tokens[depth - 1]
+            token_node = key_to_child_node.get(token)
+            if token_node is not None:
+                append_clusters_recursive(token_node, depth + 1)
+            param_node = key_to_child_node.get(param_str)
+            if param_node is not None and param_node is not token_node:
+                append_clusters_recursive(param_node, depth + 1)
+
+        first_layer_node = self.root_node.key_to_child_node.get(str(len(tokens)))
+        if first_layer_node is not None:
+            append_clusters_recursive(first_layer_node, 1)
+        # leaf nodes may hold IDs of evicted clusters, which fast_match() skips
+        return sorted(target)
 
     def tree_search(self,
                     root_node: Node,
@@ -321,6 +811,21 @@ class Drain(DrainBase):
         cluster = self.fast_match(cur_node.cluster_ids, tokens, sim_th, include_params)
         return cluster
 
+    def get_prefix_tree_path(self, tokens: Sequence[str]) -> Tuple[str, ...]:
+        token_count = len(tokens)
+        path = [str(token_count)]
+        cur_node = self.root_node.key_to_child_node[path[0]]
+        # same as the search in tree_search()
+        cur_node_depth = 1
+        for token in tokens:
+            if cur_node_depth >= self.max_node_depth or cur_node_depth == token_count:
+                break
+            key = token if token in cur_node.key_to_child_node else self.param_str
+            path.append(key)
+            cur_node = cur_node.key_to_child_node[key]
+            cur_node_depth += 1
+        return tuple(path)
+
     def add_seq_to_prefix_tree(self, root_node: Node, cluster: LogCluster) -> None:
         token_count = len(cluster.log_template_tokens)
         token_count_str = str(token_count)
@@ -412,6 +917,41 @@ class Drain(DrainBase):
 
         return ret_val, param_count
 
+    def get_seq_distance_bounded(self,
+                                 seq1: Sequence[str],
+                                 seq2: Sequence[str],
+                                 include_params: bool,
+                                 min_sim: float) -> Optional[Tuple[float, int]]:
+        assert len(seq1) == len(seq2)
+
+        token_count = len(seq1)
+
+        # sequences are empty - full match
+        if token_count == 0:
+            return (1.0, 0) if min_sim <= 1.0 else None
+
+        # Counting equal tokens with map() runs in C, which is faster than a per-token loop
+        # even when the loop stops as soon as min_sim can not be reached.
+        param_str = self.param_str
+        sim_tokens = sum(map(operator.eq, seq1, seq2))
+        param_count = seq1.count(param_str)
+        if param_count > 0:
+            # tokens equal to a parameter are counted by include_params only
+            if param_str in seq2:
+                sim_tokens -= sum(1 for token1, token2 in zip(seq1, seq2) if token1 == token2 == param_str)
+            if include_params:
+                sim_tokens += param_count
+
+        ret_val = float(sim_tokens) / token_count
+        if ret_val < min_sim:
+            return None
+
+        return ret_val, param_count
+
+    def get_full_sim_max_param_count(self, tokens: Sequence[str], include_params: bool) -> Optional[int]:
+        # parameters count as similar tokens only when included
+        return len(tokens) if include_params else 0
+
     def create_template(self, seq1: Sequence[str], seq2: Sequence[str]) -> Sequence[str]:
         """
         Loop through two sequences and create a template sequence that
@@ -440,20 +980,18 @@ class Drain(DrainBase):
             more wildcard parameters than necessary;
             (3) "always" is the slowest. It will select the best match among all known clusters, by always evaluating
             all clusters with the same token count, and selecting the cluster with perfect all token match and least
-            count of wildcard matches.
+            count of wildcard matches;
+            (4) "backtrack" gives the same result as "always", but only evaluates the clusters in tree branches
+            which can match the log message perfectly, by following both the exact token and the wildcard child
+            nodes at every depth.
         :return: Matched cluster or None if no match found.
         """
 
-        assert full_search_strategy in ["always", "never", "fallback"]
+        assert full_search_strategy in ["always", "never", "fallback", "backtrack"]
 
         required_sim_th = 1.0
         content_tokens = self.get_content_as_tokens(content)
 
-        # consider for future improvement:
-        # It is possible to implement a recursive tree_search (first try exact token match and fallback to
-        # wildcard match). This will be both accurate and more efficient than the linear full search
-        # also fast match can be optimized when exact match is required by early
-        # quitting on less than exact cluster matches.
         def full_search() -> Optional[LogCluster]:
             all_ids = self.get_clusters_ids_for_seq_len(len(content_tokens))
             cluster = self.fast_match(all_ids, content_tokens, required_sim_th, include_params=True)
@@ -462,6 +1000,10 @@ class Drain(DrainBase):
         if full_search_strategy == "always":
             return full_search()
 
+        if full_search_strategy == "backtrack":
+            candidate_ids = self.get_backtrack_cluster_ids(content_tokens)
+            return self.fast_match(candidate_ids, content_tokens, required_sim_th, include_params=True)
+
         match_cluster = self.tree_search(self.root_node, content_tokens, required_sim_th, include_params=True)
         if match_cluster is not None:
             return match_cluster
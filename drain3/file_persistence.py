@@ -1,21 +1,153 @@
 # SPDX-License-Identifier: MIT
+# The state is saved to a file, and deltas are appended to a journal file next to it.
+#
+# The state file is replaced atomically: the state is written to a temporary file in the same directory, which is then
+# renamed over the state file. The journal is only created once a delta is appended. It starts with a header that
+# identifies the state it belongs to by its length and CRC32, so that a journal left over from an older state, e.g.
+# after a crash right after the state was replaced, is ignored, and replaced before a delta is appended. Each delta
+# record is preceded by its length and CRC32, so that a record that was not completely written is detected, and
+# truncated before a delta is appended.
 
+import mmap
 import os
-import pathlib
-from typing import Optional
+import struct
+import tempfile
+import zlib
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 from drain3.persistence_handler import PersistenceHandler
 
+_JOURNAL_MAGIC = b"D3J\x01"
+# magic, state length, state CRC32
+_JOURNAL_HEADER = struct.Struct(">4sQI")
+# delta length, delta CRC32
+_DELTA_HEADER = struct.Struct(">II")
+
+
+def _fsync_dir(dir_path: str) -> None:
+    # makes a rename durable, which is only possible (and needed) on POSIX
+    if os.name != "posix":
+        return
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 
 class FilePersistence(PersistenceHandler):
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, sync_deltas: int = 1) -> None:
+        """
+        :param file_path: the file to save the state to. Deltas are saved to a journal file with a ".deltas" suffix.
+        :param sync_deltas: fsync the journal every `sync_deltas` deltas, so that up to `sync_deltas - 1` deltas
+            may be lost on a power failure. 0 leaves it to the operating system.
+        """
         self.file_path = file_path
+        self.deltas_file_path = file_path + ".deltas"
+        self.sync_deltas = sync_deltas
+        # the journal header of the state that was last saved or loaded
+        self.journal_header: Optional[bytes] = None
+        # the size of the valid part of the journal of that state, or None if it was not read yet
+        self.journal_size: Optional[int] = None
+        self.unsynced_delta_count = 0
 
     def save_state(self, state: bytes) -> None:
-        pathlib.Path(self.file_path).write_bytes(state)
+        self.write_atomic(self.file_path, state)
+        # a crash before the journal is removed is safe, since the old journal does not match the new state
+        if os.path.exists(self.deltas_file_path):
+            os.remove(self.deltas_file_path)
+        self.journal_header = _JOURNAL_HEADER.pack(_JOURNAL_MAGIC, len(state), zlib.crc32(state))
+        self.journal_size = None
+        self.unsynced_delta_count = 0
+
+    def write_atomic(self, file_path: str, data: bytes) -> None:
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_file_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + ".", suffix=".tmp", dir=dir_path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            os.remove(temp_file_path)
+            raise
+        _fsync_dir(dir_path)
 
     def load_state(self) -> Optional[bytes]:
-        if not os.path.exists(self.file_path):
+        try:
+            with open(self.file_path, "rb") as f:
+                state = f.read()
+        except FileNotFoundError:
             return None
 
-        return pathlib.Path(self.file_path).read_bytes()
+        self.journal_header = _JOURNAL_HEADER.pack(_JOURNAL_MAGIC, len(state), zlib.crc32(state))
+        self.journal_size = None
+        return state
+
+    def supports_deltas(self) -> bool:
+        return True
+
+    def append_delta(self, delta: bytes) -> bool:
+        if self.journal_header is None:
+            # the journal could not be matched to a state
+            return False
+
+        if self.journal_size is None:
+            self.load_deltas()
+        if self.journal_size is None:
+            # there is no journal of this state, or only one of an older state
+            self.write_atomic(self.deltas_file_path, self.journal_header)
+            self.journal_size = len(self.journal_header)
+
+        record = _DELTA_HEADER.pack(len(delta), zlib.crc32(delta)) + delta
+        with open(self.deltas_file_path, "ab") as f:
+            if f.tell() != self.journal_size:
+                # a record that was not completely written, e.g. due to a crash, so that deltas appended after it
+                # would not be loaded
+                f.truncate(self.journal_size)
+            f.write(record)
+            self.journal_size += len(record)
+            self.unsynced_delta_count += 1
+            if 0 < self.sync_deltas <= self.unsynced_delta_count:
+                f.flush()
+                os.fsync(f.fileno())
+                self.unsynced_delta_count = 0
+        return True
+
+    def load_deltas(self) -> Sequence[bytes]:
+        if self.journal_header is None:
+            self.load_state()
+
+        self.journal_size = None
+        try:
+            f = open(self.deltas_file_path, "rb")
+        except FileNotFoundError:
+            return []
+
+        # the journal is only read, so that the state can be loaded without write access. A record that was not
+        # completely written is truncated by the next append_delta().
+        with f:
+            if os.fstat(f.fileno()).st_size < _JOURNAL_HEADER.size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if m[:_JOURNAL_HEADER.size] != self.journal_header:
+                    # the journal of an older state
+                    return []
+                deltas: List[bytes] = []
+                end_pos = _JOURNAL_HEADER.size
+                for delta, end_pos in self.read_deltas(m, end_pos):
+                    deltas.append(delta)
+        self.journal_size = end_pos
+        return deltas
+
+    @staticmethod
+    def read_deltas(m: mmap.mmap, pos: int) -> Iterator[Tuple[bytes, int]]:
+        while pos + _DELTA_HEADER.size <= len(m):
+            length, crc = _DELTA_HEADER.unpack_from(m, pos)
+            start_pos = pos + _DELTA_HEADER.size
+            delta = m[start_pos:start_pos + length]
+            if len(delta) < length or zlib.crc32(delta) != crc:
+                return
+            pos = start_pos + length
+            yield delta, pos
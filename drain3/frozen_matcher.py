@@ -0,0 +1,403 @@
+# SPDX-License-Identifier: MIT
+# This file implements a read-only matcher of log messages to the clusters of a Drain model, which is built once from
+# the model and loaded from a file by any number of processes.
+#
+# The matcher file is a header of the magic bytes and the format version, followed by sections, each preceded by its
+# length in bytes and padded to a multiple of 8 bytes, so that the integer arrays can be used in place in a memory
+# mapped file:
+# - meta: json with the parameter string, the max node depth and the extra delimiters of the model
+# - string offsets, string data: the distinct template tokens and prefix tree keys, sorted by their UTF-8 encoding
+# - child offsets, child keys, child nodes: the children of each prefix tree node, sorted by key, in the CSR format:
+#   the children of node i are at child offsets [i, i + 1). Node 0 is the root.
+# - leaf offsets, leaf clusters: the clusters of each prefix tree node, in the CSR format
+# - cluster IDs, cluster sizes, token offsets, tokens, parameter counts: the clusters, sorted by token count and ID
+# Integer arrays are little endian, 64-bit for offsets, cluster IDs and sizes, and 32-bit otherwise.
+
+import array
+import bisect
+import json
+import mmap
+import struct
+import sys
+from typing import Any, Dict, List, MutableMapping, Optional, Sequence, Tuple, Union
+
+from cachetools import LRUCache
+
+from drain3.drain import Drain, DrainBase, LogCluster, Node
+from drain3.masking import LogMasker
+from drain3.template_miner import ExtractedParameter, TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+MAGIC = b"\x93D3F"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sB3x")
+_SECTION_LENGTH = struct.Struct("<Q")
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+def _to_bytes(type_code: str, ints: Sequence[int]) -> bytes:
+    values = array.array(type_code, ints)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def dump_frozen_matcher(drain: DrainBase) -> bytes:
+    """
+    Create the data of a `FrozenMatcher` from the clusters and prefix tree of a model.
+    Only the `Drain` engine is supported.
+
+    :param drain: the model
+    """
+    if not isinstance(drain, Drain):
+        raise ValueError(f"FrozenMatcher supports the Drain engine only, not {type(drain).__name__}")
+
+    clusters = sorted((cluster for cluster in drain.clusters),
+                      key=lambda cluster: (len(cluster.log_template_tokens), cluster.cluster_id))
+    cluster_id_to_index = {cluster.cluster_id: index for index, cluster in enumerate(clusters)}
+
+    nodes: List[Node] = []
+    pending_nodes = [drain.root_node]
+    strings = {drain.param_str}
+    while pending_nodes:
+        node = pending_nodes.pop()
+        nodes.append(node)
+        strings.update(node.key_to_child_node)
+        pending_nodes.extend(node.key_to_child_node.values())
+    for cluster in clusters:
+        strings.update(cluster.log_template_tokens)
+
+    encoded_strings = sorted(s.encode("utf-8", "surrogatepass") for s in strings)
+    string_to_index = {s.decode("utf-8", "surrogatepass"): index for index, s in enumerate(encoded_strings)}
+    string_offsets = [0]
+    for s in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(s))
+
+    node_to_index = {id(node): index for index, node in enumerate(nodes)}
+    child_offsets = [0]
+    child_keys: List[int] = []
+    child_nodes: List[int] = []
+    leaf_offsets = [0]
+    leaf_clusters: List[int] = []
+    for node in nodes:
+        for key_index, child_node in sorted((string_to_index[key], child_node)
+                                            for key, child_node in node.key_to_child_node.items()):
+            child_keys.append(key_index)
+            child_nodes.append(node_to_index[id(child_node)])
+        child_offsets.append(len(child_keys))
+        # IDs of evicted clusters are skipped, as they are by a search of the model
+        leaf_clusters.extend(cluster_id_to_index[cluster_id] for cluster_id in node.cluster_ids
+                             if cluster_id in cluster_id_to_index)
+        leaf_offsets.append(len(leaf_clusters))
+
+    token_offsets = [0]
+    tokens: List[int] = []
+    for cluster in clusters:
+        tokens.extend(string_to_index[token] for token in cluster.log_template_tokens)
+        token_offsets.append(len(tokens))
+
+    meta = {
+        "param_str": drain.param_str,
+        "max_node_depth": drain.max_node_depth,
+        "extra_delimiters": list(drain.extra_delimiters),
+    }
+    sections = [
+        json.dumps(meta).encode("utf-8"),
+        _to_bytes("q", string_offsets),
+        b"".join(encoded_strings),
+        _to_bytes("q", child_offsets),
+        _to_bytes("i", child_keys),
+        _to_bytes("i", child_nodes),
+        _to_bytes("q", leaf_offsets),
+        _to_bytes("i", leaf_clusters),
+        _to_bytes("q", [cluster.cluster_id for cluster in clusters]),
+        _to_bytes("q", [cluster.size for cluster in clusters]),
+        _to_bytes("q", token_offsets),
+        _to_bytes("i", tokens),
+        _to_bytes("i", [cluster.log_template_tokens.count(drain.param_str) for cluster in clusters]),
+    ]
+    parts = [_HEADER.pack(MAGIC, VERSION)]
+    for section in sections:
+        parts.append(_SECTION_LENGTH.pack(len(section)))
+        parts.append(section)
+        parts.append(b"\0" * (-len(section) % 8))
+    return b"".join(parts)
+
+
+class FrozenMatcher:
+
+    def __init__(self, data: Buffer, config: Optional[TemplateMinerConfig] = None) -> None:
+        """
+        Read-only matcher of log messages to the clusters of a model, with the same results as
+        `TemplateMiner.match()` and `TemplateMiner.extract_parameters()`, which uses the data created by
+        `dump_frozen_matcher()` in place, e.g. in a memory mapped file shared by many processes.
+
+        :param data: the data created by `dump_frozen_matcher()`
+        :param config: the config of the template miner, for masking and parameter extraction
+        """
+        magic, version = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a frozen matcher")
+        if version > VERSION:
+            raise ValueError(f"Frozen matcher version {version} is not supported, max supported version is {VERSION}")
+
+        self.data = data
+        sections: List[Tuple[int, int]] = []
+        pos = _HEADER.size
+        while pos < len(data):
+            length, = _SECTION_LENGTH.unpack_from(data, pos)
+            pos += _SECTION_LENGTH.size
+            sections.append((pos, pos + length))
+            pos += length + (-length % 8)
+
+        meta = json.loads(data[sections[0][0]:sections[0][1]])
+        self.param_str: str = meta["param_str"]
+        self.max_node_depth: int = meta["max_node_depth"]
+        self.extra_delimiters: List[str] = meta["extra_delimiters"]
+        self.string_data_start = sections[2][0]
+
+        type_codes = ["q", "", "q", "i", "i", "q", "i", "q", "q", "q", "i", "i"]
+        arrays = [self.get_array(data, start, end, type_code)
+                  for (start, end), type_code in zip(sections[1:], type_codes) if type_code]
+        self.string_offsets, self.child_offsets, self.child_keys, self.child_nodes, self.leaf_offsets, \
+            self.leaf_clusters, self.cluster_ids, self.cluster_sizes, self.token_offsets, self.tokens, \
+            self.param_counts = arrays
+
+        self.template_miner = TemplateMiner(config=config)
+        self.masker: LogMasker = self.template_miner.masker
+        if self.template_miner.drain.param_str != self.param_str:
+            raise ValueError(f"Frozen matcher was created with parameter string {self.param_str}, "
+                             f"but the config has {self.template_miner.drain.param_str}")
+        self.param_index = self.get_string_index(self.param_str)
+        # token -> string index, or -1 if it is not a string of the matcher
+        self.string_index_cache: MutableMapping[str, int] = LRUCache(maxsize=100000)
+
+    @staticmethod
+    def get_array(data: Buffer, start: int, end: int, type_code: str) -> Sequence[int]:
+        if sys.byteorder == "little":
+            # used in place, without copying
+            view = memoryview(data)[start:end]
+            return view.cast("q") if type_code == "q" else view.cast("i")
+        values = array.array(type_code)
+        values.frombytes(data[start:end])
+        values.byteswap()
+        return values
+
+    @classmethod
+    def load(cls, file_path: str, config: Optional[TemplateMinerConfig] = None) -> "FrozenMatcher":
+        """
+        Load a matcher from a file, which is memory mapped rather than read, so that processes which load the same
+        file share its memory.
+
+        :param file_path: a file with the data created by `dump_frozen_matcher()`
+        :param config: the config of the template miner, for masking and parameter extraction
+        """
+        with open(file_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, config)
+
+    def get_string(self, index: int) -> str:
+        start = self.string_data_start + self.string_offsets[index]
+        end = self.string_data_start + self.string_offsets[index + 1]
+        return self.data[start:end].decode("utf-8", "surrogatepass")
+
+    def get_string_index(self, s: str) -> int:
+        """
+        Return the index of a string in the sorted string table, or -1 if it is not in the table.
+        """
+        encoded = s.encode("utf-8", "surrogatepass")
+        data = self.data
+        string_offsets = self.string_offsets
+        string_data_start = self.string_data_start
+        low = 0
+        high = len(string_offsets) - 1
+        while low < high:
+            mid = (low + high) // 2
+            mid_string = data[string_data_start + string_offsets[mid]:string_data_start + string_offsets[mid + 1]]
+            if mid_string < encoded:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(string_offsets) - 1 and \
+                data[string_data_start + string_offsets[low]:string_data_start + string_offsets[low + 1]] == encoded:
+            return low
+        return -1
+
+    def get_token_indexes(self, tokens: Sequence[str]) -> List[int]:
+        cache = self.string_index_cache
+        indexes = []
+        for token in tokens:
+            index = cache.get(token)
+            if index is None:
+                index = self.get_string_index(token)
+                cache[token] = index
+            indexes.append(index)
+        return indexes
+
+    def get_child_node(self, node: int, key: int) -> int:
+        """
+        Return the index of the child node of a node with a key, or -1 if there is none.
+        """
+        start = self.child_offsets[node]
+        end = self.child_offsets[node + 1]
+        if key < 0 or start == end:
+            return -1
+        pos = bisect.bisect_left(self.child_keys, key, start, end)
+        if pos < end and self.child_keys[pos] == key:
+            return self.child_nodes[pos]
+        return -1
+
+    def get_cluster(self, index: int) -> LogCluster:
+        tokens = self.tokens[self.token_offsets[index]:self.token_offsets[index + 1]]
+        cluster = LogCluster([self.get_string(token) for token in tokens], self.cluster_ids[index])
+        cluster.size = self.cluster_sizes[index]
+        return cluster
+
+    def fast_match(self, cluster_indexes: Sequence[int], token_indexes: Sequence[int]) -> Optional[int]:
+        """
+        Return the index of the first cluster with the most parameters whose template matches the tokens,
+        same as `Drain.fast_match()` with a similarity threshold of 1.0 and included parameters.
+        """
+        param_index = self.param_index
+        token_offsets = self.token_offsets
+        tokens = self.tokens
+        param_counts = self.param_counts
+        max_param_count = -1
+        max_cluster_index = None
+        for cluster_index in cluster_indexes:
+            param_count = param_counts[cluster_index]
+            if param_count <= max_param_count:
+                continue
+            start = token_offsets[cluster_index]
+            if len(token_indexes) != token_offsets[cluster_index + 1] - start:
+                continue
+            for i, token_index in enumerate(token_indexes):
+                template_token_index = tokens[start + i]
+                if template_token_index != token_index and template_token_index != param_index:
+                    break
+            else:
+                max_param_count = param_count
+                max_cluster_index = cluster_index
+                if max_param_count >= len(token_indexes):
+                    break
+        return max_cluster_index
+
+    def get_clusters_for_token_count(self, token_count: int) -> range:
+        """
+        Return the indexes of the clusters with a token count, which are in ascending ID order.
+        """
+        token_offsets = self.token_offsets
+
+        def find_first(min_token_count: int) -> int:
+            low = 0
+            high = len(token_offsets) - 1
+            while low < high:
+                mid = (low + high) // 2
+                if token_offsets[mid + 1] - token_offsets[mid] < min_token_count:
+                    low = mid + 1
+                else:
+                    high = mid
+            return low
+
+        return range(find_first(token_count), find_first(token_count + 1))
+
+    def tree_search(self, token_indexes: Sequence[int], first_layer_key: int) -> Optional[int]:
+        token_count = len(token_indexes)
+        cur_node = self.get_child_node(0, first_layer_key)
+        if cur_node < 0:
+            return None
+
+        leaf_offsets = self.leaf_offsets
+        if token_count == 0:
+            start = leaf_offsets[cur_node]
+            return self.leaf_clusters[start] if start < leaf_offsets[cur_node + 1] else None
+
+        cur_node_depth = 1
+        for token_index in token_indexes:
+            if cur_node_depth >= self.max_node_depth or cur_node_depth == token_count:
+                break
+            child_node = self.get_child_node(cur_node, token_index)
+            if child_node < 0:
+                child_node = self.get_child_node(cur_node, self.param_index)
+            if child_node < 0:
+                return None
+            cur_node = child_node
+            cur_node_depth += 1
+
+        leaf_clusters = self.leaf_clusters[leaf_offsets[cur_node]:leaf_offsets[cur_node + 1]]
+        return self.fast_match(leaf_clusters, token_indexes)
+
+    def get_backtrack_clusters(self, token_indexes: Sequence[int], first_layer_key: int) -> List[int]:
+        leaf_offsets = self.leaf_offsets
+        leaf_clusters = self.leaf_clusters
+        target: List[int] = []
+        first_layer_node = self.get_child_node(0, first_layer_key)
+        if first_layer_node < 0:
+            return target
+        # (node, depth) of the nodes to visit
+        pending_nodes = [(first_layer_node, 1)]
+        while pending_nodes:
+            node, depth = pending_nodes.pop()
+            target.extend(leaf_clusters[leaf_offsets[node]:leaf_offsets[node + 1]])
+            if self.child_offsets[node] == self.child_offsets[node + 1]:
+                continue
+            token_node = self.get_child_node(node, token_indexes[depth - 1])
+            if token_node >= 0:
+                pending_nodes.append((token_node, depth + 1))
+            param_node = self.get_child_node(node, self.param_index)
+            if param_node >= 0 and param_node != token_node:
+                pending_nodes.append((param_node, depth + 1))
+        # clusters are sorted by ID within a token count
+        return sorted(target)
+
+    def get_content_as_tokens(self, content: str) -> Sequence[str]:
+        content = content.strip()
+        for delimiter in self.extra_delimiters:
+            content = content.replace(delimiter, " ")
+        return content.split()
+
+    def match(self, log_message: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
+        """
+        Mask log message and match against the clusters, same as `TemplateMiner.match()`.
+
+        :param log_message: log message to match
+        :param full_search_strategy: when to perform full cluster search, see `TemplateMiner.match()`.
+        :return: A copy of the matched cluster, or None if no match found.
+        """
+        assert full_search_strategy in ["always", "never", "fallback", "backtrack"]
+
+        tokens = self.get_content_as_tokens(self.masker.mask(log_message))
+        token_indexes = self.get_token_indexes(tokens)
+        first_layer_key = self.get_string_index(str(len(tokens)))
+
+        if full_search_strategy == "always":
+            cluster_index = self.fast_match(self.get_clusters_for_token_count(len(tokens)), token_indexes)
+        elif full_search_strategy == "backtrack":
+            cluster_index = self.fast_match(self.get_backtrack_clusters(token_indexes, first_layer_key), token_indexes)
+        else:
+            cluster_index = self.tree_search(token_indexes, first_layer_key)
+            if cluster_index is None and full_search_strategy == "fallback":
+                cluster_index = self.fast_match(self.get_clusters_for_token_count(len(tokens)), token_indexes)
+
+        if cluster_index is None:
+            return None
+        return self.get_cluster(cluster_index)
+
+    def extract_parameters(self,
+                           log_template: str,
+                           log_message: str,
+                           exact_matching: bool = True) -> Optional[Sequence[ExtractedParameter]]:
+        """
+        Extract parameters from a log message according to a template, same as `TemplateMiner.extract_parameters()`.
+        """
+        return self.template_miner.extract_parameters(log_template, log_message, exact_matching)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "clusters": len(self.cluster_ids),
+            "strings": len(self.string_offsets) - 1,
+            "nodes": len(self.child_offsets) - 1,
+            "bytes": len(self.data),
+        }
@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from drain3.simple_profiler import Profiler
+
+# Latencies are counted in buckets of nanoseconds: one per value below 16, then 8 per power of two, so that a bucket is
+# at most 1/8 wider than the latencies it counts
+_SUB_BUCKET_BITS = 3
+_SUB_BUCKET_MASK = (1 << _SUB_BUCKET_BITS) - 1
+_BUCKET_COUNT = (64 - _SUB_BUCKET_BITS) << _SUB_BUCKET_BITS
+
+_perf_counter_ns = time.perf_counter_ns
+
+ProfiledSectionReport = NamedTuple("ProfiledSectionReport", [("section_name", str),
+                                                             ("sample_count", int),
+                                                             ("total_sec", float),
+                                                             ("mean_us", float),
+                                                             ("p50_us", float),
+                                                             ("p90_us", float),
+                                                             ("p99_us", float),
+                                                             ("max_us", float)])
+
+
+def get_bucket_index(latency_ns: int) -> int:
+    shift = latency_ns.bit_length() - _SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return latency_ns
+    return ((shift + 1) << _SUB_BUCKET_BITS) | ((latency_ns >> shift) & _SUB_BUCKET_MASK)
+
+
+def get_bucket_bounds(index: int) -> Tuple[int, int]:
+    """
+    Return the lowest and highest latencies in nanoseconds counted in a bucket.
+    """
+    if index < 2 << _SUB_BUCKET_BITS:
+        return index, index
+    shift = (index >> _SUB_BUCKET_BITS) - 1
+    lowest = ((1 << _SUB_BUCKET_BITS) | (index & _SUB_BUCKET_MASK)) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class HistogramSectionStats:
+    def __init__(self, section_name: str) -> None:
+        self.section_name = section_name
+        self.sample_count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.bucket_counts = [0] * _BUCKET_COUNT
+
+    def add(self, latency_ns: int) -> None:
+        self.sample_count += 1
+        self.total_ns += latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+        self.bucket_counts[get_bucket_index(latency_ns)] += 1
+
+    def get_percentile_ns(self, percentile: float) -> int:
+        """
+        Return the highest latency of the bucket of a percentile of the samples, or 0 if there are no samples.
+
+        :param percentile: between 0 and 100
+        """
+        if self.sample_count == 0:
+            return 0
+        rank = max(1, -int(-percentile * self.sample_count // 100))
+        count = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            count += bucket_count
+            if count >= rank:
+                return min(get_bucket_bounds(index)[1], self.max_ns)
+        return self.max_ns
+
+    def get_report(self) -> ProfiledSectionReport:
+        return ProfiledSectionReport(self.section_name,
+                                     self.sample_count,
+                                     self.total_ns / 1e9,
+                                     self.total_ns / self.sample_count / 1e3 if self.sample_count else 0.0,
+                                     self.get_percentile_ns(50) / 1e3,
+                                     self.get_percentile_ns(90) / 1e3,
+                                     self.get_percentile_ns(99) / 1e3,
+                                     self.max_ns / 1e3)
+
+
+class HistogramProfiler(Profiler):
+    """
+    A profiler which measures sections with `time.perf_counter_ns()` and keeps a histogram of the latencies of each
+    section, to report their percentiles.
+
+    To keep its overhead low enough to stay enabled in production, it can profile only 1 in every `sample_interval`
+    calls of the enclosing section, with all the sections started within it. Sections are ended in the reverse order of
+    starting them. Unlike `SimpleProfiler`, it does not check how sections are started and ended: ending a section that
+    was not started is ignored.
+    """
+
+    def __init__(self,
+                 sample_interval: int = 1,
+                 enclosing_section_name: str = "total",
+                 printer: Callable[[str], Any] = print) -> None:
+        """
+        :param sample_interval: profile 1 in every this number of calls of the enclosing section
+        :param enclosing_section_name: the section which contains the others, which the sampling applies to
+        :param printer: prints the text of reports
+        """
+        if sample_interval < 1:
+            raise ValueError(f"Invalid sample_interval: {sample_interval}, must be at least 1")
+        self.sample_interval = sample_interval
+        self.enclosing_section_name = enclosing_section_name
+        self.printer = printer
+
+        self.section_to_stats: Dict[str, HistogramSectionStats] = {}
+        # the started sections and their start times, the last started section last
+        self.started_sections: List[Tuple[str, int]] = []
+        self.enclosing_call_count = 0
+        self.sampled = True
+        self.last_report_timestamp_sec = time.time()
+
+    def start_section(self, section_name: str) -> None:
+        """Start measuring a section"""
+        if section_name == self.enclosing_section_name:
+            self.sampled = self.enclosing_call_count % self.sample_interval == 0
+            self.enclosing_call_count += 1
+        if self.sampled:
+            self.started_sections.append((section_name, _perf_counter_ns()))
+
+    def end_section(self, section_name: str = "") -> None:
+        """End measuring a section. Leave section name empty to end the last started section."""
+        now_ns = _perf_counter_ns()
+        if not self.sampled:
+            # sections after the enclosing section are profiled, until the next call of it
+            if section_name == self.enclosing_section_name:
+                self.sampled = True
+            return
+        started_sections = self.started_sections
+        if not started_sections:
+            return
+        name, start_ns = started_sections.pop()
+        if section_name and section_name != name:
+            started_sections.append((name, start_ns))
+            # the sections started within it were not ended
+            for index in range(len(started_sections) - 2, -1, -1):
+                if started_sections[index][0] == section_name:
+                    name, start_ns = started_sections[index]
+                    del started_sections[index:]
+                    break
+            else:
+                return
+
+        stats = self.section_to_stats.get(name)
+        if stats is None:
+            stats = HistogramSectionStats(name)
+            self.section_to_stats[name] = stats
+        # same as stats.add(), without the calls
+        latency_ns = now_ns - start_ns
+        stats.sample_count += 1
+        stats.total_ns += latency_ns
+        if latency_ns > stats.max_ns:
+            stats.max_ns = latency_ns
+        shift = latency_ns.bit_length() - _SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            stats.bucket_counts[latency_ns] += 1
+        else:
+            stats.bucket_counts[((shift + 1) << _SUB_BUCKET_BITS) | ((latency_ns >> shift) & _SUB_BUCKET_MASK)] += 1
+
+    def get_report(self) -> List[ProfiledSectionReport]:
+        """
+        Return the statistics of each section, the section with the highest total time first.
+        """
+        sections = sorted(self.section_to_stats.values(), key=lambda it: it.total_ns, reverse=True)
+        return [section.get_report() for section in sections]
+
+    def reset(self) -> None:
+        """Discard the statistics of all sections."""
+        self.section_to_stats.clear()
+
+    def report(self, period_sec: int = 30) -> None:
+        """Print results using [printer] function. By default prints to stdout."""
+        if time.time() - self.last_report_timestamp_sec < period_sec:
+            return
+
+        section_reports = self.get_report()
+        enclosing_total_sec = 0.0
+        for section_report in section_reports:
+            if section_report.section_name == self.enclosing_section_name:
+                enclosing_total_sec = section_report.total_sec
+
+        lines = []
+        for section_report in section_reports:
+            took_sec_text = f"{section_report.total_sec:>8.2f} s"
+            if enclosing_total_sec > 0:
+                took_sec_text += f" ({100 * section_report.total_sec / enclosing_total_sec:>6.2f}%)"
+            lines.append(f"{section_report.section_name: <15}: took {took_sec_text}, "
+                         f"{section_report.sample_count: >10,} samples, "
+                         f"mean {section_report.mean_us:9.2f} us, "
+                         f"p50 {section_report.p50_us:9.2f} us, "
+                         f"p90 {section_report.p90_us:9.2f} us, "
+                         f"p99 {section_report.p99_us:9.2f} us, "
+                         f"max {section_report.max_us:9.2f} us")
+        if self.sample_interval > 1:
+            lines.append(f"(1 in {self.sample_interval} calls of {self.enclosing_section_name} profiled)")
+        self.printer(os.linesep.join(lines))
+
+        self.last_report_timestamp_sec = time.time()
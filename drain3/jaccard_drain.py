@@ -14,6 +14,10 @@ class JaccardDrain(DrainBase):
     Drain that uses Jaccard similarity to match log messages.
     """
 
+    def get_first_layer_key(self, tokens: Sequence[str]) -> str:
+        # at first level, children are grouped by the first token
+        return tokens[0] if tokens else ""
+
     def tree_search(self,
                     root_node: Node,
                     tokens: Sequence[str],
@@ -66,6 +70,21 @@ class JaccardDrain(DrainBase):
 
         return cluster
 
+    def get_prefix_tree_path(self, tokens: Sequence[str]) -> Tuple[str, ...]:
+        token_count = len(tokens)
+        path = [self.get_first_layer_key(tokens)]
+        cur_node = self.root_node.key_to_child_node[path[0]]
+        # same as the search in tree_search()
+        cur_node_depth = 1
+        for token in tokens[1:]:
+            if cur_node_depth >= self.max_node_depth or cur_node_depth == token_count - 1:
+                break
+            key = token if token in cur_node.key_to_child_node else self.param_str
+            path.append(key)
+            cur_node = cur_node.key_to_child_node[key]
+            cur_node_depth += 1
+        return tuple(path)
+
     def add_seq_to_prefix_tree(self, root_node: Node, cluster: LogCluster) -> None:
         token_count = len(cluster.log_template_tokens)
         # Determine if the string is empty
@@ -179,6 +198,46 @@ class JaccardDrain(DrainBase):
 
         return ret_val, param_count
 
+    def get_seq_distance_bounded(self,
+                                 seq1: Sequence[str],
+                                 seq2: Sequence[str],
+                                 include_params: bool,
+                                 min_sim: float) -> Optional[Tuple[float, int]]:
+        # Same as get_seq_distance(), but builds each set once and skips calculating the intersection
+        # when the set sizes alone show that min_sim can not be reached.
+
+        # sequences are empty - full match
+        if len(seq1) == 0:
+            return (1.0, 0) if min_sim <= 1.0 else None
+
+        param_str = self.param_str
+        param_count = seq1.count(param_str)
+
+        if len(seq1) == len(seq2) and param_count > 0:
+            seq2 = [x for i, x in enumerate(seq2) if seq1[i] != param_str]
+
+        if include_params:
+            seq1 = [x for x in seq1 if x != param_str]
+
+        set1 = set(seq1)
+        set2 = set(seq2)
+        set1_len = len(set1)
+        set2_len = len(set2)
+
+        # the intersection is at most the smaller set, and the union is at least the larger set
+        max_ret_val = min(set1_len, set2_len) / max(set1_len, set2_len)
+        max_ret_val = max_ret_val * 1.3 if max_ret_val * 1.3 < 1 else 1
+        if max_ret_val < min_sim:
+            return None
+
+        intersection_len = len(set1 & set2)
+        ret_val = intersection_len / (set1_len + set2_len - intersection_len)
+        ret_val = ret_val * 1.3 if ret_val * 1.3 < 1 else 1
+        if ret_val < min_sim:
+            return None
+
+        return ret_val, param_count
+
     # seq1:tonkens->list seq2:template->tuple
     def create_template(self, seq1: Sequence[str], seq2: Sequence[str]) -> Sequence[str]:
 
@@ -203,7 +262,7 @@ class JaccardDrain(DrainBase):
 
     def match(self, content: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
 
-        assert full_search_strategy in ["always", "never", "fallback"]
+        assert full_search_strategy in ["always", "never", "fallback", "backtrack"]
 
         # Because the template length and data are not equal in length, Jaccard distance required_sim_th != 1
         required_sim_th = 0.8
@@ -214,7 +273,9 @@ class JaccardDrain(DrainBase):
             cluster = self.fast_match(all_ids, content_tokens, required_sim_th, include_params=True)
             return cluster
 
-        if full_search_strategy == "always":
+        # Jaccard similarity does not depend on token positions, so a tree branch can not be ruled out
+        # by its key, and "backtrack" is the same as "always"
+        if full_search_strategy in ("always", "backtrack"):
             return full_search()
 
         match_cluster = self.tree_search(self.root_node, content_tokens, required_sim_th, include_params=True)
@@ -1,25 +1,57 @@
 # SPDX-License-Identifier: MIT
 
-from typing import Any, cast, Optional
+import json
+import uuid
+from typing import Any, cast, Dict, List, Mapping, Optional, Set, Tuple
 
 import kafka  # type: ignore[import]
 
 from drain3.persistence_handler import PersistenceHandler
 
+_META_KEY = b"meta"
+_CLUSTER_KEY_PREFIX = b"cluster:"
+_NODE_KEY_PREFIX = b"node:"
+
 
 class KafkaPersistence(PersistenceHandler):
 
-    def __init__(self, topic: str, snapshot_poll_timeout_sec: int = 60, **kafka_client_options: Any) -> None:
+    def __init__(self, topic: str, snapshot_poll_timeout_sec: int = 60, keyed: bool = False,
+                 flush_on_save: bool = True, **kafka_client_options: Any) -> None:
+        """
+        :param topic: the topic to save the state to
+        :param snapshot_poll_timeout_sec: max time to wait for messages when loading the state
+        :param keyed: whether to save each cluster and prefix tree node as a separate keyed message, so that only
+            the ones that changed are sent on each save, and log compaction of the topic keeps only the latest
+            message of each. Otherwise, the whole state is sent as a single message. The topic must have a single
+            partition, so that the messages of a save are read back in the order they were sent.
+        :param flush_on_save: whether to wait until the messages of a save are sent before returning. Otherwise,
+            they are sent in batches according to the producer options, e.g. `linger_ms`, or by calling `flush()`.
+        :param kafka_client_options: options of the Kafka producer and consumer
+        """
         self.topic = topic
         self.kafka_client_options = kafka_client_options
-        self.producer = kafka.KafkaProducer(**self.kafka_client_options)
+        self.producer = self.create_producer()
         self.snapshot_poll_timeout_sec = snapshot_poll_timeout_sec
+        self.keyed = keyed
+        self.flush_on_save = flush_on_save
+        # in keyed mode, messages of a different generation than the latest meta message are from an older state
+        self.generation: Optional[str] = None
+        # sequence number of the last saved cluster, to restore clusters in the order they were last used
+        self.cluster_seq = 0
+        # in keyed mode, the keys of the clusters and prefix tree nodes in the topic, or None if it was not read yet
+        self.keys: Optional[Set[bytes]] = None
+
+    def create_producer(self) -> Any:
+        return kafka.KafkaProducer(**self.kafka_client_options)
+
+    def create_consumer(self) -> Any:
+        return kafka.KafkaConsumer(**self.kafka_client_options)
 
     def save_state(self, state: bytes) -> None:
         self.producer.send(self.topic, value=state)
 
     def load_state(self) -> Optional[bytes]:
-        consumer = kafka.KafkaConsumer(**self.kafka_client_options)
+        consumer = self.create_consumer()
         partition = kafka.TopicPartition(self.topic, 0)
         consumer.assign([partition])
         end_offsets = consumer.end_offsets([partition])
@@ -37,3 +69,126 @@ class KafkaPersistence(PersistenceHandler):
 
         consumer.close()
         return state
+
+    def flush(self) -> None:
+        """
+        Wait until all saved messages are sent.
+        """
+        self.producer.flush()
+
+    def supports_changes(self) -> bool:
+        return self.keyed
+
+    def save_changes(self, changes: Mapping[str, Any], replace: bool) -> None:
+        if self.keys is None:
+            # the keys of an older state, to remove them when it is replaced
+            self.keys = {key for key in self.load_latest_values() if key != _META_KEY}
+        if self.generation is None or replace:
+            self.generation = uuid.uuid4().hex
+            self.cluster_seq = 0
+            replace = True
+        send = self.producer.send
+        topic = self.topic
+        generation = self.generation
+        keys: Set[bytes] = set()
+        for cluster_id in changes["removed_cluster_ids"]:
+            # a tombstone, which log compaction removes eventually
+            key = _CLUSTER_KEY_PREFIX + str(cluster_id).encode()
+            send(topic, key=key, value=None)
+            self.keys.discard(key)
+        for cluster_id, log_template_tokens, size in changes["clusters"]:
+            self.cluster_seq += 1
+            value = json.dumps([generation, self.cluster_seq, size, log_template_tokens]).encode()
+            key = _CLUSTER_KEY_PREFIX + str(cluster_id).encode()
+            send(topic, key=key, value=value)
+            keys.add(key)
+        for path, cluster_ids in changes["nodes"]:
+            key = _NODE_KEY_PREFIX + json.dumps(path).encode()
+            send(topic, key=key, value=json.dumps([generation, cluster_ids]).encode())
+            keys.add(key)
+        # the meta message is sent last, so that a state is complete once its meta message is loaded
+        meta = {"generation": generation, "clusters_counter": changes["clusters_counter"],
+                "cluster_seq": self.cluster_seq}
+        send(topic, key=_META_KEY, value=json.dumps(meta).encode())
+        if replace:
+            # tombstones for the clusters and nodes of the older state that are not in the new one, after the meta
+            # message, so that the older state stays complete until the new one is
+            for key in self.keys - keys:
+                send(topic, key=key, value=None)
+            self.keys = keys
+        else:
+            self.keys.update(keys)
+        if self.flush_on_save:
+            self.producer.flush()
+
+    def load_changes(self) -> Optional[Dict[str, Any]]:
+        key_to_value = self.load_latest_values()
+        self.keys = {key for key in key_to_value if key != _META_KEY}
+        meta_value = key_to_value.get(_META_KEY)
+        if meta_value is None:
+            return None
+        meta = json.loads(meta_value)
+        self.generation = meta["generation"]
+        self.cluster_seq = meta["cluster_seq"]
+
+        seq_clusters: List[Tuple[int, List[Any]]] = []
+        nodes: List[Any] = []
+        for key, value in key_to_value.items():
+            if key.startswith(_CLUSTER_KEY_PREFIX):
+                generation, seq, size, log_template_tokens = json.loads(value)
+                if generation == self.generation:
+                    cluster_id = int(key[len(_CLUSTER_KEY_PREFIX):])
+                    seq_clusters.append((seq, [cluster_id, log_template_tokens, size]))
+            elif key.startswith(_NODE_KEY_PREFIX):
+                generation, cluster_ids = json.loads(value)
+                if generation == self.generation:
+                    nodes.append([json.loads(key[len(_NODE_KEY_PREFIX):]), cluster_ids])
+        # least recently used first
+        seq_clusters.sort(key=lambda seq_cluster: seq_cluster[0])
+        # parent nodes before their children
+        nodes.sort(key=lambda node: node[0])
+
+        return {
+            "clusters_counter": meta["clusters_counter"],
+            "removed_cluster_ids": [],
+            "clusters": [cluster for _, cluster in seq_clusters],
+            "nodes": nodes,
+        }
+
+    def load_latest_values(self) -> Dict[bytes, bytes]:
+        """
+        Read the topic from the beginning, and return the latest value of each key, as log compaction would.
+
+        :raises ValueError: if the topic has more than one partition, since the order of the messages of different
+            partitions is not known.
+        """
+        consumer = self.create_consumer()
+        partitions = [kafka.TopicPartition(self.topic, partition)
+                      for partition in sorted(consumer.partitions_for_topic(self.topic) or [])]
+        if len(partitions) > 1:
+            consumer.close()
+            raise ValueError(f"Topic {self.topic} has {len(partitions)} partitions, keyed mode requires a single one")
+        consumer.assign(partitions)
+        consumer.seek_to_beginning(*partitions)
+        end_offsets = consumer.end_offsets(partitions)
+        remaining_partitions = {partition for partition in partitions
+                                if consumer.position(partition) < end_offsets[partition]}
+
+        key_to_value: Dict[bytes, bytes] = {}
+        snapshot_poll_timeout_ms = self.snapshot_poll_timeout_sec * 1000
+        while remaining_partitions:
+            records = consumer.poll(snapshot_poll_timeout_ms)
+            if not records:
+                consumer.close()
+                raise RuntimeError("No message received from Kafka during restore even though end_offset>0")
+            for partition, partition_records in records.items():
+                for record in partition_records:
+                    if record.value is None:
+                        key_to_value.pop(record.key, None)
+                    else:
+                        key_to_value[record.key] = record.value
+                if consumer.position(partition) >= end_offsets[partition]:
+                    remaining_partitions.discard(partition)
+
+        consumer.close()
+        return key_to_value
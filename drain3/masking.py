@@ -1,8 +1,22 @@
 # SPDX-License-Identifier: MIT
 
 import abc
+import logging
 import re
-from typing import cast, Collection, Dict, List
+import warnings
+from typing import Any, cast, Collection, Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Pattern, Sequence, \
+    Set, Tuple
+
+with warnings.catch_warnings():
+    # sre_parse is deprecated since Python 3.11, but still the only way to inspect the structure of a pattern
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import sre_constants
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# A mask in masked content: its start and end in the masked content, its name, and the text it replaced
+MaskSpan = NamedTuple("MaskSpan", [("start", int), ("end", int), ("mask_name", str), ("value", str)])
 
 
 class AbstractMaskingInstruction(abc.ABC):
@@ -21,33 +35,555 @@ class AbstractMaskingInstruction(abc.ABC):
         """
         pass
 
+    def may_match(self, content: str) -> bool:
+        """
+        A cheap check whether this instruction might mask anything in content. Returns False only if it would not.
+
+        :param content: text to apply masking to
+        """
+        return True
+
 
 class MaskingInstruction(AbstractMaskingInstruction):
 
-    def __init__(self, pattern: str, mask_with: str):
+    def __init__(self, pattern: str, mask_with: str,
+                 required_literal: Optional[str] = None, required_chars: Optional[str] = None):
+        """
+        Instructions are skipped for content that does not contain `required_literal` or any of `required_chars`. When
+        neither is given, they are derived from the pattern. Pass empty strings to disable skipping.
+
+        :param pattern: regular expression to mask
+        :param mask_with: the name of the mask
+        :param required_literal: text that content must contain for the pattern to match
+        :param required_chars: characters that content must contain at least one of for the pattern to match. Only
+            checked for ASCII content.
+        """
         super().__init__(mask_with)
         self.regex = re.compile(pattern)
+        if required_literal is None and required_chars is None:
+            required_literal, required_chars = _get_prefilter(self.regex)
+        self.required_literal = required_literal or ""
+        self.required_chars = required_chars or ""
 
     @property
     def pattern(self) -> str:
         return self.regex.pattern
 
+    def may_match(self, content: str) -> bool:
+        if self.required_literal not in content:
+            return False
+        if self.required_chars and content.isascii():
+            return any(c in content for c in self.required_chars)
+        return True
+
     def mask(self, content: str, mask_prefix: str, mask_suffix: str) -> str:
         mask = mask_prefix + self.mask_with + mask_suffix
         return self.regex.sub(mask, content)
 
+    def mask_with_spans(self, content: str, mask_prefix: str, mask_suffix: str,
+                        spans: Sequence[MaskSpan]) -> Tuple[str, Optional[List[MaskSpan]]]:
+        """
+        Same as `mask()`, and also return the spans of all masks in the result, or None if a match overlaps only a part
+        of a mask inserted before.
+
+        :param spans: the spans of the masks in content, in order
+        """
+        mask = mask_prefix + self.mask_with + mask_suffix
+        parts = []
+        new_spans = []
+        pos = 0
+        # index of the first span after the last match
+        i = 0
+        # how much the masks inserted so far shifted the content
+        shift = 0
+        for match in self.regex.finditer(content):
+            start, end = match.span()
+            while i < len(spans) and spans[i].end <= start:
+                span = spans[i]
+                new_spans.append(MaskSpan(span.start + shift, span.end + shift, span.mask_name, span.value))
+                i += 1
+            # masks inside the match are replaced by the text they replaced
+            value_parts = []
+            value_pos = start
+            while i < len(spans) and spans[i].start < end:
+                span = spans[i]
+                if span.start < start or span.end > end:
+                    return self.regex.sub(mask, content), None
+                value_parts.append(content[value_pos:span.start])
+                value_parts.append(span.value)
+                value_pos = span.end
+                i += 1
+            value_parts.append(content[value_pos:end])
+            # sub() expands escapes in the replacement
+            replacement = mask if "\\" not in mask else match.expand(mask)
+            new_spans.append(MaskSpan(start + shift, start + shift + len(replacement), self.mask_with,
+                                      "".join(value_parts)))
+            parts.append(content[pos:start])
+            parts.append(replacement)
+            pos = end
+            shift += len(replacement) - (end - start)
+        if not parts:
+            return content, list(spans)
+        new_spans.extend(MaskSpan(span.start + shift, span.end + shift, span.mask_name, span.value)
+                         for span in spans[i:])
+        parts.append(content[pos:])
+        return "".join(parts), new_spans
+
 
 # Alias for `MaskingInstruction`.
 RegexMaskingInstruction = MaskingInstruction
 
 
+_CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: r"\d",
+    sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+    sre_constants.CATEGORY_SPACE: r"\s",
+    sre_constants.CATEGORY_NOT_SPACE: r"\S",
+    sre_constants.CATEGORY_WORD: r"\w",
+    sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+
+_DEFAULT_FLAGS = re.compile("").flags
+
+# larger character sets take longer to check than they save
+_MAX_REQUIRED_CHARS = 32
+
+# anchors that do not examine the characters around the current position
+_STRING_ANCHORS = (sre_constants.AT_BEGINNING_STRING, sre_constants.AT_END_STRING)
+
+
+def _get_nodes(pattern: sre_parse.SubPattern) -> List[Tuple[int, Any]]:
+    return cast(List[Tuple[int, Any]], pattern.data)
+
+
+def _get_subpatterns(op: int, av: Any) -> List[sre_parse.SubPattern]:
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_constants.BRANCH:
+        return list(av[1])
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None)):
+        return [av[2]]
+    if op == getattr(sre_constants, "ATOMIC_GROUP", None):
+        return [av]
+    if op == sre_constants.GROUPREF_EXISTS:
+        return [p for p in av[1:] if p is not None]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+
+def _get_set_chars(items: Any) -> Optional[FrozenSet[str]]:
+    # the ASCII characters matched by a character set, or None if it matches too many to enumerate
+    chars: Set[str] = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op == sre_constants.RANGE:
+            chars.update(chr(c) for c in range(av[0], min(av[1], 127) + 1))
+        elif op == sre_constants.CATEGORY and av == sre_constants.CATEGORY_DIGIT:
+            chars.update("0123456789")
+        else:
+            return None
+    return frozenset(c for c in chars if c.isascii())
+
+
+def _add_requirements(pattern: sre_parse.SubPattern, literals: List[str], char_sets: List[FrozenSet[str]]) -> None:
+    # collects literals and character sets which are part of every match of pattern
+    literal_chars: List[str] = []
+    for op, av in _get_nodes(pattern):
+        if op == sre_constants.LITERAL:
+            literal_chars.append(chr(av))
+            continue
+        if literal_chars:
+            literals.append("".join(literal_chars))
+            literal_chars = []
+        if op == sre_constants.IN:
+            chars = _get_set_chars(av)
+            if chars:
+                char_sets.append(chars)
+        elif op == sre_constants.SUBPATTERN:
+            # scoped flags such as (?i:...) change what the literals match
+            if not any(av[1:-1]):
+                _add_requirements(av[-1], literals, char_sets)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, "POSSESSIVE_REPEAT", None)):
+            if av[0] > 0:
+                _add_requirements(av[2], literals, char_sets)
+        elif op == getattr(sre_constants, "ATOMIC_GROUP", None):
+            _add_requirements(av, literals, char_sets)
+        elif op == sre_constants.ASSERT:
+            _add_requirements(av[1], literals, char_sets)
+    if literal_chars:
+        literals.append("".join(literal_chars))
+
+
+def _get_prefilter(regex: Pattern[str]) -> Tuple[str, str]:
+    """
+    Derive the longest literal, or else the smallest character set, that content must contain for regex to match.
+    """
+    if regex.flags & (re.IGNORECASE | re.LOCALE):
+        return "", ""
+    literals: List[str] = []
+    char_sets: List[FrozenSet[str]] = []
+    _add_requirements(sre_parse.parse(regex.pattern), literals, char_sets)
+    if literals:
+        return max(literals, key=len), ""
+    if char_sets:
+        chars = min(char_sets, key=len)
+        if len(chars) <= _MAX_REQUIRED_CHARS:
+            return "", "".join(sorted(chars))
+    return "", ""
+
+
+def _iter_ops(pattern: sre_parse.SubPattern) -> Iterator[int]:
+    for op, av in _get_nodes(pattern):
+        yield op
+        for subpattern in _get_subpatterns(op, av):
+            yield from _iter_ops(subpattern)
+
+
+def _get_reach(pattern: sre_parse.SubPattern) -> Tuple[int, int]:
+    """
+    Max number of characters before and after the current position that lookarounds and anchors of the pattern can
+    examine.
+    """
+    behind = 0
+    ahead = 0
+    for op, av in _get_nodes(pattern):
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            direction, subpattern = av
+            sub_behind, sub_ahead = _get_reach(subpattern)
+            width = subpattern.getwidth()[1]
+            if direction < 0:
+                behind = max(behind, width + sub_behind)
+                ahead = max(ahead, sub_ahead)
+            else:
+                behind = max(behind, sub_behind)
+                ahead = max(ahead, width + sub_ahead)
+        elif op == sre_constants.AT:
+            # "^" and "$" look at line breaks in multiline mode, "$" also before a trailing line break
+            if av not in _STRING_ANCHORS:
+                behind = max(behind, 1)
+                ahead = max(ahead, 1)
+        else:
+            for subpattern in _get_subpatterns(op, av):
+                sub_behind, sub_ahead = _get_reach(subpattern)
+                behind = max(behind, sub_behind)
+                ahead = max(ahead, sub_ahead)
+    return behind, ahead
+
+
+def _can_consume(pattern: sre_parse.SubPattern, char: str) -> bool:
+    """
+    Whether a match of the pattern may contain the character. The answer may be a false positive, but never a false
+    negative.
+    """
+    code = ord(char)
+    for op, av in _get_nodes(pattern):
+        if op == sre_constants.LITERAL:
+            if av == code:
+                return True
+        elif op == sre_constants.NOT_LITERAL:
+            if av != code:
+                return True
+        elif op == sre_constants.IN:
+            if _in_set(av, char):
+                return True
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT, sre_constants.AT):
+            continue
+        elif op in (sre_constants.SUBPATTERN, sre_constants.BRANCH, sre_constants.MAX_REPEAT,
+                    sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None),
+                    getattr(sre_constants, "ATOMIC_GROUP", None), sre_constants.GROUPREF_EXISTS):
+            if any(_can_consume(subpattern, char) for subpattern in _get_subpatterns(op, av)):
+                return True
+        else:
+            # ANY, back references and anything else we do not look into
+            return True
+    return False
+
+
+def _in_set(items: Any, char: str) -> bool:
+    code = ord(char)
+    negate = False
+    found = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            found = found or av == code
+        elif op == sre_constants.RANGE:
+            found = found or av[0] <= code <= av[1]
+        elif op == sre_constants.CATEGORY and av in _CATEGORY_PATTERNS:
+            # ASCII matching can also be enabled for a part of the pattern only
+            in_category = {re.match(_CATEGORY_PATTERNS[av], char, f) is not None for f in (0, re.ASCII)}
+            if len(in_category) > 1:
+                return True
+            found = found or in_category.pop()
+        else:
+            return True
+    return found != negate
+
+
+def _split_leading_group(pattern: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a pattern that starts with a group and has no top level alternation into that group and the rest.
+    """
+    if not pattern.startswith("("):
+        return None
+    depth = 0
+    split = 0
+    in_set = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 1
+        elif in_set:
+            in_set = c != "]"
+        elif c == "[":
+            in_set = True
+            # "]" right after "[" or "[^" is a literal
+            if pattern.startswith("^", i + 1):
+                i += 1
+            if pattern.startswith("]", i + 1):
+                i += 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0 and split == 0:
+                split = i + 1
+        elif c == "|" and depth == 0:
+            return None
+        i += 1
+    if split == 0:
+        return None
+    return pattern[:split], pattern[split:]
+
+
+def _is_zero_width(pattern: str) -> bool:
+    try:
+        return sre_parse.parse(pattern).getwidth() == (0, 0) and re.compile(pattern).flags == _DEFAULT_FLAGS
+    except re.error:
+        return False
+
+
+def _compile_char_class(chars: Collection[str]) -> Pattern[str]:
+    if not chars:
+        # never matches
+        return re.compile("(?!)")
+    return re.compile(f"[{''.join(re.escape(c) for c in sorted(chars))}]")
+
+
+def _join_patterns(patterns: Sequence[str], group_names: Sequence[str]) -> Pattern[str]:
+    # Consecutive patterns that start with the same zero width group (typically a word boundary lookbehind) share
+    # it, so it is evaluated once per position instead of once per pattern. Since it consumes nothing and is not
+    # referenced, this does not change which alternative matches.
+    alternatives = []
+    i = 0
+    while i < len(patterns):
+        split = _split_leading_group(patterns[i])
+        j = i + 1
+        if split is not None and _is_zero_width(split[0]):
+            while j < len(patterns) and patterns[j].startswith(split[0]) and \
+                    _split_leading_group(patterns[j]) == (split[0], patterns[j][len(split[0]):]):
+                j += 1
+        if j - i > 1 and split is not None:
+            rests = (f"(?P<{group_names[k]}>{patterns[k][len(split[0]):]})" for k in range(i, j))
+            alternatives.append(f"{split[0]}(?:{'|'.join(rests)})")
+        else:
+            alternatives.append(f"(?P<{group_names[i]}>{patterns[i]})")
+        i = j
+    return re.compile("|".join(alternatives))
+
+
+class CombinedMasker:
+    """
+    Masks content with a single regex that joins the patterns of several masking instructions into one alternation,
+    instead of applying them one after the other.
+
+    The two differ when matches of different instructions overlap, or when an instruction matches text around a mask
+    that an earlier instruction inserted. mask() checks every message for such cases and returns None for messages it
+    cannot mask exactly like the instructions would sequentially.
+    """
+
+    def __init__(self, masking_instructions: Sequence[AbstractMaskingInstruction], mask_prefix: str,
+                 mask_suffix: str):
+        if not mask_prefix or not mask_suffix:
+            raise ValueError("mask prefix and suffix must not be empty")
+        patterns = []
+        self.masks = []
+        self.mask_names = []
+        self.parsed_patterns = []
+        # instructions from this index on may match the masks inserted before them, so they are checked against the
+        # masked content instead
+        self.mask_consumer_index = len(masking_instructions)
+        for i, mi in enumerate(masking_instructions):
+            if not isinstance(mi, MaskingInstruction):
+                raise ValueError(f"instruction {mi.mask_with} is not a regex masking instruction")
+            if mi.regex.flags != _DEFAULT_FLAGS:
+                # before Python 3.11 they would apply to all the joined patterns
+                raise ValueError(f"pattern of instruction {mi.mask_with} sets global flags")
+            parsed = sre_parse.parse(mi.pattern)
+            ops = set(_iter_ops(parsed))
+            if sre_constants.GROUPREF in ops or sre_constants.GROUPREF_EXISTS in ops:
+                raise ValueError(f"pattern of instruction {mi.mask_with} has a group reference")
+            if parsed.getwidth()[0] == 0:
+                raise ValueError(f"pattern of instruction {mi.mask_with} can match an empty string")
+            if i < self.mask_consumer_index and \
+                    (self.can_consume(parsed, mask_prefix[0]) or self.can_consume(parsed, mask_suffix[-1])):
+                self.mask_consumer_index = i
+            patterns.append(mi.pattern)
+            self.masks.append(mask_prefix + mi.mask_with + mask_suffix)
+            self.mask_names.append(mi.mask_with)
+            self.parsed_patterns.append(parsed)
+        if self.mask_consumer_index == 0:
+            raise ValueError(f"pattern of instruction {masking_instructions[0].mask_with} can match masks")
+
+        head_patterns = self.parsed_patterns[:self.mask_consumer_index]
+        reaches = [_get_reach(parsed) for parsed in head_patterns]
+        self.max_ahead = max(ahead for _, ahead in reaches)
+        self.max_behind_offset = max(max(behind for behind, _ in reaches) - 1, 0)
+        self.max_ahead_offset = max(self.max_ahead - 1, 0)
+        # how far from the ends of a gap between matches a character must be, so that lookarounds that see one end
+        # cannot see past it
+        self.separator_margins = [(max(behind - 1, 0), max(ahead - 1, 0)) for behind, ahead in reaches]
+        # ASCII characters that matches of each instruction cannot contain. Other characters are assumed to be
+        # matchable, which only costs an unnecessary fallback now and then.
+        ascii_chars = [chr(i) for i in range(128)]
+        stop_chars = [{c for c in ascii_chars if not self.can_consume(parsed, c)} for parsed in head_patterns]
+        self.stop_regexes = [_compile_char_class(chars) for chars in stop_chars]
+        self.any_stop_chars = set.intersection(*stop_chars)
+        self.any_stop_regex = _compile_char_class(self.any_stop_chars)
+
+        group_names = [f"_mask{i}" for i in range(len(patterns))]
+        self.group_name_to_index = {name: i for i, name in enumerate(group_names)}
+        head = patterns[:self.mask_consumer_index]
+        tail = patterns[self.mask_consumer_index:]
+        try:
+            self.regex = _join_patterns(head, group_names)
+            # for each instruction, the instructions that come before it
+            self.preceding_regexes = [_join_patterns(head[:i], group_names) if i > 0 else None
+                                      for i in range(len(head))]
+            self.tail_regex = _join_patterns(tail, group_names[len(head):]) if tail else None
+        except re.error as e:
+            raise ValueError(f"patterns cannot be joined: {e}") from e
+        self.fallback_count = 0
+
+    @staticmethod
+    def can_consume(pattern: sre_parse.SubPattern, char: str) -> bool:
+        # case insensitive matching can also be enabled for a part of the pattern only
+        chars = {char, char.lower(), char.upper()}
+        return any(_can_consume(pattern, c) for c in chars if len(c) == 1)
+
+    def is_separated(self, content: str, start: int, end: int, index: int) -> bool:
+        """
+        Whether content[start:end] has a character that instruction `index` cannot match, far enough from both ends
+        that its lookarounds cannot see past it.
+        """
+        start_margin, end_margin = self.separator_margins[index]
+        return self.stop_regexes[index].search(content, start + start_margin, end - end_margin) is not None
+
+    def mask(self, content: str, spans: Optional[List[MaskSpan]] = None) -> Optional[str]:
+        """
+        Mask content and return the result, or None if it might differ from the sequential result.
+
+        :param content: text to apply masking to
+        :param spans: if not None, the spans of the masks in the result are appended to it
+        """
+        any_stop_chars = self.any_stop_chars
+        max_ahead = self.max_ahead
+        parts = []
+        # for each mask: where the text around it that needs to be searched again starts, the mask span, and how far
+        # it extends after the mask
+        windows = []
+        pos = 0
+        masked_pos = 0
+        prev_index = -1
+        for match in self.regex.finditer(content):
+            start, end = match.span()
+            index = self.group_name_to_index[cast(str, match.lastgroup)]
+
+            # Matches are made of characters that instructions can match, and can see a bit further with lookarounds.
+            # These are the runs of such characters before and after this match.
+            run_start = max(start - self.max_ahead_offset, pos)
+            while run_start > pos and content[run_start - 1] not in any_stop_chars:
+                run_start -= 1
+            stop_match = self.any_stop_regex.search(content, end + self.max_behind_offset)
+            run_end = stop_match.start() if stop_match is not None else len(content)
+
+            # an earlier instruction would have masked text starting inside this match first
+            preceding_regex = self.preceding_regexes[index]
+            if preceding_regex is not None:
+                preceding_match = preceding_regex.search(content, start + 1, run_end + max_ahead)
+                if preceding_match is not None and preceding_match.start() < end:
+                    self.fallback_count += 1
+                    return None
+
+            # the instructions between the two would see one match masked and the other one not
+            if prev_index >= 0 and prev_index != index:
+                for i in range(min(prev_index, index) + 1, max(prev_index, index) + 1):
+                    if not self.is_separated(content, pos, start, i):
+                        self.fallback_count += 1
+                        return None
+
+            parts.append(content[pos:start])
+            mask = self.masks[index]
+            parts.append(mask)
+            masked_pos += start - pos
+            if spans is not None:
+                spans.append(MaskSpan(masked_pos, masked_pos + len(mask), self.mask_names[index], match.group()))
+            windows.append((masked_pos - (start - run_start), masked_pos, masked_pos + len(mask), run_end - end))
+            masked_pos += len(mask)
+            pos = end
+            prev_index = index
+
+        if not parts:
+            masked_content = content
+        else:
+            parts.append(content[pos:])
+            masked_content = "".join(parts)
+
+            # Some instruction might match inside a mask, or next to it where it did not match before
+            for i, (window_start, mask_start, mask_end, run_length) in enumerate(windows):
+                next_mask_start = windows[i + 1][1] if i + 1 < len(windows) else len(masked_content)
+                window_end = min(mask_end + run_length, next_mask_start) + max_ahead
+                if self.regex.search(masked_content, window_start, window_end) is not None:
+                    self.fallback_count += 1
+                    return None
+
+        if self.tail_regex is not None and self.tail_regex.search(masked_content) is not None:
+            self.fallback_count += 1
+            return None
+        return masked_content
+
+
 class LogMasker:
 
     def __init__(self, masking_instructions: Collection[AbstractMaskingInstruction],
-                 mask_prefix: str, mask_suffix: str):
+                 mask_prefix: str, mask_suffix: str, combined: bool = False):
+        """
+        :param masking_instructions: instructions to apply, in order
+        :param mask_prefix: the prefix of any masks inserted
+        :param mask_suffix: the suffix of any masks inserted
+        :param combined: whether to apply all instructions in a single scan of the content. Messages where the
+            result might differ from applying the instructions one after the other are masked sequentially. This is
+            faster for messages with few or no parameters, and slower for messages with many parameters, since each
+            match is checked against the other instructions.
+        """
         self.mask_prefix = mask_prefix
         self.mask_suffix = mask_suffix
         self.masking_instructions = masking_instructions
+        # per instruction, how many times it was skipped by its prefilter. Only skips are counted, and once per
+        # message the number of messages masked one instruction at a time, to keep counting off the hot path.
+        self.prefilter_skip_counts = [0] * len(masking_instructions)
+        self.sequential_mask_count = 0
+        self.combined_masker: Optional[CombinedMasker] = None
+        if combined and masking_instructions:
+            try:
+                self.combined_masker = CombinedMasker(list(masking_instructions), mask_prefix, mask_suffix)
+            except ValueError as e:
+                logger.warning(f"Masking instructions cannot be combined, applying them sequentially: {e}")
         mask_name_to_instructions: Dict[str, List[AbstractMaskingInstruction]] = {}
         for mi in self.masking_instructions:
             mask_name_to_instructions.setdefault(mi.mask_with, [])
@@ -55,10 +591,52 @@ class LogMasker:
         self.mask_name_to_instructions = mask_name_to_instructions
 
     def mask(self, content: str) -> str:
-        for mi in self.masking_instructions:
+        if self.combined_masker is not None:
+            masked_content = self.combined_masker.mask(content)
+            if masked_content is not None:
+                return masked_content
+        self.sequential_mask_count += 1
+        for i, mi in enumerate(self.masking_instructions):
+            if not mi.may_match(content):
+                self.prefilter_skip_counts[i] += 1
+                continue
             content = mi.mask(content, self.mask_prefix, self.mask_suffix)
         return content
 
+    def mask_with_spans(self, content: str) -> Tuple[str, Optional[List[MaskSpan]]]:
+        """
+        Same as `mask()`, and also return the span of each mask in the result with the text it replaced, in order.
+        When an instruction masks text that includes a mask inserted before, the text replaced by that mask is part of
+        the text of the new mask. The spans are None when they can not be recorded, when a mask overlaps a part of a
+        mask inserted before, or an instruction is not a `MaskingInstruction`.
+
+        :param content: text to apply masking to
+        """
+        if self.combined_masker is not None:
+            combined_spans: List[MaskSpan] = []
+            masked_content = self.combined_masker.mask(content, combined_spans)
+            if masked_content is not None:
+                return masked_content, combined_spans
+        spans: Optional[List[MaskSpan]] = []
+        self.sequential_mask_count += 1
+        for i, mi in enumerate(self.masking_instructions):
+            if not mi.may_match(content):
+                self.prefilter_skip_counts[i] += 1
+                continue
+            if spans is not None and isinstance(mi, MaskingInstruction):
+                content, spans = mi.mask_with_spans(content, self.mask_prefix, self.mask_suffix, spans)
+            else:
+                content = mi.mask(content, self.mask_prefix, self.mask_suffix)
+                spans = None
+        return content, spans
+
+    @property
+    def prefilter_hit_counts(self) -> List[int]:
+        """
+        Per instruction, how many times it was applied, after its prefilter did not skip it.
+        """
+        return [self.sequential_mask_count - skip_count for skip_count in self.prefilter_skip_counts]
+
     @property
     def mask_names(self) -> Collection[str]:
         return self.mask_name_to_instructions.keys()
@@ -1,6 +1,6 @@
 # SPDX-License-Identifier: MIT
 
-from typing import Optional
+from typing import List, Optional, Sequence
 
 from drain3.persistence_handler import PersistenceHandler
 
@@ -8,9 +8,21 @@ from drain3.persistence_handler import PersistenceHandler
 class MemoryBufferPersistence(PersistenceHandler):
     def __init__(self) -> None:
         self.state: Optional[bytes] = None
+        self.deltas: List[bytes] = []
 
     def save_state(self, state: bytes) -> None:
         self.state = state
+        self.deltas = []
 
     def load_state(self) -> Optional[bytes]:
-        return self.state
\ No newline at end of file
+        return self.state
+
+    def supports_deltas(self) -> bool:
+        return True
+
+    def append_delta(self, delta: bytes) -> bool:
+        self.deltas.append(delta)
+        return True
+
+    def load_deltas(self) -> Sequence[bytes]:
+        return list(self.deltas)
@@ -0,0 +1,240 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+from drain3.histogram_profiler import HistogramProfiler
+from drain3.simple_profiler import Profiler, SimpleProfiler
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A sample of a metric: the suffix of its name, e.g. "_sum" for summaries, its labels, and its value
+MetricSample = NamedTuple("MetricSample", [("suffix", str), ("labels", Mapping[str, str]), ("value", float)])
+
+# A metric with its samples, one per combination of labels. The type is "counter", "gauge", "summary" or "untyped".
+MetricFamily = NamedTuple("MetricFamily", [("name", str),
+                                           ("type", str),
+                                           ("help", str),
+                                           ("samples", Sequence[MetricSample])])
+
+Collector = Callable[[], Iterable[MetricFamily]]
+
+
+def create_metric_family(name: str,
+                         metric_type: str,
+                         help_text: str,
+                         value: Union[int, float, None] = None,
+                         samples: Iterable[MetricSample] = ()) -> MetricFamily:
+    """
+    Create a metric with a single sample without labels, or with the given samples.
+    """
+    if value is not None:
+        samples = [MetricSample("", {}, value)]
+    return MetricFamily(name, metric_type, help_text, list(samples))
+
+
+class Counter:
+    """A value that only increases, e.g. the number of times something happened."""
+
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.value: Union[int, float] = 0
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        self.value += amount
+
+    def collect(self) -> List[MetricFamily]:
+        return [create_metric_family(self.name, "counter", self.help_text, self.value)]
+
+
+class Gauge:
+    """A value that can go up and down, set directly or read from a function when collected."""
+
+    def __init__(self,
+                 name: str,
+                 help_text: str,
+                 function: Optional[Callable[[], Union[int, float]]] = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+        self.value: Union[int, float] = 0
+
+    def set(self, value: Union[int, float]) -> None:
+        self.value = value
+
+    def collect(self) -> List[MetricFamily]:
+        value = self.function() if self.function is not None else self.value
+        return [create_metric_family(self.name, "gauge", self.help_text, value)]
+
+
+class MetricsRegistry:
+    """
+    Metrics to expose, as counters and gauges, and collectors which return metrics when they are collected.
+    Collectors read counters kept by the objects they collect from, such as `TemplateMiner.collect_metrics()`,
+    so that nothing is done on the hot path to expose them.
+    """
+
+    def __init__(self) -> None:
+        self.collectors: List[Collector] = []
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        counter = Counter(name, help_text)
+        self.add_collector(counter.collect)
+        return counter
+
+    def gauge(self, name: str, help_text: str, function: Optional[Callable[[], Union[int, float]]] = None) -> Gauge:
+        gauge = Gauge(name, help_text, function)
+        self.add_collector(gauge.collect)
+        return gauge
+
+    def add_collector(self, collector: Collector) -> None:
+        with self.lock:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector: Collector) -> None:
+        with self.lock:
+            self.collectors.remove(collector)
+
+    def collect(self) -> List[MetricFamily]:
+        with self.lock:
+            collectors = list(self.collectors)
+        metric_families: List[MetricFamily] = []
+        for collector in collectors:
+            metric_families.extend(collector())
+        return metric_families
+
+    def render_prometheus(self) -> str:
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric_family in self.collect():
+            help_text = metric_family.help.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {metric_family.name} {help_text}")
+            lines.append(f"# TYPE {metric_family.name} {metric_family.type}")
+            for sample in metric_family.samples:
+                labels = ""
+                if sample.labels:
+                    labels = "{" + ",".join(f'{name}="{_escape_label_value(value)}"'
+                                            for name, value in sample.labels.items()) + "}"
+                lines.append(f"{metric_family.name}{sample.suffix}{labels} {_format_value(sample.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def summary_samples(quantiles: Iterable[Tuple[float, float]], total: float, count: int,
+                    labels: Optional[Dict[str, str]] = None) -> List[MetricSample]:
+    """
+    Return the samples of a summary: its quantiles, as (quantile, value), its sum and its count.
+    """
+    labels = labels or {}
+    samples = [MetricSample("", dict(labels, quantile=str(quantile)), value) for quantile, value in quantiles]
+    samples.append(MetricSample("_sum", labels, total))
+    samples.append(MetricSample("_count", labels, count))
+    return samples
+
+
+def collect_profiler_metrics(profiler: Profiler) -> List[MetricFamily]:
+    """
+    Return the time spent in each section of a profiler as a summary, with quantiles for `HistogramProfiler`.
+    With sampling, only the profiled calls are counted.
+    """
+    samples = []
+    if isinstance(profiler, HistogramProfiler):
+        for section_report in profiler.get_report():
+            quantiles = [(0.5, section_report.p50_us / 1e6),
+                         (0.9, section_report.p90_us / 1e6),
+                         (0.99, section_report.p99_us / 1e6)]
+            samples.extend(summary_samples(quantiles, section_report.total_sec, section_report.sample_count,
+                                           {"section": section_report.section_name}))
+    elif isinstance(profiler, SimpleProfiler):
+        for section in list(profiler.section_to_stats.values()):
+            samples.extend(summary_samples([], section.total_time_sec, section.sample_count,
+                                           {"section": section.section_name}))
+    else:
+        return []
+    return [create_metric_family("drain3_section_duration_seconds", "summary",
+                                 "Time spent in each profiled section.", samples=samples)]
+
+
+class MetricsServer:
+    """
+    An HTTP server in a background thread, which serves the metrics of a registry in the Prometheus text format,
+    for Prometheus to scrape.
+    """
+
+    def __init__(self, registry: MetricsRegistry, port: int = 9100, host: str = "127.0.0.1",
+                 path: str = "/metrics") -> None:
+        """
+        :param registry: the metrics to serve
+        :param port: the port to listen on, or 0 for any free port, see `port`
+        :param host: the address to listen on, the local host only by default
+        :param path: the path of the metrics
+        """
+        self.registry = registry
+        self.path = path
+        self.http_server = ThreadingHTTPServer((host, port), self._create_handler_class())
+        self.http_server.daemon_threads = True
+        self.thread = threading.Thread(target=self.http_server.serve_forever, name="drain3-metrics", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return int(self.http_server.server_address[1])
+
+    def _create_handler_class(self) -> Any:
+        server = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != server.path:
+                    self.send_error(404)
+                    return
+                try:
+                    body = server.registry.render_prometheus().encode("utf-8")
+                except Exception:
+                    logger.exception("Collecting metrics failed")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(format, *args)
+
+        return MetricsRequestHandler
+
+    def close(self) -> None:
+        """Stop serving metrics."""
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.thread.join()
+
+    def __enter__(self) -> "MetricsServer":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
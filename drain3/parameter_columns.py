@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: MIT
+
+import importlib
+from array import array
+from typing import Any, Iterable, Iterator, List, Optional, overload, Sequence, Tuple, Union
+
+# number of values of a column joined at a time while building it
+_CHUNK_SIZE = 4096
+
+
+def _import_numpy() -> Any:
+    # NumPy is an optional dependency, imported only when arrays are requested
+    return importlib.import_module("numpy")
+
+
+class ParameterColumn(Sequence[str]):
+    """
+    The values of a parameter of a template in many log messages. The values are stored in a single string with the
+    offsets of each value in an array, instead of a string object per value.
+    """
+
+    def __init__(self, mask_name: str, data: str, offsets: "array[int]") -> None:
+        """
+        :param mask_name: the name of the mask of the parameter, or `*` for the catch-all mask
+        :param data: the values, one after the other
+        :param offsets: the offset of each value in data, followed by the length of data
+        """
+        self.mask_name = mask_name
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @overload
+    def __getitem__(self, index: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[str]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ParameterColumn index out of range")
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data
+        offsets = self.offsets
+        return (data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1))
+
+    def to_numpy(self, dtype: Any = object) -> Any:
+        """
+        Return the values as a NumPy array. NumPy must be installed.
+
+        :param dtype: the type of the array, `object` for an array of strings, or `str` for fixed width unicode
+        """
+        return _import_numpy().array(list(self), dtype=dtype)
+
+
+class ParameterColumns:
+    """
+    The parameters of many log messages of a cluster, with a column per parameter of its template.
+    """
+
+    def __init__(self, cluster_id: int, template: str, columns: List[ParameterColumn], matched: "array[int]") -> None:
+        """
+        :param cluster_id: the ID of the cluster
+        :param template: the template of the cluster the parameters were extracted with
+        :param columns: a column for each parameter of the template, in order, with a value for each log message
+        :param matched: 1 for each log message that corresponds to the template, 0 for others, whose values are empty
+        """
+        self.cluster_id = cluster_id
+        self.template = template
+        self.columns = columns
+        self.matched = matched
+
+    @property
+    def row_count(self) -> int:
+        return len(self.matched)
+
+    @property
+    def mask_names(self) -> List[str]:
+        return [column.mask_name for column in self.columns]
+
+    def get_row(self, index: int) -> Optional[List[str]]:
+        """
+        Return the parameter values of a log message, or None if it does not correspond to the template.
+        """
+        if not self.matched[index]:
+            return None
+        return [column[index] for column in self.columns]
+
+    def to_numpy(self, dtype: Any = object) -> Tuple[List[Any], Any]:
+        """
+        Return the columns as NumPy arrays, and the matched log messages as a boolean array. NumPy must be installed.
+
+        :param dtype: the type of the arrays of the columns, see `ParameterColumn.to_numpy()`
+        """
+        return [column.to_numpy(dtype) for column in self.columns], _import_numpy().array(self.matched, dtype=bool)
+
+
+class ParameterColumnsBuilder:
+
+    def __init__(self, cluster_id: int, template: str, mask_names: Sequence[str]) -> None:
+        """
+        Builds the columns of the parameter values of log messages, a row at a time.
+
+        :param cluster_id: the ID of the cluster
+        :param template: the template of the cluster
+        :param mask_names: the mask name of each parameter of the template, in order
+        """
+        self.cluster_id = cluster_id
+        self.template = template
+        self.mask_names = mask_names
+        column_count = len(mask_names)
+        self.empty_row = [""] * column_count
+        self.chunks: List[List[str]] = [[] for _ in range(column_count)]
+        self.pending: List[List[str]] = [[] for _ in range(column_count)]
+        self.offsets = [array("q", [0]) for _ in range(column_count)]
+        self.matched = array("b")
+
+    def add_row(self, values: Optional[Sequence[str]]) -> None:
+        """
+        Add the parameter values of a log message.
+
+        :param values: the parameter values, or None if the log message does not correspond to the template
+        """
+        if values is None:
+            self.matched.append(0)
+            values = self.empty_row
+        else:
+            if len(values) != len(self.mask_names):
+                raise ValueError(f"Expected {len(self.mask_names)} parameter values, got {len(values)}")
+            self.matched.append(1)
+        pending = self.pending
+        for value, column_pending, column_offsets in zip(values, pending, self.offsets):
+            column_pending.append(value)
+            column_offsets.append(column_offsets[-1] + len(value))
+        # the values are joined in chunks, so that only a chunk of them are separate string objects at a time
+        if pending and len(pending[0]) >= _CHUNK_SIZE:
+            for column_chunks, column_pending in zip(self.chunks, pending):
+                column_chunks.append("".join(column_pending))
+                column_pending.clear()
+
+    def build(self) -> ParameterColumns:
+        columns = []
+        for mask_name, column_chunks, column_pending, column_offsets in zip(self.mask_names, self.chunks, self.pending,
+                                                                            self.offsets):
+            column_chunks.append("".join(column_pending))
+            columns.append(ParameterColumn(mask_name, "".join(column_chunks), column_offsets))
+        return ParameterColumns(self.cluster_id, self.template, columns, self.matched)
+
+
+def build_parameter_columns(cluster_id: int,
+                            template: str,
+                            mask_names: Sequence[str],
+                            rows: Iterable[Optional[Sequence[str]]]) -> ParameterColumns:
+    """
+    Build the columns of the parameter values of log messages.
+
+    :param cluster_id: the ID of the cluster
+    :param template: the template of the cluster
+    :param mask_names: the mask name of each parameter of the template, in order
+    :param rows: the parameter values of each log message, or None if it does not correspond to the template
+    """
+    builder = ParameterColumnsBuilder(cluster_id, template, mask_names)
+    for values in rows:
+        builder.add_row(values)
+    return builder.build()
@@ -1,7 +1,7 @@
 # SPDX-License-Identifier: MIT
 
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Any, Dict, Mapping, Optional, Sequence
 
 
 class PersistenceHandler(ABC):
@@ -13,3 +13,58 @@ class PersistenceHandler(ABC):
     @abstractmethod
     def load_state(self) -> Optional[bytes]:
         pass
+
+    def is_binary_safe(self) -> bool:
+        """
+        Whether the handler can save arbitrary bytes. Otherwise, compressed snapshots are always base64 encoded,
+        and the binary snapshot format is not supported.
+        """
+        return True
+
+    def supports_deltas(self) -> bool:
+        """
+        Whether the handler can save deltas with `append_delta()`.
+        """
+        return False
+
+    def append_delta(self, delta: bytes) -> bool:
+        """
+        Save a delta record of the changes since the last saved state or delta, to be loaded by `load_deltas()`.
+        Saving a new state with `save_state()` discards all deltas. Requires `supports_deltas()`.
+
+        :return: False if the delta can not be saved now, in which case the caller should save the full state instead.
+        """
+        return False
+
+    def load_deltas(self) -> Sequence[bytes]:
+        """
+        Load the delta records appended since the state was last saved, in order.
+        """
+        return []
+
+    def supports_changes(self) -> bool:
+        """
+        Whether the handler stores each cluster and prefix tree node separately, with `save_changes()` and
+        `load_changes()`, instead of saving full states and deltas.
+        """
+        return False
+
+    def save_changes(self, changes: Mapping[str, Any], replace: bool) -> None:
+        """
+        Save the clusters and prefix tree nodes that changed, as returned by `DrainBase.pop_changes()`.
+        Requires `supports_changes()`.
+
+        :param changes: the changes
+        :param replace: whether the changes contain the whole model, as returned by `DrainBase.get_all_changes()`,
+            and replace everything saved before.
+        """
+        raise NotImplementedError("Saving changes is not supported")
+
+    def load_changes(self) -> Optional[Dict[str, Any]]:
+        """
+        Load all saved clusters and prefix tree nodes, in the format of `DrainBase.get_all_changes()`.
+        Requires `supports_changes()`.
+
+        :return: None if nothing was saved.
+        """
+        raise NotImplementedError("Loading changes is not supported")
@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: MIT
 
-from typing import Optional, Union
+import json
+from typing import Any, cast, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 import redis
 
@@ -14,21 +15,110 @@ class RedisPersistence(PersistenceHandler):
                  redis_db: int,
                  redis_pass: Optional[str],
                  is_ssl: bool,
-                 redis_key: Union[bytes, str, memoryview]) -> None:
+                 redis_key: Union[bytes, str, memoryview],
+                 per_cluster: bool = False,
+                 chunk_size: int = 1000) -> None:
+        """
+        :param per_cluster: whether to store each cluster as a field of a hash (`<redis_key>:clusters`) and each
+            prefix tree node as a field of another hash (`<redis_key>:nodes`), with the cluster counter under
+            `<redis_key>:meta`, so that only the clusters and nodes that changed are written on each save.
+            Otherwise, the whole state is saved to `redis_key`.
+        :param chunk_size: max number of hash fields written by a single HSET or read by a single HSCAN call
+            in per cluster mode.
+        """
         self.redis_host = redis_host
         self.redis_port = redis_port
         self.redis_db = redis_db
         self.redis_pass = redis_pass
         self.is_ssl = is_ssl
         self.redis_key = redis_key
+        self.per_cluster = per_cluster
+        self.chunk_size = chunk_size
+        self.redis_deltas_key = self.get_key(":deltas")
+        self.redis_meta_key = self.get_key(":meta")
+        self.redis_clusters_key = self.get_key(":clusters")
+        self.redis_nodes_key = self.get_key(":nodes")
+        # sequence number of the last saved cluster, to restore clusters in the order they were last used
+        self.cluster_seq: Optional[int] = None
         self.r = redis.Redis(host=self.redis_host,
                              port=self.redis_port,
                              db=self.redis_db,
                              password=self.redis_pass,
                              ssl=self.is_ssl)
 
+    def get_key(self, suffix: str) -> Union[bytes, str]:
+        redis_key = self.redis_key
+        return redis_key + suffix if isinstance(redis_key, str) else bytes(redis_key) + suffix.encode()
+
     def save_state(self, state: bytes) -> None:
-        self.r.set(self.redis_key, state)
+        # replace the state and discard its deltas in a single transaction
+        pipeline = self.r.pipeline()
+        pipeline.set(self.redis_key, state)
+        pipeline.delete(self.redis_deltas_key)
+        pipeline.execute()
 
     def load_state(self) -> Optional[bytes]:
         return self.r.get(self.redis_key)
+
+    def supports_deltas(self) -> bool:
+        return True
+
+    def append_delta(self, delta: bytes) -> bool:
+        self.r.rpush(self.redis_deltas_key, delta)
+        return True
+
+    def load_deltas(self) -> Sequence[bytes]:
+        return cast(List[bytes], self.r.lrange(self.redis_deltas_key, 0, -1))
+
+    def supports_changes(self) -> bool:
+        return self.per_cluster
+
+    def save_changes(self, changes: Mapping[str, Any], replace: bool) -> None:
+        if self.cluster_seq is None or replace:
+            self.cluster_seq = 0
+        # a cluster is stored as [sequence number, size, template tokens], a node as its cluster IDs
+        cluster_fields: Dict[str, str] = {}
+        for cluster_id, log_template_tokens, size in changes["clusters"]:
+            self.cluster_seq += 1
+            cluster_fields[str(cluster_id)] = json.dumps([self.cluster_seq, size, log_template_tokens])
+        node_fields = {json.dumps(path): json.dumps(cluster_ids) for path, cluster_ids in changes["nodes"]}
+        meta = json.dumps({"clusters_counter": changes["clusters_counter"], "cluster_seq": self.cluster_seq})
+
+        # all commands are sent in a single round trip, and applied in a single transaction
+        pipeline = self.r.pipeline()
+        if replace:
+            pipeline.delete(self.redis_clusters_key, self.redis_nodes_key)
+        elif changes["removed_cluster_ids"]:
+            pipeline.hdel(self.redis_clusters_key, *[str(cluster_id) for cluster_id in changes["removed_cluster_ids"]])
+        for key, fields in [(self.redis_clusters_key, cluster_fields), (self.redis_nodes_key, node_fields)]:
+            items = list(fields.items())
+            for i in range(0, len(items), self.chunk_size):
+                pipeline.hset(key, mapping=dict(items[i:i + self.chunk_size]))
+        pipeline.set(self.redis_meta_key, meta)
+        pipeline.execute()
+
+    def load_changes(self) -> Optional[Dict[str, Any]]:
+        meta_data = self.r.get(self.redis_meta_key)
+        if meta_data is None:
+            return None
+        meta = json.loads(meta_data)
+        self.cluster_seq = meta["cluster_seq"]
+
+        seq_clusters: List[Tuple[int, List[Any]]] = []
+        for field, value in self.r.hscan_iter(self.redis_clusters_key, count=self.chunk_size):
+            seq, size, log_template_tokens = json.loads(value)
+            seq_clusters.append((seq, [int(field), log_template_tokens, size]))
+        # least recently used first
+        seq_clusters.sort(key=lambda seq_cluster: seq_cluster[0])
+
+        nodes = [[json.loads(field), json.loads(value)]
+                 for field, value in self.r.hscan_iter(self.redis_nodes_key, count=self.chunk_size)]
+        # parent nodes before their children
+        nodes.sort(key=lambda node: node[0])
+
+        return {
+            "clusters_counter": meta["clusters_counter"],
+            "removed_cluster_ids": [],
+            "clusters": [cluster for _, cluster in seq_clusters],
+            "nodes": nodes,
+        }
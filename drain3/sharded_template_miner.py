@@ -0,0 +1,391 @@
+# SPDX-License-Identifier: MIT
+
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+from drain3.drain import Drain, DrainBase, LogCluster
+from drain3.jaccard_drain import JaccardDrain
+from drain3.masking import LogMasker
+from drain3.persistence_handler import PersistenceHandler
+from drain3.snapshot_policy import SnapshotPolicy
+from drain3.template_miner import config_filename, create_profiler, TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+logger = logging.getLogger(__name__)
+
+# binary snapshots of all shards start with these magic bytes, followed by the shard count and, for each shard,
+# the length of its snapshot and the snapshot
+_SHARDS_MAGIC = b"\x93D3M"
+_SHARD_COUNT = struct.Struct("<I")
+_SHARD_STATE_LENGTH = struct.Struct("<Q")
+
+
+def run_shard(connection: Connection, config: TemplateMinerConfig) -> None:
+    """
+    Main loop of a shard worker process. Receives commands from a ShardedTemplateMiner, applies them
+    to a TemplateMiner that owns the clusters of the shard, and sends back (success, result) tuples.
+    """
+    template_miner = TemplateMiner(config=config)
+    drain = template_miner.drain
+
+    while True:
+        command, args = connection.recv()
+        if command == "close":
+            connection.close()
+            return
+
+        result: Any
+        try:
+            if command == "mask":
+                mask = template_miner.masker.mask
+                result = [mask(log_message) for log_message in args]
+            elif command == "add_log_message":
+                cluster, change_type = drain.add_log_message(args)
+                result = (cluster, change_type, len(drain.id_to_cluster))
+            elif command == "add_log_messages":
+                result = (drain.add_log_messages(args), len(drain.id_to_cluster))
+            elif command == "match":
+                result = drain.match(*args)
+            elif command == "clusters":
+                result = list(drain.clusters)
+            elif command == "dump_state":
+                result = template_miner.dump_state()
+            elif command == "restore_state":
+                template_miner.restore_state(args)
+                result = len(drain.id_to_cluster)
+            else:
+                raise ValueError(f"Unknown shard command: {command}")
+        except Exception as e:
+            connection.send((False, e))
+        else:
+            connection.send((True, result))
+
+
+class ShardedTemplateMiner:
+
+    def __init__(self,
+                 persistence_handler: Optional[PersistenceHandler] = None,
+                 config: Optional[TemplateMinerConfig] = None,
+                 shard_count: Optional[int] = None):
+        """
+        Wrapper for multiple Drain instances (shards), each owned by a worker process, with persistence and
+        masking support. Masked log messages are routed to a shard by their token count
+        (or by their first token for JaccardDrain), which is the first layer of the prefix tree.
+        Therefore, each shard owns a disjoint part of the clusters, and mines the same templates as a single Drain.
+
+        Cluster IDs are unique across shards. `[DRAIN]/max_clusters` applies to each shard separately.
+        Call `close()` to stop the worker processes, or use the miner as a context manager.
+
+        :param persistence_handler: The type of persistence to use. When None, no persistence is applied.
+            The state of all shards is saved together, as a single full snapshot, synchronously. Therefore,
+            `[SNAPSHOT]/max_deltas` and `[SNAPSHOT]/background` do not apply, while the options that coalesce
+            changes into fewer snapshots do. Handlers that store each cluster separately, such as
+            `SqlitePersistence`, are not supported.
+        :param config: Configuration object. When none, configuration is loaded from default .ini file (if exist)
+        :param shard_count: number of shards (worker processes). Defaults to the number of CPUs.
+        """
+        logger.info("Starting Drain3 sharded template miner")
+
+        if config is None:
+            logger.info(f"Loading configuration from {config_filename}")
+            config = TemplateMinerConfig()
+            config.load(config_filename)
+
+        self.config = config
+        self.shard_count = shard_count or os.cpu_count() or 1
+
+        self.profiler = create_profiler(self.config)
+
+        if persistence_handler is not None and persistence_handler.supports_changes():
+            raise ValueError(f"{type(persistence_handler).__name__} stores each cluster separately, "
+                             f"which is not supported by ShardedTemplateMiner")
+        self.persistence_handler = persistence_handler
+
+        target_obj = self.config.engine
+        if target_obj not in ["Drain", "JaccardDrain"]:
+            raise ValueError(f"Invalid matched_pattern: {target_obj}, must be either 'Drain' or 'JaccardDrain'")
+
+        # an empty model, only used to split log messages to tokens and to find the first layer key to route them by
+        param_str = f"{self.config.mask_prefix}*{self.config.mask_suffix}"
+        self.router: DrainBase = globals()[target_obj](extra_delimiters=self.config.drain_extra_delimiters,
+                                                       param_str=param_str)
+
+        self.masker = LogMasker(self.config.masking_instructions, self.config.mask_prefix, self.config.mask_suffix,
+                                self.config.masking_combined)
+        self.last_save_time = time.time()
+        self.snapshot_policy = SnapshotPolicy(self.config)
+
+        shard_config = copy.copy(self.config)
+        shard_config.profiling_enabled = False
+        # shard snapshots are embedded as text in json snapshots
+        shard_config.snapshot_base64 = self.config.snapshot_base64 or self.config.snapshot_format == "json"
+        context = multiprocessing.get_context()
+        self.connections: List[Connection] = []
+        self.processes: List[BaseProcess] = []
+        self.shard_cluster_counts = [0] * self.shard_count
+        for shard in range(self.shard_count):
+            connection, shard_connection = context.Pipe()
+            process = context.Process(target=run_shard,
+                                      args=(shard_connection, shard_config),
+                                      name=f"drain3-shard-{shard}",
+                                      daemon=True)
+            process.start()
+            shard_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        if persistence_handler is not None:
+            self.load_state()
+
+    def __enter__(self) -> "ShardedTemplateMiner":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Save the changes held back by `[SNAPSHOT]/min_interval_sec`, and stop the worker processes.
+        """
+        if self.processes:
+            self.save_pending_changes()
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(("close", None))
+            process.join()
+            connection.close()
+        self.connections = []
+        self.processes = []
+
+    def get_shard(self, masked_content: str) -> int:
+        first_layer_key = self.router.get_first_layer_key(self.router.get_content_as_tokens(masked_content))
+        # crc32 rather than hash(), which is not stable between processes
+        return zlib.crc32(first_layer_key.encode("utf-8")) % self.shard_count
+
+    def get_cluster_id(self, shard: int, shard_cluster_id: int) -> int:
+        """
+        Convert the ID of a cluster in a shard to a cluster ID which is unique across shards.
+        """
+        return (shard_cluster_id - 1) * self.shard_count + shard + 1
+
+    def to_cluster(self, shard: int, cluster: LogCluster) -> LogCluster:
+        cluster.cluster_id = self.get_cluster_id(shard, cluster.cluster_id)
+        return cluster
+
+    def send(self, shard: int, command: str, args: Any = None) -> None:
+        self.connections[shard].send((command, args))
+
+    def receive(self, shard: int) -> Any:
+        success, result = self.connections[shard].recv()
+        if not success:
+            raise result
+        return result
+
+    def call(self, shard: int, command: str, args: Any = None) -> Any:
+        self.send(shard, command, args)
+        return self.receive(shard)
+
+    def call_all(self, command: str, shard_args: Optional[Sequence[Any]] = None) -> List[Any]:
+        # send to all shards before receiving, so that the shards run in parallel
+        for shard in range(self.shard_count):
+            self.send(shard, command, None if shard_args is None else shard_args[shard])
+        return [self.receive(shard) for shard in range(self.shard_count)]
+
+    @property
+    def clusters(self) -> Sequence[LogCluster]:
+        clusters: List[LogCluster] = []
+        for shard, shard_clusters in enumerate(self.call_all("clusters")):
+            clusters.extend(self.to_cluster(shard, cluster) for cluster in shard_clusters)
+        return clusters
+
+    def load_state(self) -> None:
+        logger.info("Checking for saved state")
+
+        assert self.persistence_handler is not None
+
+        state = self.persistence_handler.load_state()
+        if state is None:
+            logger.info("Saved state not found")
+            return
+
+        self.restore_state(state)
+
+    def restore_state(self, state: bytes) -> None:
+        """
+        Replace the state of all shards with a snapshot created by `dump_state()`.
+        """
+        if state.startswith(_SHARDS_MAGIC):
+            shard_states = []
+            shard_count, = _SHARD_COUNT.unpack_from(state, len(_SHARDS_MAGIC))
+            pos = len(_SHARDS_MAGIC) + _SHARD_COUNT.size
+            for _ in range(shard_count):
+                length, = _SHARD_STATE_LENGTH.unpack_from(state, pos)
+                pos += _SHARD_STATE_LENGTH.size
+                shard_states.append(state[pos:pos + length])
+                pos += length
+        else:
+            loaded_state = json.loads(state.decode("utf-8"))
+            shard_states = [shard_state.encode("utf-8") for shard_state in loaded_state["shards"]]
+        if len(shard_states) != self.shard_count:
+            raise ValueError(f"Snapshot has {len(shard_states)} shards, "
+                             f"but the miner has {self.shard_count} shards")
+
+        self.shard_cluster_counts = self.call_all("restore_state", shard_states)
+
+        logger.info(f"Restored {sum(self.shard_cluster_counts)} clusters in {self.shard_count} shards")
+
+    def dump_state(self) -> bytes:
+        """
+        Create a snapshot of all shards, as saved by the persistence handler.
+        """
+        shard_states: List[bytes] = self.call_all("dump_state")
+        if self.config.snapshot_format == "binary":
+            return _SHARDS_MAGIC + _SHARD_COUNT.pack(len(shard_states)) + \
+                b"".join(_SHARD_STATE_LENGTH.pack(len(shard_state)) + shard_state for shard_state in shard_states)
+        state = {
+            "shard_count": self.shard_count,
+            "shards": [shard_state.decode("utf-8") for shard_state in shard_states]
+        }
+        return json.dumps(state).encode("utf-8")
+
+    def save_state(self, snapshot_reason: str) -> None:
+        assert self.persistence_handler is not None
+
+        self.snapshot_policy.reset()
+        state = self.dump_state()
+
+        logger.info(f"Saving state of {sum(self.shard_cluster_counts)} clusters in {self.shard_count} shards, "
+                    f"{len(state)} bytes, reason: {snapshot_reason}")
+        self.persistence_handler.save_state(state)
+
+    def save_pending_changes(self) -> None:
+        """
+        Save a snapshot of the changes held back by `[SNAPSHOT]/min_interval_sec`. Does nothing if there are none.
+        """
+        if self.persistence_handler is None:
+            return
+        snapshot_reason = self.snapshot_policy.get_pending_reason()
+        if snapshot_reason:
+            self.save_state(snapshot_reason)
+            self.last_save_time = time.time()
+
+    def get_snapshot_reason(self, change_type: str, cluster_id: int) -> Optional[str]:
+        now = time.time()
+        if change_type != "none":
+            self.snapshot_policy.add_changes(1, f"{change_type} ({cluster_id})", now)
+        return self.snapshot_policy.get_snapshot_reason(self.last_save_time, now)
+
+    def add_log_message(self, log_message: str) -> Mapping[str, Union[str, int]]:
+        self.profiler.start_section("total")
+
+        self.profiler.start_section("mask")
+        masked_content = self.masker.mask(log_message)
+        self.profiler.end_section()
+
+        self.profiler.start_section("drain")
+        shard = self.get_shard(masked_content)
+        cluster, change_type, self.shard_cluster_counts[shard] = self.call(shard, "add_log_message", masked_content)
+        cluster = self.to_cluster(shard, cluster)
+        self.profiler.end_section("drain")
+        result: Mapping[str, Union[str, int]] = {
+            "change_type": change_type,
+            "cluster_id": cluster.cluster_id,
+            "cluster_size": cluster.size,
+            "template_mined": cluster.get_template(),
+            "cluster_count": sum(self.shard_cluster_counts)
+        }
+
+        if self.persistence_handler is not None:
+            self.profiler.start_section("save_state")
+            snapshot_reason = self.get_snapshot_reason(change_type, cluster.cluster_id)
+            if snapshot_reason:
+                self.save_state(snapshot_reason)
+                self.last_save_time = time.time()
+            self.profiler.end_section()
+
+        self.profiler.end_section("total")
+        self.profiler.report(self.config.profiling_report_sec)
+        return result
+
+    def add_log_messages(self, log_messages: Iterable[str]) -> List[Tuple[int, str]]:
+        """
+        Mask and add a batch of log messages to the model. The shards mask an equal slice of the batch,
+        and then add the messages routed to them, in parallel.
+
+        :param log_messages: log messages to add, as a list or any other iterable.
+        :return: a (cluster_id, change_type) tuple for each message, in input order.
+        """
+        self.profiler.start_section("total")
+
+        self.profiler.start_section("mask")
+        # masking is the most expensive part of ingestion, so all shards mask an equal slice of the batch in parallel
+        log_messages = list(log_messages)
+        slice_size = -(-len(log_messages) // self.shard_count)
+        log_message_slices = [log_messages[i * slice_size:(i + 1) * slice_size] for i in range(self.shard_count)]
+        masked_contents = [masked_content
+                           for masked_slice in self.call_all("mask", log_message_slices)
+                           for masked_content in masked_slice]
+        self.profiler.end_section()
+
+        self.profiler.start_section("drain")
+        shard_indexes: List[List[int]] = [[] for _ in range(self.shard_count)]
+        shard_contents: List[List[str]] = [[] for _ in range(self.shard_count)]
+        for i, masked_content in enumerate(masked_contents):
+            shard = self.get_shard(masked_content)
+            shard_indexes[shard].append(i)
+            shard_contents[shard].append(masked_content)
+
+        results: List[Tuple[int, str]] = [(0, "")] * len(masked_contents)
+        shard_results = self.call_all("add_log_messages", shard_contents)
+        for shard, (shard_result, self.shard_cluster_counts[shard]) in enumerate(shard_results):
+            for i, (shard_cluster_id, change_type) in zip(shard_indexes[shard], shard_result):
+                results[i] = (self.get_cluster_id(shard, shard_cluster_id), change_type)
+        self.profiler.end_section("drain")
+
+        if self.persistence_handler is not None:
+            self.profiler.start_section("save_state")
+            snapshot_reason = self.get_batch_snapshot_reason(results)
+            if snapshot_reason:
+                self.save_state(snapshot_reason)
+                self.last_save_time = time.time()
+            self.profiler.end_section()
+
+        self.profiler.end_section("total")
+        self.profiler.report(self.config.profiling_report_sec)
+        return results
+
+    def get_batch_snapshot_reason(self, results: Sequence[Tuple[int, str]]) -> Optional[str]:
+        changes = [(cluster_id, change_type) for cluster_id, change_type in results if change_type != "none"]
+        if len(changes) == 1:
+            cluster_id, change_type = changes[0]
+            return self.get_snapshot_reason(change_type, cluster_id)
+        now = time.time()
+        if changes:
+            self.snapshot_policy.add_changes(len(changes), f"batch with {len(changes)} changes", now)
+        return self.snapshot_policy.get_snapshot_reason(self.last_save_time, now)
+
+    def match(self, log_message: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
+        """
+        Mask log message and match against an already existing cluster in its shard.
+        See `TemplateMiner.match()` for the available full search strategies.
+
+        :param log_message: log message to match
+        :param full_search_strategy: when to perform full cluster search.
+        :return: Matched cluster or None if no match found.
+        """
+
+        masked_content = self.masker.mask(log_message)
+        shard = self.get_shard(masked_content)
+        matched_cluster: Optional[LogCluster] = self.call(shard, "match", (masked_content, full_search_strategy))
+        if matched_cluster is None:
+            return None
+        return self.to_cluster(shard, matched_cluster)
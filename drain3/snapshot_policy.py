@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: MIT
+
+from typing import Optional
+
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class SnapshotPolicy:
+
+    def __init__(self, config: TemplateMinerConfig) -> None:
+        """
+        Decides when to save a snapshot. Changes to the model are folded into a single snapshot until either
+        `[SNAPSHOT]/min_interval_sec` passed since the last snapshot, `max_pending_changes` changes are pending
+        or the oldest pending change is `max_staleness_sec` old. With the default config, every change is saved.
+        The policy is only consulted when changes are added, so `max_staleness_sec` is not enforced while no log
+        messages arrive; `save_pending_changes()` of the template miner saves the pending changes then.
+
+        :param config: the config with the `[SNAPSHOT]` options
+        """
+        self.config = config
+        # number of changes since the last snapshot
+        self.pending_change_count = 0
+        # number of snapshot triggers since the last snapshot, e.g. a batch with several changes is a single trigger
+        self.pending_trigger_count = 0
+        self.pending_reason = ""
+        self.first_pending_time = 0.0
+
+    def add_changes(self, change_count: int, reason: str, now: float) -> None:
+        """
+        Record changes to the model that need to be saved.
+
+        :param change_count: the number of changes
+        :param reason: the snapshot reason of the changes, e.g. "cluster_created (1)"
+        :param now: the current time, as returned by `time.time()`
+        """
+        if self.pending_change_count == 0:
+            self.first_pending_time = now
+        self.pending_change_count += change_count
+        self.pending_trigger_count += 1
+        self.pending_reason = reason
+
+    def get_snapshot_reason(self, last_save_time: float, now: float) -> Optional[str]:
+        """
+        Return the reason to save a snapshot now, or None if no snapshot is due.
+
+        :param last_save_time: the time of the last snapshot, as returned by `time.time()`
+        :param now: the current time, as returned by `time.time()`
+        """
+        periodic = now - last_save_time >= self.config.snapshot_interval_minutes * 60
+        if self.pending_change_count == 0:
+            return "periodic" if periodic else None
+
+        if periodic or self.is_pending_due(last_save_time, now):
+            return self.get_pending_reason()
+        return None
+
+    def get_pending_reason(self) -> Optional[str]:
+        """
+        Return the reason to save the pending changes, whether or not a snapshot is due, or None if there are none.
+        """
+        if self.pending_change_count == 0:
+            return None
+        if self.pending_trigger_count == 1:
+            return self.pending_reason
+        return f"{self.pending_change_count} coalesced changes, last: {self.pending_reason}"
+
+    def is_pending_due(self, last_save_time: float, now: float) -> bool:
+        config = self.config
+        if now - last_save_time >= config.snapshot_min_interval_sec:
+            return True
+        if 0 < config.snapshot_max_pending_changes <= self.pending_change_count:
+            return True
+        if 0 < config.snapshot_max_staleness_sec <= now - self.first_pending_time:
+            return True
+        return False
+
+    def reset(self) -> None:
+        """
+        Forget the pending changes, after a snapshot was saved.
+        """
+        self.pending_change_count = 0
+        self.pending_trigger_count = 0
+        self.pending_reason = ""
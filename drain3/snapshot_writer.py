@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import threading
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotWriter:
+
+    def __init__(self) -> None:
+        """
+        Runs snapshot saves in a background thread, in the order they were submitted.
+        """
+        self.condition = threading.Condition()
+        self.pending_saves: List[Callable[[], Any]] = []
+        self.saving = False
+        self.closed = False
+        self.error: Optional[Exception] = None
+        # number of saves that were replaced by a later save before they started
+        self.skipped_count = 0
+        self.thread = threading.Thread(target=self.run, name="drain3-snapshot-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, save: Callable[[], Any], replace_pending: bool) -> None:
+        """
+        Schedule a save.
+
+        :param save: saves a snapshot
+        :param replace_pending: whether this save makes the saves that did not start yet obsolete, e.g. because
+            it saves a full snapshot.
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Snapshot writer is closed")
+            if replace_pending:
+                self.skipped_count += len(self.pending_saves)
+                self.pending_saves.clear()
+            self.pending_saves.append(save)
+            self.condition.notify_all()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending_saves and not self.closed:
+                    self.condition.wait()
+                if not self.pending_saves:
+                    return
+                save = self.pending_saves.pop(0)
+                self.saving = True
+            try:
+                save()
+            except Exception as e:
+                logger.exception("Saving snapshot failed")
+                with self.condition:
+                    self.error = e
+            finally:
+                with self.condition:
+                    self.saving = False
+                    self.condition.notify_all()
+
+    def flush(self) -> None:
+        """
+        Wait until all submitted saves are done.
+
+        :raises RuntimeError: if a save failed since the last call.
+        """
+        with self.condition:
+            while self.pending_saves or self.saving:
+                self.condition.wait()
+            error = self.error
+            self.error = None
+        if error is not None:
+            raise RuntimeError("Saving snapshot failed") from error
+
+    def close(self) -> None:
+        """
+        Wait until all submitted saves are done, and stop the background thread.
+
+        :raises RuntimeError: if a save failed since the last call to `flush()`.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: MIT
+
+import json
+import sqlite3
+from typing import Any, Dict, List, Mapping, Optional
+
+from drain3.persistence_handler import PersistenceHandler
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster_id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    template TEXT NOT NULL,
+    tokens TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    path TEXT PRIMARY KEY,
+    cluster_ids TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    data BLOB NOT NULL
+);
+"""
+
+
+class SqlitePersistence(PersistenceHandler):
+    def __init__(self, file_path: str) -> None:
+        """
+        Saves each cluster as a row of the `clusters` table, with its ID, size and template, and each prefix tree
+        node as a row of the `nodes` table. Only the rows of clusters and nodes that changed are written on each save,
+        in a single transaction. The database can be queried by other processes while it is being saved to, e.g.
+        `SELECT cluster_id, size, template FROM clusters`.
+
+        :param file_path: the SQLite database file, which is created if it does not exist
+        """
+        self.file_path = file_path
+        # saves may run in a background thread, one at a time
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        # readers do not block the writer and vice versa, and a commit only syncs the write-ahead log
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+        # sequence number of the last saved cluster, to restore clusters in the order they were last used
+        self.cluster_seq = 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def save_state(self, state: bytes) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO state (id, data) VALUES (0, ?)", (state,))
+
+    def load_state(self) -> Optional[bytes]:
+        row = self.connection.execute("SELECT data FROM state WHERE id = 0").fetchone()
+        return None if row is None else bytes(row[0])
+
+    def supports_changes(self) -> bool:
+        return True
+
+    def save_changes(self, changes: Mapping[str, Any], replace: bool) -> None:
+        if replace:
+            self.cluster_seq = 0
+        cluster_rows = []
+        for cluster_id, log_template_tokens, size in changes["clusters"]:
+            self.cluster_seq += 1
+            cluster_rows.append((cluster_id, self.cluster_seq, size, " ".join(log_template_tokens),
+                                 json.dumps(log_template_tokens)))
+        node_rows = [(json.dumps(path), json.dumps(cluster_ids)) for path, cluster_ids in changes["nodes"]]
+        meta_rows = [("clusters_counter", changes["clusters_counter"]), ("cluster_seq", self.cluster_seq)]
+
+        connection = self.connection
+        with connection:
+            if replace:
+                connection.execute("DELETE FROM clusters")
+                connection.execute("DELETE FROM nodes")
+            connection.executemany("DELETE FROM clusters WHERE cluster_id = ?",
+                                   [(cluster_id,) for cluster_id in changes["removed_cluster_ids"]])
+            connection.executemany("INSERT OR REPLACE INTO clusters (cluster_id, seq, size, template, tokens) "
+                                   "VALUES (?, ?, ?, ?, ?)", cluster_rows)
+            connection.executemany("INSERT OR REPLACE INTO nodes (path, cluster_ids) VALUES (?, ?)", node_rows)
+            connection.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", meta_rows)
+
+    def load_changes(self) -> Optional[Dict[str, Any]]:
+        meta = dict(self.connection.execute("SELECT name, value FROM meta"))
+        if "clusters_counter" not in meta:
+            return None
+        self.cluster_seq = meta["cluster_seq"]
+
+        # rows are decoded as they are read, least recently used first
+        clusters: List[Any] = [[cluster_id, json.loads(tokens), size] for cluster_id, size, tokens in
+                               self.connection.execute("SELECT cluster_id, size, tokens FROM clusters ORDER BY seq")]
+        # parent nodes before their children
+        nodes: List[Any] = [[json.loads(path), json.loads(cluster_ids)] for path, cluster_ids in
+                            self.connection.execute("SELECT path, cluster_ids FROM nodes")]
+        nodes.sort(key=lambda node: node[0])
+
+        return {
+            "clusters_counter": meta["clusters_counter"],
+            "removed_cluster_ids": [],
+            "clusters": clusters,
+            "nodes": nodes,
+        }
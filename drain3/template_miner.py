@@ -1,19 +1,30 @@
 # SPDX-License-Identifier: MIT
 
 import base64
+import itertools
+import json
 import logging
+import operator
 import re
 import time
-import zlib
-from typing import Optional, Mapping, MutableMapping, NamedTuple, Sequence, Tuple, Union
+from typing import Any, Callable, cast, Dict, Iterable, List, Optional, Mapping, MutableMapping, NamedTuple, \
+    Pattern, Sequence, Tuple, Union
 
 import jsonpickle  # type: ignore[import]
-from cachetools import LRUCache, cachedmethod
+from cachetools import LRUCache
 
+from drain3.binary_snapshot import dump_binary_state, is_binary_snapshot, restore_binary_state
+from drain3.compression import decompress_snapshot
 from drain3.drain import Drain, DrainBase, LogCluster
-from drain3.masking import LogMasker
+from drain3.histogram_profiler import HistogramProfiler
+from drain3.jaccard_drain import JaccardDrain
+from drain3.masking import LogMasker, MaskingInstruction, MaskSpan
+from drain3.metrics import collect_profiler_metrics, create_metric_family, MetricFamily, MetricSample
+from drain3.parameter_columns import ParameterColumns, ParameterColumnsBuilder
 from drain3.persistence_handler import PersistenceHandler
 from drain3.simple_profiler import SimpleProfiler, NullProfiler, Profiler
+from drain3.snapshot_policy import SnapshotPolicy
+from drain3.snapshot_writer import SnapshotWriter
 from drain3.template_miner_config import TemplateMinerConfig
 
 
@@ -21,8 +32,46 @@ logger = logging.getLogger(__name__)
 
 config_filename = 'drain3.ini'
 
+_whitespace_regex = re.compile(r"\s")
+
+# single chars which, as regexes, match other text than themselves
+_non_literal_delimiters = ".^$|"
+
 ExtractedParameter = NamedTuple("ExtractedParameter", [("value", str), ("mask_name", str)])
 
+# A template whose parameters can be aligned with tokens of log messages: its token count, a getter of its literal
+# tokens from the tokens of a log message and their values, its parameters as (index, mask name), and the regexes of
+# the values of parameters which do not match any value, as (index, regex)
+_AlignedTemplate = NamedTuple("_AlignedTemplate", [("token_count", int),
+                                                   ("literal_getter", Optional[Callable[[Sequence[str]], Any]]),
+                                                   ("literal_tokens", Any),
+                                                   ("parameters", List[Tuple[int, str]]),
+                                                   ("value_regexes", List[Tuple[int, Pattern[str]]])])
+
+
+def _create_tuple_getter(create_getter: Callable[..., Callable[[Any], Any]],
+                         keys: Sequence[Any]) -> Callable[[Any], Tuple[Any, ...]]:
+    # a getter of several keys, e.g. an itemgetter, returns a tuple, but of one key returns the item
+    if not keys:
+        return lambda obj: ()
+    if len(keys) == 1:
+        getter = create_getter(keys[0])
+        return lambda obj: (getter(obj),)
+    return cast(Callable[[Any], Tuple[Any, ...]], create_getter(*keys))
+
+
+def create_profiler(config: TemplateMinerConfig) -> Profiler:
+    """
+    Create the profiler of the `[PROFILING]` section of a configuration.
+    """
+    if not config.profiling_enabled:
+        return NullProfiler()
+    if config.profiling_type == "simple":
+        return SimpleProfiler()
+    if config.profiling_type == "histogram":
+        return HistogramProfiler(config.profiling_sample_interval)
+    raise ValueError(f"Invalid profiling type: {config.profiling_type}, must be either 'simple' or 'histogram'")
+
 
 class TemplateMiner:
 
@@ -43,10 +92,7 @@ class TemplateMiner:
 
         self.config = config
 
-        self.profiler: Profiler = NullProfiler()
-
-        if self.config.profiling_enabled:
-            self.profiler = SimpleProfiler()
+        self.profiler = create_profiler(self.config)
 
         self.persistence_handler = persistence_handler
 
@@ -57,6 +103,14 @@ class TemplateMiner:
         target_obj = self.config.engine
         if target_obj not in ["Drain", "JaccardDrain"]:
             raise ValueError(f"Invalid matched_pattern: {target_obj}, must be either 'Drain' or 'JaccardDrain'")
+        if self.config.snapshot_format not in ["json", "binary"]:
+            raise ValueError(f"Invalid snapshot format: {self.config.snapshot_format}, "
+                             f"must be either 'json' or 'binary'")
+        self.snapshot_codec = self.config.get_snapshot_codec()
+        binary_safe = persistence_handler is None or persistence_handler.is_binary_safe()
+        if self.config.snapshot_format == "binary" and not binary_safe:
+            raise ValueError("Binary snapshot format is not supported by the persistence handler")
+        self.snapshot_base64 = self.config.snapshot_base64 or not binary_safe
 
         self.drain: DrainBase = globals()[target_obj](
             sim_th=self.config.drain_sim_th,
@@ -66,13 +120,61 @@ class TemplateMiner:
             extra_delimiters=self.config.drain_extra_delimiters,
             profiler=self.profiler,
             param_str=param_str,
-            parametrize_numeric_tokens=self.config.parametrize_numeric_tokens
+            parametrize_numeric_tokens=self.config.parametrize_numeric_tokens,
+            intern_tokens=self.config.drain_intern_tokens,
+            repeat_cache_size=self.config.drain_repeat_cache_size,
+            track_changes=persistence_handler is not None and
+            ((self.config.snapshot_max_deltas > 0 and persistence_handler.supports_deltas()) or
+             persistence_handler.supports_changes())
         )
 
-        self.masker = LogMasker(self.config.masking_instructions, self.config.mask_prefix, self.config.mask_suffix)
-        self.parameter_extraction_cache: MutableMapping[Tuple[str, bool], str] = \
+        self.masker = LogMasker(self.config.masking_instructions, self.config.mask_prefix, self.config.mask_suffix,
+                                self.config.masking_combined)
+        # compiled regex and mask names of the parameters of each template, by template and exact_matching
+        self.parameter_extraction_cache: MutableMapping[Tuple[str, bool], Tuple[Pattern[str], Mapping[str, str]]] = \
+            LRUCache(self.config.parameter_extraction_cache_capacity)
+        self.parameter_extraction_cache_hits = 0
+        self.parameter_extraction_cache_misses = 0
+        # literal tokens and parameters of each template, by template and exact_matching
+        self.aligned_template_cache: MutableMapping[Tuple[str, bool], _AlignedTemplate] = \
             LRUCache(self.config.parameter_extraction_cache_capacity)
+        # regex of the values of each mask with exact matching, or None if any value matches
+        self.parameter_value_regexes: Dict[str, Optional[Pattern[str]]] = {}
+        # number of extractions by the regex of the template, which could not align tokens of the template
+        self.parameter_extraction_fallback_count = 0
+        self.extra_delimiter_regexes = [re.compile(delimiter) for delimiter in self.config.drain_extra_delimiters]
+        # whether the masks of log messages are always within a token, and text which looks like a mask can be found in
+        # them, so that parameters can be extracted from the spans of masks. Extra delimiters must also be replaced the
+        # same way by Drain, which replaces them as text, and by extract_parameters(), which replaces them as regexes,
+        # and no instruction may mask a mask inserted before, whose text extract_parameters() does not see.
+        mask_strs = [self.masker.mask_prefix + mask_name + self.masker.mask_suffix
+                     for mask_name in self.masker.mask_names]
+        self.mask_spans_alignable = bool(self.masker.mask_prefix) and all(
+            len(delimiter) == 1 and delimiter not in _non_literal_delimiters
+            and not any(delimiter in mask_str for mask_str in mask_strs)
+            for delimiter in self.config.drain_extra_delimiters) and not any(
+            _whitespace_regex.search(mask_str) for mask_str in mask_strs) and not any(
+            isinstance(mi, MaskingInstruction) and mi.regex.search(mask_str)
+            for mi in self.masker.masking_instructions for mask_str in mask_strs)
         self.last_save_time = time.time()
+        self.snapshot_policy = SnapshotPolicy(self.config)
+        # number of deltas saved after the last full snapshot, or None if there is no full snapshot to add them to
+        self.snapshot_delta_count: Optional[int] = None
+        # whether the persistence handler rejected a delta saved in the background, so that a full snapshot must be
+        # saved, and further deltas are not saved until then. Set by the background thread, so it is only accessed
+        # with the lock of the snapshot writer held, like the number of full snapshots submitted, which tells
+        # whether a rejected delta was saved after the last one.
+        self.snapshot_delta_rejected = False
+        self.full_snapshot_number = 0
+        # number of log messages added, and of snapshots saved by type ("full", "delta" or "changes"), with the total
+        # size of full and delta snapshots and the total time to save snapshots, for metrics
+        self.message_count = 0
+        self.snapshot_counts = {"full": 0, "delta": 0, "changes": 0}
+        self.snapshot_bytes = 0
+        self.snapshot_duration_sec = 0.0
+        self.snapshot_writer: Optional[SnapshotWriter] = None
+        if persistence_handler is not None and self.config.snapshot_background:
+            self.snapshot_writer = SnapshotWriter()
 
         if persistence_handler is not None:
             self.load_state()
@@ -82,13 +184,41 @@ class TemplateMiner:
 
         assert self.persistence_handler is not None
 
+        if self.persistence_handler.supports_changes():
+            changes = self.persistence_handler.load_changes()
+            if changes is None:
+                logger.info("Saved state not found")
+                return
+            self.drain.apply_changes([changes])
+            self.snapshot_delta_count = 0
+            logger.info(f"Restored {len(self.drain.clusters)} clusters "
+                        f"built from {self.drain.get_total_cluster_size()} messages")
+            return
+
         state = self.persistence_handler.load_state()
         if state is None:
             logger.info("Saved state not found")
             return
 
-        if self.config.snapshot_compress_state:
-            state = zlib.decompress(base64.b64decode(state))
+        self.restore_state(state)
+        deltas = self.persistence_handler.load_deltas()
+        if deltas:
+            self.restore_deltas(deltas)
+        self.snapshot_delta_count = len(deltas)
+
+    def restore_state(self, state: bytes) -> None:
+        """
+        Replace the model with a snapshot created by `dump_state()`, in any snapshot format.
+        """
+        if is_binary_snapshot(state):
+            restore_binary_state(self.drain, state, self.config.compression_codecs.values())
+            logger.info(f"Restored {len(self.drain.clusters)} clusters "
+                        f"built from {self.drain.get_total_cluster_size()} messages")
+            return
+
+        # json snapshots are either plain or compressed, and optionally base64 encoded
+        if not state.startswith(b"{"):
+            state = decompress_snapshot(state, self.config.compression_codecs.values())
 
         loaded_drain: Drain = jsonpickle.loads(state, keys=True)
 
@@ -102,34 +232,276 @@ class TemplateMiner:
                 cache.update(loaded_drain.id_to_cluster)
                 loaded_drain.id_to_cluster = cache
 
-        self.drain.id_to_cluster = loaded_drain.id_to_cluster
-        self.drain.clusters_counter = loaded_drain.clusters_counter
-        self.drain.root_node = loaded_drain.root_node
+        self.drain.restore_state(loaded_drain.id_to_cluster, loaded_drain.clusters_counter, loaded_drain.root_node)
 
         logger.info(f"Restored {len(loaded_drain.clusters)} clusters "
                     f"built from {loaded_drain.get_total_cluster_size()} messages")
 
+    def restore_deltas(self, deltas: Sequence[bytes]) -> None:
+        """
+        Apply deltas created by `dump_delta()`, in order, to the model restored from the preceding snapshot.
+        """
+        changes_list = []
+        for delta in deltas:
+            if not delta.startswith(b"{"):
+                delta = decompress_snapshot(delta, self.config.compression_codecs.values())
+            changes_list.append(json.loads(delta))
+        self.drain.apply_changes(changes_list)
+
+        logger.info(f"Restored {len(deltas)} deltas, {len(self.drain.clusters)} clusters "
+                    f"built from {self.drain.get_total_cluster_size()} messages")
+
+    def dump_delta(self) -> bytes:
+        """
+        Create a delta snapshot of the changes to the model since the last snapshot or delta.
+        Requires `[SNAPSHOT]/max_deltas`.
+        """
+        delta = json.dumps(self.drain.pop_changes(), separators=(",", ":")).encode('utf-8')
+        return self.compress_snapshot(delta)
+
+    def compress_snapshot(self, data: bytes) -> bytes:
+        """
+        Compress a json snapshot or delta with the configured codec, and base64 encode it if configured or
+        required by the persistence handler.
+        """
+        if self.snapshot_codec is None:
+            return data
+        data = self.snapshot_codec.compress(data, self.config.snapshot_compression_level)
+        if self.snapshot_base64:
+            data = base64.b64encode(data)
+        return data
+
+    def dump_state(self) -> bytes:
+        """
+        Create a snapshot of the model, as saved by the persistence handler.
+        """
+        return self._dump_state(self.drain)
+
+    def _dump_state(self, drain: DrainBase) -> bytes:
+        if self.config.snapshot_format == "binary":
+            return dump_binary_state(drain, self.snapshot_codec, self.config.snapshot_compression_level)
+
+        state: bytes = jsonpickle.dumps(drain, keys=True).encode('utf-8')
+        return self.compress_snapshot(state)
+
     def save_state(self, snapshot_reason: str) -> None:
+        """
+        Save a snapshot with the persistence handler. With `[SNAPSHOT]/background`, the snapshot is saved in
+        a background thread after a copy of the model is taken, and this method does not wait for it.
+        """
+        assert self.persistence_handler is not None
+
+        self.snapshot_policy.reset()
+        if self.persistence_handler.supports_changes():
+            self.save_changes(snapshot_reason)
+            return
+
+        if self.drain.track_changes and not self.is_delta_rejected() and self.snapshot_delta_count is not None \
+                and self.snapshot_delta_count < self.config.snapshot_max_deltas:
+            delta = self.dump_delta()
+            self.snapshot_delta_count += 1
+            delta_number = self.snapshot_delta_count
+            snapshot_writer = self.snapshot_writer
+            if snapshot_writer is not None:
+                full_snapshot_number = self.full_snapshot_number
+                snapshot_writer.submit(lambda: self._save_delta_in_background(
+                    snapshot_writer, delta, delta_number, full_snapshot_number, snapshot_reason), False)
+                return
+            if self._save_delta(delta, delta_number, snapshot_reason):
+                return
+
+        self.snapshot_delta_count = 0
+        if self.snapshot_writer is not None:
+            drain_copy = self.drain.copy_for_snapshot()
+            self.drain.reset_changes()
+            with self.snapshot_writer.condition:
+                self.snapshot_delta_rejected = False
+                self.full_snapshot_number += 1
+            self.snapshot_writer.submit(lambda: self._save_state(drain_copy, snapshot_reason), True)
+            return
+        self.snapshot_delta_rejected = False
+        self.full_snapshot_number += 1
+        self._save_state(self.drain, snapshot_reason)
+        self.drain.reset_changes()
+
+    def _save_state(self, drain: DrainBase, snapshot_reason: str) -> None:
         assert self.persistence_handler is not None
 
-        state = jsonpickle.dumps(self.drain, keys=True).encode('utf-8')
-        if self.config.snapshot_compress_state:
-            state = base64.b64encode(zlib.compress(state))
+        start_time = time.perf_counter()
+        state = self._dump_state(drain)
 
-        logger.info(f"Saving state of {len(self.drain.clusters)} clusters "
-                    f"with {self.drain.get_total_cluster_size()} messages, {len(state)} bytes, "
+        logger.info(f"Saving state of {len(drain.clusters)} clusters "
+                    f"with {drain.get_total_cluster_size()} messages, {len(state)} bytes, "
                     f"reason: {snapshot_reason}")
         self.persistence_handler.save_state(state)
+        self._count_snapshot("full", len(state), start_time)
 
-    def get_snapshot_reason(self, change_type: str, cluster_id: int) -> Optional[str]:
-        if change_type != "none":
-            return f"{change_type} ({cluster_id})"
+    def _count_snapshot(self, snapshot_type: str, size: int, start_time: float) -> None:
+        self.snapshot_counts[snapshot_type] += 1
+        self.snapshot_bytes += size
+        self.snapshot_duration_sec += time.perf_counter() - start_time
+
+    def _save_delta(self, delta: bytes, delta_number: int, snapshot_reason: str) -> bool:
+        assert self.persistence_handler is not None
+
+        start_time = time.perf_counter()
+        if not self.persistence_handler.append_delta(delta):
+            logger.info(f"Persistence handler rejected delta {delta_number}, saving a full snapshot instead")
+            return False
+
+        logger.info(f"Saving delta {delta_number}, {len(delta)} bytes, reason: {snapshot_reason}")
+        self._count_snapshot("delta", len(delta), start_time)
+        return True
+
+    def _save_delta_in_background(self, snapshot_writer: SnapshotWriter, delta: bytes, delta_number: int,
+                                  full_snapshot_number: int, snapshot_reason: str) -> None:
+        # The model can not be saved in the background thread, so the thread that adds log messages saves the full
+        # snapshot, which includes the changes of this delta and of any deltas saved before it is done. A delta
+        # rejected after that full snapshot was submitted needs no other.
+        with snapshot_writer.condition:
+            if self.snapshot_delta_rejected:
+                return
+        if self._save_delta(delta, delta_number, snapshot_reason):
+            return
+        with snapshot_writer.condition:
+            if full_snapshot_number == self.full_snapshot_number:
+                self.snapshot_delta_rejected = True
+
+    def is_delta_rejected(self) -> bool:
+        """
+        Whether the persistence handler rejected a delta saved in the background, so that a full snapshot must be
+        saved.
+        """
+        if self.snapshot_writer is None:
+            return self.snapshot_delta_rejected
+        with self.snapshot_writer.condition:
+            return self.snapshot_delta_rejected
+
+    def save_changes(self, snapshot_reason: str) -> None:
+        # all clusters and nodes are saved the first time, and the ones that changed since the last save afterwards
+        replace = self.snapshot_delta_count is None
+        if replace:
+            changes = self.drain.get_all_changes()
+            self.drain.reset_changes()
+        else:
+            changes = self.drain.pop_changes()
+        self.snapshot_delta_count = 0
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit(lambda: self._save_changes(changes, replace, snapshot_reason), replace)
+            return
+        self._save_changes(changes, replace, snapshot_reason)
+
+    def _save_changes(self, changes: Dict[str, Any], replace: bool, snapshot_reason: str) -> None:
+        assert self.persistence_handler is not None
+
+        start_time = time.perf_counter()
+        logger.info(f"Saving {'all' if replace else 'changed'} {len(changes['clusters'])} clusters and "
+                    f"{len(changes['nodes'])} prefix tree nodes, reason: {snapshot_reason}")
+        self.persistence_handler.save_changes(changes, replace)
+        # the size of the changes is known to the persistence handler only
+        self._count_snapshot("changes", 0, start_time)
+
+    def save_pending_changes(self) -> None:
+        """
+        Save a snapshot of the changes held back by `[SNAPSHOT]/min_interval_sec`, or a full snapshot if a delta was
+        rejected by the persistence handler. Does nothing if there are no such changes.
+        """
+        if self.persistence_handler is None:
+            return
+        snapshot_reason = "delta rejected" if self.is_delta_rejected() else \
+            self.snapshot_policy.get_pending_reason()
+        if snapshot_reason:
+            self.save_state(snapshot_reason)
+            self.last_save_time = time.time()
+
+    def flush(self) -> None:
+        """
+        Save the changes held back by `[SNAPSHOT]/min_interval_sec`, and wait until the snapshots being saved in the
+        background are saved. If a delta was rejected by the persistence handler, a full snapshot is saved instead.
 
-        diff_time_sec = time.time() - self.last_save_time
-        if diff_time_sec >= self.config.snapshot_interval_minutes * 60:
-            return "periodic"
+        :raises RuntimeError: if saving a snapshot in the background failed since the last call.
+        """
+        self.save_pending_changes()
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.flush()
+            if self.is_delta_rejected():
+                self.save_pending_changes()
+                self.snapshot_writer.flush()
+
+    def close(self) -> None:
+        """
+        Save the changes held back by `[SNAPSHOT]/min_interval_sec`, wait until the snapshots being saved in the
+        background are saved, and stop the background thread. Later snapshots are saved without a background thread.
+
+        :raises RuntimeError: if saving a snapshot in the background failed since the last call to `flush()`.
+        """
+        self.save_pending_changes()
+        if self.snapshot_writer is not None:
+            snapshot_writer = self.snapshot_writer
+            self.snapshot_writer = None
+            snapshot_writer.close()
+            # a full snapshot after a delta rejected in the background is saved without it
+            self.save_pending_changes()
 
-        return None
+    def __enter__(self) -> "TemplateMiner":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """
+        Return the metrics of the template miner, its model and its profiler. The counters they are read from are
+        updated anyway, so that exposing them, e.g. by `registry.add_collector(template_miner.collect_metrics)` with a
+        `MetricsRegistry`, does not slow down adding log messages.
+        """
+        drain = self.drain
+        metric_families = [
+            create_metric_family("drain3_messages_total", "counter", "Log messages added.", self.message_count),
+            create_metric_family("drain3_clusters", "gauge", "Clusters in the model.", len(drain.id_to_cluster)),
+            create_metric_family("drain3_clusters_created_total", "counter",
+                                 "Clusters created since the model was created.", drain.clusters_counter),
+            create_metric_family("drain3_cluster_template_changes_total", "counter",
+                                 "Changes of the templates of clusters.", drain.template_change_count),
+            create_metric_family("drain3_clusters_evicted_total", "counter",
+                                 "Clusters evicted by [DRAIN]/max_clusters.", drain.evicted_cluster_count),
+            create_metric_family("drain3_repeat_cache_hits_total", "counter",
+                                 "Log messages added as exact repeats, without a tree search.",
+                                 drain.repeat_cache_hits),
+            create_metric_family("drain3_repeat_cache_misses_total", "counter",
+                                 "Log messages which were not exact repeats.", drain.repeat_cache_misses),
+            create_metric_family("drain3_parameter_extraction_cache_hits_total", "counter",
+                                 "Lookups of compiled template regexes that hit the cache.",
+                                 self.parameter_extraction_cache_hits),
+            create_metric_family("drain3_parameter_extraction_cache_misses_total", "counter",
+                                 "Lookups of compiled template regexes that missed the cache.",
+                                 self.parameter_extraction_cache_misses),
+            create_metric_family("drain3_parameter_extraction_fallbacks_total", "counter",
+                                 "Parameter extractions by the regex of the template.",
+                                 self.parameter_extraction_fallback_count),
+            create_metric_family("drain3_snapshots_total", "counter", "Snapshots saved, by type.",
+                                 samples=[MetricSample("", {"type": snapshot_type}, count)
+                                          for snapshot_type, count in self.snapshot_counts.items()]),
+            create_metric_family("drain3_snapshot_bytes_total", "counter",
+                                 "Size of the full and delta snapshots saved.", self.snapshot_bytes),
+            create_metric_family("drain3_snapshot_duration_seconds_total", "counter", "Time spent saving snapshots.",
+                                 self.snapshot_duration_sec),
+        ]
+        if self.masker.combined_masker is not None:
+            metric_families.append(create_metric_family(
+                "drain3_masking_combined_fallbacks_total", "counter",
+                "Log messages masked one instruction at a time, because the combined result might differ.",
+                self.masker.combined_masker.fallback_count))
+        metric_families.extend(collect_profiler_metrics(self.profiler))
+        return metric_families
+
+    def get_snapshot_reason(self, change_type: str, cluster_id: int) -> Optional[str]:
+        now = time.time()
+        if change_type != "none":
+            self.snapshot_policy.add_changes(1, f"{change_type} ({cluster_id})", now)
+        if self.is_delta_rejected():
+            return "delta rejected"
+        return self.snapshot_policy.get_snapshot_reason(self.last_save_time, now)
 
     def add_log_message(self, log_message: str) -> Mapping[str, Union[str, int]]:
         self.profiler.start_section("total")
@@ -138,9 +510,52 @@ class TemplateMiner:
         masked_content = self.masker.mask(log_message)
         self.profiler.end_section()
 
+        _, result = self._add_masked_content(masked_content)
+
+        self.profiler.end_section("total")
+        self.profiler.report(self.config.profiling_report_sec)
+        return result
+
+    def add_log_message_with_parameters(self, log_message: str) -> Mapping[str, Any]:
+        """
+        Mask and add a log message to the model like `add_log_message()`, and also extract its parameters according to
+        the mined template, like `extract_parameters()` does with exact matching.
+
+        The parameters are taken from the text replaced by each mask while masking the log message, and from the tokens
+        of the log message at the position of the `<*>` parameters of the template, without matching the log message
+        against the regex of the template. When the masks can not be aligned with the tokens of the log message, this
+        falls back to `extract_parameters()`.
+
+        :param log_message: log message to add
+        :return: the result of `add_log_message()`, with an ordered list of ExtractedParameter under "parameters",
+            or None if the log message does not correspond to the template.
+        """
+        self.profiler.start_section("total")
+
+        self.profiler.start_section("mask")
+        masked_content, mask_spans = self.masker.mask_with_spans(log_message)
+        self.profiler.end_section()
+
+        cluster, result = self._add_masked_content(masked_content)
+
+        self.profiler.start_section("extract_parameters")
+        extracted_parameters: Optional[Sequence[ExtractedParameter]] = None
+        if mask_spans is not None:
+            extracted_parameters = self._extract_parameters_by_mask_spans(
+                cluster.log_template_tokens, masked_content, mask_spans)
+        if extracted_parameters is None:
+            extracted_parameters = self.extract_parameters(cluster.get_template(), log_message)
+        self.profiler.end_section()
+
+        self.profiler.end_section("total")
+        self.profiler.report(self.config.profiling_report_sec)
+        return dict(result, parameters=extracted_parameters)
+
+    def _add_masked_content(self, masked_content: str) -> Tuple[LogCluster, Mapping[str, Union[str, int]]]:
         self.profiler.start_section("drain")
         cluster, change_type = self.drain.add_log_message(masked_content)
         self.profiler.end_section("drain")
+        self.message_count += 1
         result: Mapping[str, Union[str, int]] = {
             "change_type": change_type,
             "cluster_id": cluster.cluster_id,
@@ -157,9 +572,54 @@ class TemplateMiner:
                 self.last_save_time = time.time()
             self.profiler.end_section()
 
+        return cluster, result
+
+    def add_log_messages(self, log_messages: Iterable[str]) -> List[Tuple[int, str]]:
+        """
+        Mask and add a batch of log messages to the model.
+
+        This is a faster alternative to calling `add_log_message()` for each message: the batch is processed
+        in a tight loop, no result dictionary is built per message, and the snapshot trigger is evaluated
+        once for the whole batch rather than after each message.
+
+        :param log_messages: log messages to add, as a list or any other iterable.
+        :return: a (cluster_id, change_type) tuple for each message, in input order.
+        """
+        self.profiler.start_section("total")
+
+        self.profiler.start_section("mask")
+        mask = self.masker.mask
+        masked_contents = [mask(log_message) for log_message in log_messages]
+        self.profiler.end_section()
+
+        self.profiler.start_section("drain")
+        results = self.drain.add_log_messages(masked_contents)
+        self.message_count += len(results)
+        self.profiler.end_section("drain")
+
+        if self.persistence_handler is not None:
+            self.profiler.start_section("save_state")
+            snapshot_reason = self.get_batch_snapshot_reason(results)
+            if snapshot_reason:
+                self.save_state(snapshot_reason)
+                self.last_save_time = time.time()
+            self.profiler.end_section()
+
         self.profiler.end_section("total")
         self.profiler.report(self.config.profiling_report_sec)
-        return result
+        return results
+
+    def get_batch_snapshot_reason(self, results: Sequence[Tuple[int, str]]) -> Optional[str]:
+        changes = [(cluster_id, change_type) for cluster_id, change_type in results if change_type != "none"]
+        if len(changes) == 1:
+            cluster_id, change_type = changes[0]
+            return self.get_snapshot_reason(change_type, cluster_id)
+        now = time.time()
+        if changes:
+            self.snapshot_policy.add_changes(len(changes), f"batch with {len(changes)} changes", now)
+        if self.is_delta_rejected():
+            return "delta rejected"
+        return self.snapshot_policy.get_snapshot_reason(self.last_save_time, now)
 
     def match(self, log_message: str, full_search_strategy: str = "never") -> Optional[LogCluster]:
         """
@@ -177,7 +637,9 @@ class TemplateMiner:
             more wildcard parameters than necessary;
             (3) "always" is the slowest. It will select the best match among all known clusters, by always evaluating
             all clusters with the same token count, and selecting the cluster with perfect all token match and least
-            count of wildcard matches.
+            count of wildcard matches;
+            (4) "backtrack" gives the same result as "always", but only evaluates the clusters in tree branches
+            which can match the log message perfectly.
         :return: Matched cluster or None if no match found.
         """
 
@@ -225,14 +687,74 @@ class TemplateMiner:
             or None if log_message does not correspond to log_template.
         """
 
-        for delimiter in self.config.drain_extra_delimiters:
-            log_message = re.sub(delimiter, " ", log_message)
+        for delimiter_regex in self.extra_delimiter_regexes:
+            log_message = delimiter_regex.sub(" ", log_message)
+
+        aligned, extracted_parameters = self._extract_parameters_by_tokens(log_template, log_message, exact_matching)
+        if aligned:
+            return extracted_parameters
 
+        self.parameter_extraction_fallback_count += 1
+        return self._extract_parameters_by_regex(log_template, log_message, exact_matching)
+
+    def extract_parameter_columns(self,
+                                  cluster_id: int,
+                                  log_messages: Iterable[str],
+                                  exact_matching: bool = True) -> ParameterColumns:
+        """
+        Extract the parameters of many log messages of a cluster, like `extract_parameters()` with its template,
+        into a column per parameter of the template. The values of each column are stored in a single string,
+        instead of an `ExtractedParameter` per value in a list per log message.
+
+        :param cluster_id: ID of the cluster whose template the log messages correspond to
+        :param log_messages: log messages to extract parameters from
+        :param exact_matching: see `extract_parameters()`
+        :return: the columns of the parameters, with a row per log message. Log messages which do not correspond to
+            the template have empty values, and are not marked as matched.
+        """
+        cluster = self.drain.id_to_cluster.get(cluster_id)
+        if cluster is None:
+            raise ValueError(f"Unknown cluster ID: {cluster_id}")
+        log_template = cluster.get_template()
+
+        # the parameters, in the order of their groups in the regex of the template
+        template_regex, param_group_name_to_mask_name = self._get_template_parameter_extraction_regex(
+            log_template, exact_matching)
+        group_names = [group_name for group_name in sorted(template_regex.groupindex,
+                                                           key=template_regex.groupindex.__getitem__)
+                       if group_name in param_group_name_to_mask_name]
+        builder = ParameterColumnsBuilder(cluster_id, log_template,
+                                          [param_group_name_to_mask_name[group_name] for group_name in group_names])
+
+        # The values are added to the columns straight from the tokens of each log message, or from the match of the
+        # regex of the template, as a tuple, without an ExtractedParameter per value
+        aligned_template = self._create_aligned_template(log_template, exact_matching)
+        get_token_values = _create_tuple_getter(operator.itemgetter,
+                                                [index for index, _ in aligned_template.parameters])
+        get_group_values = _create_tuple_getter(lambda *names: operator.methodcaller("group", *names), group_names)
+        for log_message in log_messages:
+            for delimiter_regex in self.extra_delimiter_regexes:
+                log_message = delimiter_regex.sub(" ", log_message)
+
+            _, aligned, message_tokens = self._align_tokens(log_template, log_message, exact_matching)
+            if aligned:
+                builder.add_row(None if message_tokens is None else get_token_values(message_tokens))
+                continue
+
+            self.parameter_extraction_fallback_count += 1
+            parameter_match = template_regex.match(log_message)
+            builder.add_row(None if parameter_match is None else get_group_values(parameter_match))
+        return builder.build()
+
+    def _extract_parameters_by_regex(self,
+                                     log_template: str,
+                                     log_message: str,
+                                     exact_matching: bool) -> Optional[List[ExtractedParameter]]:
         template_regex, param_group_name_to_mask_name = self._get_template_parameter_extraction_regex(
             log_template, exact_matching)
 
         # Parameters are represented by specific named groups inside template_regex.
-        parameter_match = re.match(template_regex, log_message)
+        parameter_match = template_regex.match(log_message)
 
         # log template does not match template
         if not parameter_match:
@@ -248,10 +770,226 @@ class TemplateMiner:
 
         return extracted_parameters
 
-    @cachedmethod(lambda self: self.parameter_extraction_cache)
+    def _extract_parameters_by_tokens(self,
+                                      log_template: str,
+                                      log_message: str,
+                                      exact_matching: bool) -> Tuple[bool, Optional[List[ExtractedParameter]]]:
+        """
+        Extract parameters by aligning the tokens of a template with the tokens of a log message, which gives the same
+        result as the regex of the template without running it.
+
+        :return: whether the tokens were aligned, and the extracted parameters, or None if the log message does not
+            correspond to the template. When the tokens were not aligned, the regex of the template must be used.
+        """
+        aligned_template, aligned, message_tokens = self._align_tokens(log_template, log_message, exact_matching)
+        if message_tokens is None:
+            return aligned, None
+        return True, [ExtractedParameter(message_tokens[index], mask_name)
+                      for index, mask_name in aligned_template.parameters]
+
+    def _align_tokens(self,
+                      log_template: str,
+                      log_message: str,
+                      exact_matching: bool) -> Tuple[_AlignedTemplate, bool, Optional[List[str]]]:
+        """
+        Align the tokens of a template with the tokens of a log message.
+
+        When the log message has as many tokens as the template, separated by a single whitespace char, the regex can
+        only match each token of the template with the token of the log message at the same position, so only the
+        values of parameters with exact matching are checked, by the regex of their mask. When tokens are separated by
+        more whitespace, the regex may match a parameter with some of it, unless the parameter matches any value.
+
+        :return: the aligned template, whether the tokens were aligned, and the tokens of the log message, whose
+            values at the indexes of the parameters of the aligned template are the parameters, or None if the log
+            message does not correspond to the template. When the tokens were not aligned, the regex of the template
+            must be used.
+        """
+        aligned_template = self.aligned_template_cache.get((log_template, exact_matching))
+        if aligned_template is None:
+            aligned_template = self._create_aligned_template(log_template, exact_matching)
+        message_tokens = log_message.split()
+        token_count = len(message_tokens)
+        # the regex matches leading and trailing whitespace as part of parameters
+        if token_count != aligned_template.token_count or log_message[0].isspace() or log_message[-1].isspace():
+            return aligned_template, False, None
+
+        literal_getter = aligned_template.literal_getter
+        literals_match = literal_getter is None or literal_getter(message_tokens) == aligned_template.literal_tokens
+        if not literals_match or aligned_template.value_regexes:
+            # the total length of the tokens up to each token
+            token_ends = list(itertools.accumulate(map(len, message_tokens)))
+            single_spaced = len(log_message) == token_ends[-1] + token_count - 1
+            if not literals_match:
+                # unless tokens are separated by more whitespace, the regex does not match either
+                return aligned_template, single_spaced, None
+            if not single_spaced:
+                return aligned_template, False, None
+            for index, value_regex in aligned_template.value_regexes:
+                token_end = token_ends[index] + index
+                value_match = value_regex.match(log_message, token_end - len(message_tokens[index]))
+                if value_match is None:
+                    return aligned_template, True, None
+                if value_match.end() != token_end:
+                    return aligned_template, False, None
+
+        return aligned_template, True, message_tokens
+
+    def _extract_parameters_by_mask_spans(self,
+                                          template_tokens: Sequence[str],
+                                          masked_content: str,
+                                          mask_spans: Sequence[MaskSpan]) -> Optional[List[ExtractedParameter]]:
+        """
+        Extract the parameters of a masked log message that was added to the cluster of a template, from the spans of
+        its masks and its tokens, which gives the same result as `extract_parameters()` with the template.
+
+        Each token of the template is either a `<*>` parameter, whose value is the token of the log message before
+        masking, or the same as the token of the log message, whose masks are parameters. The tokens must be separated
+        by a single whitespace char, as in `_extract_parameters_by_tokens()`, and the text replaced by masks must not
+        contain whitespace or extra delimiters.
+
+        :return: the extracted parameters, or None if they can not be aligned with the tokens of the log message.
+        """
+        if not self.mask_spans_alignable:
+            return None
+        content = masked_content
+        for delimiter in self.config.drain_extra_delimiters:
+            content = content.replace(delimiter, " ")
+        content_tokens = content.split()
+        token_count = len(content_tokens)
+        if token_count != len(template_tokens) or not content_tokens or content[0].isspace() \
+                or content[-1].isspace() or len(content) != sum(map(len, content_tokens)) + token_count - 1:
+            return None
+        # the regex of the template also extracts parameters from text which looks like a mask, and may split the text
+        # of a mask with whitespace differently. Extra delimiters in the text of a mask are replaced before matching it,
+        # so that it may no longer match the mask.
+        values = [span.value for span in mask_spans]
+        joined_values = "".join(values)
+        if content.count(self.masker.mask_prefix) != len(values) or not all(values) \
+                or _whitespace_regex.search(joined_values) \
+                or any(delimiter_regex.search(joined_values) for delimiter_regex in self.extra_delimiter_regexes):
+            return None
+
+        param_str = self.drain.param_str
+        if param_str not in template_tokens:
+            if content_tokens != list(template_tokens):
+                return None
+            extracted_parameters = [ExtractedParameter(span.value, span.mask_name) for span in mask_spans]
+        else:
+            param_indexes = [index for index, token in enumerate(template_tokens) if token == param_str]
+            expected_tokens = list(template_tokens)
+            for index in param_indexes:
+                expected_tokens[index] = content_tokens[index]
+            if content_tokens != expected_tokens:
+                return None
+            # the total length of the tokens up to each token
+            token_ends = list(itertools.accumulate(map(len, content_tokens)))
+            extracted_parameters = []
+            span_index = 0
+            span_count = len(mask_spans)
+            for index in param_indexes:
+                end = token_ends[index] + index
+                start = end - len(content_tokens[index])
+                while span_index < span_count and mask_spans[span_index].start < start:
+                    span = mask_spans[span_index]
+                    extracted_parameters.append(ExtractedParameter(span.value, span.mask_name))
+                    span_index += 1
+                # the token before masking
+                value_parts = []
+                pos = start
+                while span_index < span_count and mask_spans[span_index].start < end:
+                    span = mask_spans[span_index]
+                    value_parts.append(content[pos:span.start])
+                    value_parts.append(span.value)
+                    pos = span.end
+                    span_index += 1
+                value_parts.append(content[pos:end])
+                extracted_parameters.append(ExtractedParameter("".join(value_parts), "*"))
+            extracted_parameters.extend(ExtractedParameter(span.value, span.mask_name)
+                                        for span in mask_spans[span_index:])
+
+        if self.extra_delimiter_regexes:
+            for index, extracted_parameter in enumerate(extracted_parameters):
+                value = extracted_parameter.value
+                for delimiter_regex in self.extra_delimiter_regexes:
+                    value = delimiter_regex.sub(" ", value)
+                extracted_parameters[index] = ExtractedParameter(value, extracted_parameter.mask_name)
+        return extracted_parameters
+
+    def _create_aligned_template(self, log_template: str, exact_matching: bool) -> _AlignedTemplate:
+        """
+        Return the literal tokens and parameters of a template, or a token count of -1 if the template has tokens which
+        are not separated by a single space, or which contain a parameter and other chars.
+        """
+        mask_str_to_name = {f"{self.masker.mask_prefix}{mask_name}{self.masker.mask_suffix}": mask_name
+                            for mask_name in list(self.masker.mask_names) + ["*"]}
+        tokens = log_template.split(" ")
+        literal_indexes = []
+        parameters = []
+        value_regexes = []
+        aligned = tokens == log_template.split()
+        for index, token in enumerate(tokens if aligned else []):
+            mask_strs = [mask_str for mask_str in mask_str_to_name if mask_str in token]
+            if not mask_strs:
+                literal_indexes.append(index)
+            elif mask_strs == [token]:
+                mask_name = mask_str_to_name[token]
+                parameters.append((index, mask_name))
+                value_regex = self._get_parameter_value_regex(mask_name, exact_matching)
+                if value_regex is not None:
+                    value_regexes.append((index, value_regex))
+            else:
+                aligned = False
+                break
+
+        if not aligned:
+            aligned_template = _AlignedTemplate(-1, None, None, [], [])
+        else:
+            # an itemgetter of several indexes returns a tuple, of one index returns the item
+            literal_getter = operator.itemgetter(*literal_indexes) if literal_indexes else None
+            aligned_template = _AlignedTemplate(len(tokens),
+                                                literal_getter,
+                                                literal_getter(tokens) if literal_getter else None,
+                                                parameters,
+                                                value_regexes)
+        if self.config.parameter_extraction_cache_capacity > 0:
+            self.aligned_template_cache[(log_template, exact_matching)] = aligned_template
+        return aligned_template
+
+    def _get_parameter_value_regex(self, mask_name: str, exact_matching: bool) -> Optional[Pattern[str]]:
+        """
+        Return a regex which matches the value of a parameter at a position of a log message, followed by whitespace or
+        the end of the log message, same as the regex of a template, or None if the parameter matches any value.
+        """
+        if not exact_matching or (mask_name == "*" and not self.masker.instructions_by_mask_name(mask_name)):
+            return None
+        if mask_name not in self.parameter_value_regexes:
+            mask_str = f"{self.masker.mask_prefix}{mask_name}{self.masker.mask_suffix}"
+            template_regex, _ = self._create_template_parameter_extraction_regex(mask_str, exact_matching)
+            # the regex of a template with a single parameter, without the anchors
+            self.parameter_value_regexes[mask_name] = re.compile(template_regex[1:-1] + r"(?=\s|\Z)")
+        return self.parameter_value_regexes[mask_name]
+
     def _get_template_parameter_extraction_regex(self,
                                                  log_template: str,
-                                                 exact_matching: bool) -> Tuple[str, Mapping[str, str]]:
+                                                 exact_matching: bool) -> Tuple[Pattern[str], Mapping[str, str]]:
+        key = (log_template, exact_matching)
+        cache = self.parameter_extraction_cache
+        entry = cache.get(key)
+        if entry is not None:
+            self.parameter_extraction_cache_hits += 1
+            return entry
+
+        self.parameter_extraction_cache_misses += 1
+        template_regex, param_group_name_to_mask_name = self._create_template_parameter_extraction_regex(
+            log_template, exact_matching)
+        entry = re.compile(template_regex), param_group_name_to_mask_name
+        if self.config.parameter_extraction_cache_capacity > 0:
+            cache[key] = entry
+        return entry
+
+    def _create_template_parameter_extraction_regex(self,
+                                                    log_template: str,
+                                                    exact_matching: bool) -> Tuple[str, Mapping[str, str]]:
         param_group_name_to_mask_name = {}
         param_name_counter = [0]
 
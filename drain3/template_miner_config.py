@@ -4,8 +4,9 @@ import ast
 import configparser
 import json
 import logging
-from typing import Collection, Optional
+from typing import Collection, Dict, Optional
 
+from drain3.compression import CompressionCodec, DEFAULT_CODECS
 from drain3.masking import AbstractMaskingInstruction, MaskingInstruction
 
 logger = logging.getLogger(__name__)
@@ -16,16 +17,33 @@ class TemplateMinerConfig:
         self.engine = "Drain"
         self.profiling_enabled = False
         self.profiling_report_sec = 60
+        self.profiling_type = "simple"
+        self.profiling_sample_interval = 1
         self.snapshot_interval_minutes = 5
         self.snapshot_compress_state = True
+        # overrides snapshot_compress_state if set
+        self.snapshot_compression = ""
+        self.snapshot_compression_level: Optional[int] = None
+        self.snapshot_base64 = True
+        # codec name -> codec, the codecs snapshots can be saved and loaded with
+        self.compression_codecs: Dict[str, CompressionCodec] = {codec.name: codec for codec in DEFAULT_CODECS}
+        self.snapshot_max_deltas = 0
+        self.snapshot_format = "json"
+        self.snapshot_background = False
+        self.snapshot_min_interval_sec = 0.0
+        self.snapshot_max_pending_changes = 0
+        self.snapshot_max_staleness_sec = 0.0
         self.drain_extra_delimiters: Collection[str] = []
         self.drain_sim_th = 0.4
         self.drain_depth = 4
         self.drain_max_children = 100
         self.drain_max_clusters: Optional[int] = None
+        self.drain_intern_tokens = False
+        self.drain_repeat_cache_size = 0
         self.masking_instructions: Collection[AbstractMaskingInstruction] = []
         self.mask_prefix = "<"
         self.mask_suffix = ">"
+        self.masking_combined = False
         self.parameter_extraction_cache_capacity = 3000
         self.parametrize_numeric_tokens = True
 
@@ -46,11 +64,28 @@ class TemplateMinerConfig:
                                                    fallback=self.profiling_enabled)
         self.profiling_report_sec = parser.getint(section_profiling, 'report_sec',
                                                   fallback=self.profiling_report_sec)
+        self.profiling_type = parser.get(section_profiling, 'type', fallback=self.profiling_type)
+        self.profiling_sample_interval = parser.getint(section_profiling, 'sample_interval',
+                                                       fallback=self.profiling_sample_interval)
 
         self.snapshot_interval_minutes = parser.getint(section_snapshot, 'snapshot_interval_minutes',
                                                        fallback=self.snapshot_interval_minutes)
         self.snapshot_compress_state = parser.getboolean(section_snapshot, 'compress_state',
                                                          fallback=self.snapshot_compress_state)
+        self.snapshot_compression = parser.get(section_snapshot, 'compression', fallback=self.snapshot_compression)
+        self.snapshot_compression_level = parser.getint(section_snapshot, 'compression_level',
+                                                        fallback=self.snapshot_compression_level)
+        self.snapshot_base64 = parser.getboolean(section_snapshot, 'base64', fallback=self.snapshot_base64)
+        self.snapshot_max_deltas = parser.getint(section_snapshot, 'max_deltas', fallback=self.snapshot_max_deltas)
+        self.snapshot_format = parser.get(section_snapshot, 'format', fallback=self.snapshot_format)
+        self.snapshot_background = parser.getboolean(section_snapshot, 'background',
+                                                     fallback=self.snapshot_background)
+        self.snapshot_min_interval_sec = parser.getfloat(section_snapshot, 'min_interval_sec',
+                                                         fallback=self.snapshot_min_interval_sec)
+        self.snapshot_max_pending_changes = parser.getint(section_snapshot, 'max_pending_changes',
+                                                          fallback=self.snapshot_max_pending_changes)
+        self.snapshot_max_staleness_sec = parser.getfloat(section_snapshot, 'max_staleness_sec',
+                                                          fallback=self.snapshot_max_staleness_sec)
 
         drain_extra_delimiters_str = parser.get(section_drain, 'extra_delimiters',
                                                 fallback=str(self.drain_extra_delimiters))
@@ -66,17 +101,38 @@ class TemplateMinerConfig:
                                                 fallback=self.drain_max_clusters)
         self.parametrize_numeric_tokens = parser.getboolean(section_drain, 'parametrize_numeric_tokens',
                                                             fallback=self.parametrize_numeric_tokens)
+        self.drain_intern_tokens = parser.getboolean(section_drain, 'intern_tokens',
+                                                     fallback=self.drain_intern_tokens)
+        self.drain_repeat_cache_size = parser.getint(section_drain, 'repeat_cache_size',
+                                                     fallback=self.drain_repeat_cache_size)
 
         masking_instructions_str = parser.get(section_masking, 'masking',
                                               fallback=str(self.masking_instructions))
         self.mask_prefix = parser.get(section_masking, 'mask_prefix', fallback=self.mask_prefix)
         self.mask_suffix = parser.get(section_masking, 'mask_suffix', fallback=self.mask_suffix)
+        self.masking_combined = parser.getboolean(section_masking, 'combined', fallback=self.masking_combined)
         self.parameter_extraction_cache_capacity = parser.getint(section_masking, 'parameter_extraction_cache_capacity',
                                                                  fallback=self.parameter_extraction_cache_capacity)
 
         masking_instructions = []
         masking_list = json.loads(masking_instructions_str)
         for mi in masking_list:
-            instruction = MaskingInstruction(mi['regex_pattern'], mi['mask_with'])
+            instruction = MaskingInstruction(mi['regex_pattern'], mi['mask_with'],
+                                             mi.get('required_literal'), mi.get('required_chars'))
             masking_instructions.append(instruction)
         self.masking_instructions = masking_instructions
+
+    def get_snapshot_codec(self) -> Optional[CompressionCodec]:
+        """
+        Return the codec to compress snapshots with, or None to not compress them.
+
+        :raises ValueError: if `snapshot_compression` is not a name of a codec in `compression_codecs`.
+        """
+        name = self.snapshot_compression or ("zlib" if self.snapshot_compress_state else "none")
+        if name == "none":
+            return None
+        codec = self.compression_codecs.get(name)
+        if codec is None:
+            raise ValueError(f"Invalid snapshot compression: {name}, "
+                             f"must be one of {['none'] + list(self.compression_codecs)}")
+        return codec
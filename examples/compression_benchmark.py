@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import random
+import sys
+import time
+from typing import Callable, Optional, Tuple
+
+from drain3 import TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+
+cluster_count = 50000
+snapshot_formats = ["json", "binary"]
+# compression, compression level
+codec_configs = [("none", None), ("zlib", 1), ("zlib", 6), ("zlib", 9), ("lzma", None), ("bz2", None)]
+repeat_count = 3
+
+
+def create_template_miner(snapshot_format: str, compression: str, compression_level: Optional[int]) -> TemplateMiner:
+    config = TemplateMinerConfig()
+    config.snapshot_format = snapshot_format
+    config.snapshot_compression = compression
+    config.snapshot_compression_level = compression_level
+    config.snapshot_base64 = False
+    return TemplateMiner(config=config)
+
+
+def create_clusters(template_miner: TemplateMiner) -> None:
+    rnd = random.Random(cluster_count)
+    words = [f"word{i}" for i in range(5000)] + ["<*>"] * 500
+    while len(template_miner.drain.id_to_cluster) < cluster_count:
+        tokens = [rnd.choice(words) for _ in range(rnd.randint(3, 15))]
+        cluster = template_miner.drain.create_cluster(tokens)
+        cluster.size = rnd.randint(1, 10000)
+
+
+def best_time(func: Callable[[], None]) -> float:
+    # best of several runs, to reduce the noise of other processes
+    best_sec = float("inf")
+    for _ in range(repeat_count):
+        start_time = time.time()
+        func()
+        best_sec = min(best_sec, time.time() - start_time)
+    return best_sec
+
+
+def run(snapshot_format: str, compression: str, compression_level: Optional[int]) -> Tuple[int, float, float]:
+    template_miner = create_template_miner(snapshot_format, compression, compression_level)
+    create_clusters(template_miner)
+    state = template_miner.dump_state()
+    save_sec = best_time(template_miner.dump_state)
+
+    restored_template_miner = create_template_miner(snapshot_format, compression, compression_level)
+    load_sec = best_time(lambda: restored_template_miner.restore_state(state))
+    if restored_template_miner.dump_state() != state:
+        raise RuntimeError("Restored model differs from the saved model")
+    return len(state), save_sec, load_sec
+
+
+logging.getLogger("drain3.template_miner").setLevel(logging.WARNING)
+logger.info(f"{cluster_count} clusters:")
+for snapshot_format in snapshot_formats:
+    for compression, compression_level in codec_configs:
+        size, save_sec, load_sec = run(snapshot_format, compression, compression_level)
+        name = f"{snapshot_format}, {compression}{'' if compression_level is None else f' {compression_level}'}"
+        logger.info(f"  {name:<20} {size / 1024:>10.1f} KB, save {save_sec:>7.3f} sec, load {load_sec:>7.3f} sec")
@@ -0,0 +1,62 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import subprocess
+import sys
+import time
+from os.path import dirname
+
+from drain3 import TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+
+in_gz_file = "SSH.tar.gz"
+in_log_file = "SSH.log"
+if not os.path.isfile(in_log_file):
+    logger.info(f"Downloading file {in_gz_file}")
+    p = subprocess.Popen(f"curl https://zenodo.org/record/3227177/files/{in_gz_file} --output {in_gz_file}", shell=True)
+    p.wait()
+    logger.info(f"Extracting file {in_gz_file}")
+    p = subprocess.Popen(f"tar -xvzf {in_gz_file}", shell=True)
+    p.wait()
+
+batch_size = 10000
+
+with open(in_log_file) as f:
+    lines = [line.rstrip().partition(": ")[2] for line in f]
+
+
+def create_template_miner() -> TemplateMiner:
+    config = TemplateMinerConfig()
+    config.load(f"{dirname(__file__)}/drain3.ini")
+    config.profiling_enabled = False
+    return TemplateMiner(config=config)
+
+
+template_miner = create_template_miner()
+start_time = time.time()
+per_line_results = []
+for line in lines:
+    result = template_miner.add_log_message(line)
+    per_line_results.append((result["cluster_id"], result["change_type"]))
+per_line_sec = time.time() - start_time
+
+template_miner = create_template_miner()
+start_time = time.time()
+batch_results = []
+for i in range(0, len(lines), batch_size):
+    batch_results.extend(template_miner.add_log_messages(lines[i:i + batch_size]))
+batch_sec = time.time() - start_time
+
+if batch_results != per_line_results:
+    raise RuntimeError("Batch ingestion produced different results than per-line ingestion")
+
+per_line_rate = len(lines) / per_line_sec
+batch_rate = len(lines) / batch_sec
+logger.info(f"Processed {len(lines)} lines, {len(template_miner.drain.clusters)} clusters")
+logger.info(f"add_log_message():  {per_line_sec:>8.2f} sec, {per_line_rate:>12,.1f} lines/sec")
+logger.info(f"add_log_messages(): {batch_sec:>8.2f} sec, {batch_rate:>12,.1f} lines/sec "
+            f"(batch size {batch_size}, {batch_rate / per_line_rate:.2f}x)")
@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import random
+import sys
+import time
+from typing import Collection, Optional, Sequence
+
+from drain3.drain import Drain, DrainBase, LogCluster
+from drain3.jaccard_drain import JaccardDrain
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+
+leaf_sizes = [10, 50, 100, 500, 1000]
+query_count = 2000
+token_count = 12
+
+
+def full_scan_fast_match(drain: DrainBase,
+                         cluster_ids: Collection[int],
+                         tokens: Sequence[str],
+                         sim_th: float,
+                         include_params: bool) -> Optional[LogCluster]:
+    # fast_match() as it was before bounded scoring, as a reference
+    max_sim: float = -1
+    max_param_count = -1
+    max_cluster = None
+    for cluster_id in cluster_ids:
+        cluster = drain.id_to_cluster.get(cluster_id)
+        if cluster is None:
+            continue
+        cur_sim, param_count = drain.get_seq_distance(cluster.log_template_tokens, tokens, include_params)
+        if cur_sim > max_sim or (cur_sim == max_sim and param_count > max_param_count):
+            max_sim = cur_sim
+            max_param_count = param_count
+            max_cluster = cluster
+    return max_cluster if max_sim >= sim_th else None
+
+
+def create_leaf(drain: DrainBase, leaf_size: int, rnd: random.Random) -> None:
+    # all messages share a prefix, so their clusters end up in a single leaf
+    while len(drain.id_to_cluster) < leaf_size:
+        tokens = ["event", "from"] + [f"w{rnd.randrange(10000)}" for _ in range(token_count - 2)]
+        drain.create_cluster(tokens)
+
+
+def run(drain: DrainBase, leaf_size: int, include_params: bool) -> None:
+    rnd = random.Random(leaf_size)
+    create_leaf(drain, leaf_size, rnd)
+    cluster_ids = list(drain.id_to_cluster.keys())
+    templates = [list(c.log_template_tokens) for c in drain.id_to_cluster.values()]
+    queries = []
+    for _ in range(query_count):
+        tokens = list(rnd.choice(templates))
+        # half of the queries are exact matches, the other half have a few tokens replaced
+        if rnd.random() < 0.5:
+            for _ in range(rnd.randrange(1, 6)):
+                tokens[rnd.randrange(token_count)] = f"x{rnd.randrange(10000)}"
+        queries.append(tokens)
+
+    start_time = time.time()
+    full_scan_results = [full_scan_fast_match(drain, cluster_ids, q, drain.sim_th, include_params) for q in queries]
+    full_scan_sec = time.time() - start_time
+
+    start_time = time.time()
+    bounded_results = [drain.fast_match(cluster_ids, q, drain.sim_th, include_params) for q in queries]
+    bounded_sec = time.time() - start_time
+
+    if bounded_results != full_scan_results:
+        raise RuntimeError("Bounded fast_match() returned a different cluster than a full scan")
+
+    logger.info(f"{type(drain).__name__:<12} leaf size {leaf_size:>5}, include_params={include_params!s:<5}: "
+                f"full scan {full_scan_sec * 1e6 / query_count:>9.1f} us/msg, "
+                f"bounded {bounded_sec * 1e6 / query_count:>9.1f} us/msg "
+                f"({full_scan_sec / bounded_sec:.2f}x)")
+
+
+for drain_class in (Drain, JaccardDrain):
+    for include_params in (False, True):
+        for leaf_size in leaf_sizes:
+            run(drain_class(sim_th=0.4), leaf_size, include_params)
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import random
+import re
+import sys
+import time
+from os.path import dirname
+from typing import Callable, Dict, List, Tuple
+
+from drain3 import TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+
+template_count = 20000
+message_count = 100000
+cache_capacities = [0, 1000, 3000, 30000]
+repeat_count = 3
+
+config = TemplateMinerConfig()
+config.load(f"{dirname(__file__)}/drain3.ini")
+config.profiling_enabled = False
+
+# a parameter of each mask, as it appears in log messages
+mask_values: Dict[str, Callable[[random.Random], str]] = {
+    "NUM": lambda rnd: str(rnd.randint(0, 100000)),
+    "IP": lambda rnd: ".".join(str(rnd.randint(0, 255)) for _ in range(4)),
+    "HEX": lambda rnd: hex(rnd.randint(0, 2 ** 32)),
+    "*": lambda rnd: rnd.choice(["alice", "bob", "carol", "dave"]) + str(rnd.randint(0, 99)),
+}
+
+
+def create_templates(rnd: random.Random) -> List[Tuple[str, str]]:
+    """
+    Return log templates with a mix of masks, each with a log message of the template.
+    """
+    words = [f"word{i}" for i in range(2000)]
+    templates = []
+    for _ in range(template_count):
+        template_tokens = []
+        message_tokens = []
+        for _ in range(rnd.randint(4, 16)):
+            if rnd.random() < 0.25:
+                mask_name = rnd.choice(list(mask_values))
+                template_tokens.append(f"{config.mask_prefix}{mask_name}{config.mask_suffix}")
+                message_tokens.append(mask_values[mask_name](rnd))
+            else:
+                word = rnd.choice(words)
+                template_tokens.append(word)
+                message_tokens.append(word)
+        templates.append((" ".join(template_tokens), " ".join(message_tokens)))
+    return templates
+
+
+def best_time(func: Callable[[], None]) -> float:
+    # best of several runs, to reduce the noise of other processes
+    best_sec = float("inf")
+    for _ in range(repeat_count):
+        start_time = time.time()
+        func()
+        best_sec = min(best_sec, time.time() - start_time)
+    return best_sec
+
+
+rnd = random.Random(0)
+templates = create_templates(rnd)
+# a few templates are much more frequent than the rest, as in real logs
+messages = rnd.choices(templates, weights=[1 / (i + 1) for i in range(len(templates))], k=message_count)
+
+logging.getLogger("drain3.template_miner").setLevel(logging.WARNING)
+logger.info(f"Extracting parameters of {message_count} messages of {template_count} templates")
+
+# the regex source strings are cached, and compiled patterns are cached by the re module only
+template_miner = TemplateMiner(config=config)
+regex_sources: Dict[Tuple[str, bool], Tuple[str, object]] = {}
+
+
+def extract_source_cache() -> None:
+    for template, message in messages:
+        key = (template, True)
+        if key not in regex_sources:
+            regex_sources[key] = template_miner._create_template_parameter_extraction_regex(template, True)
+        re.match(regex_sources[key][0], message)
+
+
+source_cache_sec = best_time(extract_source_cache)
+logger.info(f"  regex source cache:     {source_cache_sec / message_count * 1e6:>8.2f} us/message")
+
+for capacity in cache_capacities:
+    config.parameter_extraction_cache_capacity = capacity
+    template_miner = TemplateMiner(config=config)
+
+    def extract_regex() -> None:
+        for template, message in messages:
+            if template_miner._extract_parameters_by_regex(template, message, True) is None:
+                raise RuntimeError(f"Template {template} does not match message {message}")
+
+    sec = best_time(extract_regex)
+    hits = template_miner.parameter_extraction_cache_hits
+    hit_ratio = hits / (hits + template_miner.parameter_extraction_cache_misses)
+    logger.info(f"  compiled cache {capacity:>7}: {sec / message_count * 1e6:>8.2f} us/message "
+                f"({source_cache_sec / sec:.2f}x), {hit_ratio:.2%} hits")
+
+for capacity in cache_capacities:
+    config.parameter_extraction_cache_capacity = capacity
+    template_miner = TemplateMiner(config=config)
+
+    def extract() -> None:
+        for template, message in messages:
+            if template_miner.extract_parameters(template, message) is None:
+                raise RuntimeError(f"Template {template} does not match message {message}")
+
+    sec = best_time(extract)
+    fallback_ratio = template_miner.parameter_extraction_fallback_count / (message_count * repeat_count)
+    logger.info(f"  token-aligned  {capacity:>7}: {sec / message_count * 1e6:>8.2f} us/message "
+                f"({source_cache_sec / sec:.2f}x), {fallback_ratio:.2%} extracted by regex")
+
+# mining the templates and extracting the parameters, separately or from the masks
+for capacity in [0, 3000]:
+    config.parameter_extraction_cache_capacity = capacity
+
+    def add_and_extract() -> None:
+        template_miner = TemplateMiner(config=config)
+        for _, message in messages:
+            result = template_miner.add_log_message(message)
+            template_miner.extract_parameters(str(result["template_mined"]), message)
+
+    def add_with_parameters() -> None:
+        template_miner = TemplateMiner(config=config)
+        for _, message in messages:
+            template_miner.add_log_message_with_parameters(message)
+
+    add_and_extract_sec = best_time(add_and_extract)
+    sec = best_time(add_with_parameters)
+    logger.info(f"  add + extract  {capacity:>7}: {add_and_extract_sec / message_count * 1e6:>8.2f} us/message, "
+                f"add with parameters: {sec / message_count * 1e6:>8.2f} us/message "
+                f"({add_and_extract_sec / sec:.2f}x)")
@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+from drain3.masking import LogMasker, MaskingInstruction
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+
+in_gz_file = "SSH.tar.gz"
+in_log_file = "SSH.log"
+if not os.path.isfile(in_log_file):
+    logger.info(f"Downloading file {in_gz_file}")
+    p = subprocess.Popen(f"curl https://zenodo.org/record/3227177/files/{in_gz_file} --output {in_gz_file}", shell=True)
+    p.wait()
+    logger.info(f"Extracting file {in_gz_file}")
+    p = subprocess.Popen(f"tar -xvzf {in_gz_file}", shell=True)
+    p.wait()
+
+# the examples at the bottom of masking.py
+masking_instructions = [
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(([0-9a-f]{2,}:){3,}([0-9a-f]{2,}))((?=[^A-Za-z0-9])|$)', "ID"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})((?=[^A-Za-z0-9])|$)', "IP"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([0-9a-f]{6,} ?){3,}((?=[^A-Za-z0-9])|$)', "SEQ"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([0-9A-F]{4} ?){4,}((?=[^A-Za-z0-9])|$)', "SEQ"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(0x[a-f0-9A-F]+)((?=[^A-Za-z0-9])|$)', "HEX"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([\-\+]?\d+)((?=[^A-Za-z0-9])|$)', "NUM"),
+    MaskingInstruction(r'(?<=executed cmd )(".+?")', "CMD"),
+]
+repeat_count = 3
+
+with open(in_log_file) as f:
+    lines = [line.rstrip().partition(": ")[2] for line in f]
+
+
+def run(masker: LogMasker) -> float:
+    # best of several runs, to reduce the noise of other processes
+    best_sec = float("inf")
+    for _ in range(repeat_count):
+        start_time = time.time()
+        for line in lines:
+            masker.mask(line)
+        best_sec = min(best_sec, time.time() - start_time)
+    return best_sec
+
+
+unfiltered_instructions = [MaskingInstruction(mi.pattern, mi.mask_with, "", "") for mi in masking_instructions]
+unfiltered_masker = LogMasker(unfiltered_instructions, "<:", ":>")
+sequential_masker = LogMasker(masking_instructions, "<:", ":>")
+combined_masker = LogMasker(masking_instructions, "<:", ":>", combined=True)
+sequential_results: List[str] = [sequential_masker.mask(line) for line in lines]
+if [unfiltered_masker.mask(line) for line in lines] != sequential_results:
+    raise RuntimeError("Masking without prefilters produced different results")
+if [combined_masker.mask(line) for line in lines] != sequential_results:
+    raise RuntimeError("Combined masking produced different results than sequential masking")
+
+unfiltered_sec = run(unfiltered_masker)
+sequential_masker.prefilter_skip_counts = [0] * len(masking_instructions)
+sequential_masker.sequential_mask_count = 0
+sequential_sec = run(sequential_masker)
+assert combined_masker.combined_masker is not None
+combined_masker.combined_masker.fallback_count = 0
+combined_sec = run(combined_masker)
+fallback_ratio = combined_masker.combined_masker.fallback_count / (len(lines) * repeat_count)
+
+logger.info(f"Masked {len(lines)} lines with {len(masking_instructions)} instructions")
+logger.info(f"no prefilters: {unfiltered_sec:>8.2f} sec, {unfiltered_sec / len(lines) * 1e6:>8.2f} us/line")
+logger.info(f"sequential:    {sequential_sec:>8.2f} sec, {sequential_sec / len(lines) * 1e6:>8.2f} us/line "
+            f"({unfiltered_sec / sequential_sec:.2f}x)")
+logger.info(f"combined:      {combined_sec:>8.2f} sec, {combined_sec / len(lines) * 1e6:>8.2f} us/line "
+            f"({unfiltered_sec / combined_sec:.2f}x, {fallback_ratio:.2%} of lines masked sequentially)")
+for mi, skip_count in zip(masking_instructions, sequential_masker.prefilter_skip_counts):
+    prefilter = repr(mi.required_literal) if mi.required_literal else f"[{mi.required_chars}]"
+    logger.info(f"{mi.mask_with:>4} prefilter {prefilter:<20} skipped {skip_count / (len(lines) * repeat_count):>7.2%} "
+                f"of lines")
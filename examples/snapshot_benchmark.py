@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: MIT
+
+import logging
+import random
+import sys
+import time
+from typing import Callable, Tuple
+
+from drain3 import TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+
+cluster_counts = [1000, 10000, 100000]
+snapshot_configs = [("json", True), ("binary", False), ("binary", True)]
+repeat_count = 3
+
+
+def create_template_miner(snapshot_format: str, compress_state: bool) -> TemplateMiner:
+    config = TemplateMinerConfig()
+    config.snapshot_format = snapshot_format
+    config.snapshot_compress_state = compress_state
+    return TemplateMiner(config=config)
+
+
+def create_clusters(template_miner: TemplateMiner, cluster_count: int) -> None:
+    rnd = random.Random(cluster_count)
+    words = [f"word{i}" for i in range(5000)] + ["<*>"] * 500
+    while len(template_miner.drain.id_to_cluster) < cluster_count:
+        tokens = [rnd.choice(words) for _ in range(rnd.randint(3, 15))]
+        cluster = template_miner.drain.create_cluster(tokens)
+        cluster.size = rnd.randint(1, 10000)
+
+
+def best_time(func: Callable[[], None]) -> float:
+    # best of several runs, to reduce the noise of other processes
+    best_sec = float("inf")
+    for _ in range(repeat_count):
+        start_time = time.time()
+        func()
+        best_sec = min(best_sec, time.time() - start_time)
+    return best_sec
+
+
+def run(cluster_count: int, snapshot_format: str, compress_state: bool) -> Tuple[int, float, float]:
+    template_miner = create_template_miner(snapshot_format, compress_state)
+    create_clusters(template_miner, cluster_count)
+    state = template_miner.dump_state()
+    save_sec = best_time(template_miner.dump_state)
+
+    restored_template_miner = create_template_miner(snapshot_format, compress_state)
+    load_sec = best_time(lambda: restored_template_miner.restore_state(state))
+    if restored_template_miner.dump_state() != state:
+        raise RuntimeError("Restored model differs from the saved model")
+    return len(state), save_sec, load_sec
+
+
+logging.getLogger("drain3.template_miner").setLevel(logging.WARNING)
+for cluster_count in cluster_counts:
+    logger.info(f"{cluster_count} clusters:")
+    for snapshot_format, compress_state in snapshot_configs:
+        size, save_sec, load_sec = run(cluster_count, snapshot_format, compress_state)
+        name = f"{snapshot_format}{', compressed' if compress_state else ''}"
+        logger.info(f"  {name:<20} {size / 1024:>10.1f} KB, save {save_sec:>7.3f} sec, load {load_sec:>7.3f} sec")
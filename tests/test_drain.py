@@ -1,8 +1,13 @@
 # SPDX-License-Identifier: MIT
 
+import random
+import sys
 import unittest
 
+import jsonpickle
+
 from drain3.drain import Drain, LogCluster
+from drain3.simple_profiler import NullProfiler, SimpleProfiler
 
 
 class DrainTest(unittest.TestCase):
@@ -271,4 +276,181 @@ class DrainTest(unittest.TestCase):
         self.assertListEqual(seq1, template)
 
         # Test for equal lengths input vectors
-        self.assertRaises(AssertionError, model.create_template, seq1, ["aa"])
\ No newline at end of file
+        self.assertRaises(AssertionError, model.create_template, seq1, ["aa"])
+
+    def test_add_log_messages(self):
+        entries = str.splitlines(
+            """
+            Dec 10 07:07:38 LabSZ sshd[24206]: input_userauth_request: invalid user test9 [preauth]
+            Dec 10 07:08:28 LabSZ sshd[24208]: input_userauth_request: invalid user webmaster [preauth]
+            Dec 10 09:12:32 LabSZ sshd[24490]: Failed password for invalid user ftpuser from 0.0.0.0 port 62891 ssh2
+            Dec 10 09:12:35 LabSZ sshd[24492]: Failed password for invalid user pi from 0.0.0.0 port 49289 ssh2
+            Dec 10 09:12:44 LabSZ sshd[24501]: Failed password for invalid user ftpuser from 0.0.0.0 port 60836 ssh2
+            Dec 10 07:28:03 LabSZ sshd[24245]: input_userauth_request: invalid user pgadmin [preauth]
+            """
+        )
+        model = Drain()
+        expected = []
+        for entry in entries:
+            cluster, change_type = model.add_log_message(entry)
+            expected.append((cluster.cluster_id, change_type))
+
+        batch_model = Drain()
+        actual = batch_model.add_log_messages(iter(entries))
+
+        self.assertListEqual(expected, actual)
+        self.assertListEqual([c.get_template() for c in model.clusters],
+                             [c.get_template() for c in batch_model.clusters])
+        self.assertEqual(8, batch_model.get_total_cluster_size())
+
+    def test_intern_tokens(self):
+        entries = [
+            "user alice logged in from web",
+            "user bob logged in from web",
+            "user carol logged out",
+            "disk sda1 is full",
+            "disk sdb2 is full",
+        ]
+        model = Drain()
+        interned_model = Drain(intern_tokens=True)
+        for entry in entries:
+            cluster, change_type = model.add_log_message(entry)
+            interned_cluster, interned_change_type = interned_model.add_log_message(entry)
+            self.assertEqual(cluster.cluster_id, interned_cluster.cluster_id)
+            self.assertEqual(change_type, interned_change_type)
+            self.assertEqual(cluster.get_template(), interned_cluster.get_template())
+
+        for cluster in interned_model.clusters:
+            for token in cluster.log_template_tokens:
+                self.assertIs(sys.intern(token), token)
+
+        # tokens are shared between clusters and prefix tree keys
+        first_layer_node = interned_model.root_node.key_to_child_node["6"]
+        user_key = next(iter(first_layer_node.key_to_child_node.keys()))
+        self.assertIs(interned_model.id_to_cluster[1].log_template_tokens[0], user_key)
+
+    def test_repeat_cache(self):
+        entries = [
+            "A format 1",
+            "A format 2",
+            "B format 1",
+            "B format 2",
+            "A format 3",
+            "A format 3",
+            "B format 2",
+            "A format 3",
+        ]
+        for max_clusters in [1, None]:
+            model = Drain(max_clusters=max_clusters)
+            cached_model = Drain(max_clusters=max_clusters, repeat_cache_size=10)
+            for entry in entries:
+                cluster, change_type = model.add_log_message(entry)
+                cached_cluster, cached_change_type = cached_model.add_log_message(entry)
+                self.assertEqual(cluster.cluster_id, cached_cluster.cluster_id)
+                self.assertEqual(change_type, cached_change_type)
+                self.assertEqual(cluster.get_template(), cached_cluster.get_template())
+            self.assertEqual(model.get_total_cluster_size(), cached_model.get_total_cluster_size())
+
+        self.assertEqual(2, cached_model.repeat_cache_hits)
+        self.assertNotIn("\"repeat_cache\"", jsonpickle.dumps(cached_model, keys=True))
+
+    def test_repeat_cache_invalidation(self):
+        model = Drain(repeat_cache_size=10)
+        model.add_log_message("a b c d")
+        self.assertEqual("cluster_template_changed", model.add_log_message("a b y z")[1])
+        self.assertEqual([(1, "none"), (1, "none")], model.add_log_messages(["a b y z", "a b y z"]))
+        self.assertEqual(1, model.repeat_cache_hits)
+
+        # the new cluster is a better match for the cached message than the cluster it was added to before
+        cluster, change_type = model.add_log_message("a q y z")
+        self.assertEqual((2, "cluster_created"), (cluster.cluster_id, change_type))
+        cluster, change_type = model.add_log_message("a b y z")
+        self.assertEqual((2, "cluster_template_changed"), (cluster.cluster_id, change_type))
+        self.assertEqual("a <*> y z", cluster.get_template())
+
+    def test_fast_match_full_match_with_more_params(self):
+        model = Drain()
+        model.create_cluster(["a", "b", "c"])
+        model.create_cluster(["a", "<*>", "c"])
+        tokens = ["a", "b", "c"]
+        self.assertEqual(2, model.fast_match([1, 2], tokens, 0.4, include_params=True).cluster_id)
+        self.assertEqual(1, model.fast_match([1, 2], tokens, 0.4, include_params=False).cluster_id)
+
+    def test_fast_match_same_as_full_scan(self):
+        rnd = random.Random(0)
+        vocabulary = ["a", "b", "c", "d", "<*>"]
+        model = Drain()
+        for _ in range(50):
+            model.create_cluster([rnd.choice(vocabulary) for _ in range(6)])
+        cluster_ids = list(model.id_to_cluster.keys())
+        for _ in range(500):
+            tokens = [rnd.choice(vocabulary) for _ in range(6)]
+            for sim_th in [0.0, 0.5, 0.8, 1.0]:
+                for include_params in [False, True]:
+                    expected = full_scan_fast_match(model, cluster_ids, tokens, sim_th, include_params)
+                    actual = model.fast_match(cluster_ids, tokens, sim_th, include_params)
+                    self.assertIs(expected, actual)
+
+    def test_match_backtrack(self):
+        model = Drain(depth=5)
+        model.add_log_message("a 1 x")
+        model.add_log_message("a 2 x")
+        model.add_log_message("a b y")
+        # tree search follows the exact token "b" only, and does not reach "a <*> x" under the wildcard node
+        self.assertIsNone(model.match("a b x", "never"))
+        self.assertEqual(1, model.match("a b x", "backtrack").cluster_id)
+        self.assertEqual(2, model.match("a b y", "backtrack").cluster_id)
+        self.assertIsNone(model.match("a c y", "backtrack"))
+
+    def test_match_backtrack_same_as_always(self):
+        rnd = random.Random(0)
+        vocabulary = ["a", "b", "c", "d", "e", "1", "2"]
+        model = Drain(depth=5, max_children=3)
+        for _ in range(300):
+            model.add_log_message(" ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(0, 5))))
+
+        for _ in range(1000):
+            content = " ".join(rnd.choice(vocabulary + ["<*>"]) for _ in range(rnd.randint(0, 5)))
+            expected = model.match(content, "always")
+            self.assertIs(expected, model.match(content, "backtrack"))
+
+    def test_get_clusters_ids_for_seq_len(self):
+        model = Drain(max_clusters=3)
+        for entry in ["a b", "c d", "a b c", "e f", "a b c d"]:
+            model.add_log_message(entry)
+        # clusters 1 and 2 were evicted
+        self.assertEqual([4], list(model.get_clusters_ids_for_seq_len(2)))
+        self.assertEqual([3], list(model.get_clusters_ids_for_seq_len(3)))
+        self.assertEqual([5], list(model.get_clusters_ids_for_seq_len(4)))
+        self.assertEqual([], list(model.get_clusters_ids_for_seq_len(5)))
+
+        restored_model = jsonpickle.loads(jsonpickle.dumps(model, keys=True), keys=True)
+        self.assertNotIn("first_layer_cluster_ids", jsonpickle.dumps(model, keys=True))
+        self.assertEqual(model.first_layer_cluster_ids, restored_model.first_layer_cluster_ids)
+        self.assertEqual(model.cluster_id_to_first_layer_key, restored_model.cluster_id_to_first_layer_key)
+
+    def test_copy_for_snapshot(self):
+        model = Drain(profiler=SimpleProfiler(printer=lambda text: None))
+        for entry in ["a b", "a c", "d e f"]:
+            model.add_log_message(entry)
+        model_copy = model.copy_for_snapshot()
+        # the profiler keeps changing while the copy is saved
+        self.assertIsInstance(model_copy.profiler, NullProfiler)
+        self.assertIsInstance(model.profiler, SimpleProfiler)
+
+        model.add_log_message("a d")
+        model.add_log_message("g h")
+        self.assertEqual(["a <*>", "d e f"], [cluster.get_template() for cluster in model_copy.clusters])
+        self.assertEqual(2, model_copy.id_to_cluster[1].size)
+
+
+def full_scan_fast_match(model, cluster_ids, tokens, sim_th, include_params):
+    max_sim = -1
+    max_param_count = -1
+    max_cluster = None
+    for cluster_id in cluster_ids:
+        cluster = model.id_to_cluster[cluster_id]
+        cur_sim, param_count = model.get_seq_distance(cluster.log_template_tokens, tokens, include_params)
+        if cur_sim > max_sim or (cur_sim == max_sim and param_count > max_param_count):
+            max_sim, max_param_count, max_cluster = cur_sim, param_count, cluster
+    return max_cluster if max_sim >= sim_th else None
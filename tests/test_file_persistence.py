@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+
+from drain3.file_persistence import FilePersistence
+
+
+class FilePersistenceTest(unittest.TestCase):
+
+    def test_save_load_deltas(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = FilePersistence(os.path.join(temp_dir, "state.bin"))
+            self.assertIsNone(persistence.load_state())
+            self.assertEqual([], persistence.load_deltas())
+            # deltas can only be appended to a saved or loaded state
+            self.assertFalse(persistence.append_delta(b"delta0"))
+
+            persistence.save_state(b"state1")
+            self.assertTrue(persistence.append_delta(b"delta1"))
+            self.assertTrue(persistence.append_delta(b""))
+            self.assertEqual(b"state1", persistence.load_state())
+            self.assertEqual([b"delta1", b""], persistence.load_deltas())
+
+            # saving a state discards the deltas
+            persistence.save_state(b"state2")
+            self.assertEqual(b"state2", persistence.load_state())
+            self.assertEqual([], persistence.load_deltas())
+            # no temporary files are left, and the journal is only written once deltas are appended
+            self.assertEqual(["state.bin"], sorted(os.listdir(temp_dir)))
+            self.assertTrue(persistence.append_delta(b"delta2"))
+            self.assertEqual([b"delta2"], persistence.load_deltas())
+            self.assertEqual(["state.bin", "state.bin.deltas"], sorted(os.listdir(temp_dir)))
+
+    def test_partial_delta_is_truncated(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = FilePersistence(os.path.join(temp_dir, "state.bin"), sync_deltas=0)
+            persistence.save_state(b"state1")
+            persistence.append_delta(b"delta1")
+            with open(persistence.deltas_file_path, "ab") as f:
+                f.write(b"\x00\x00\x00\x09\x00\x00\x00\x00delta")
+
+            with open(persistence.deltas_file_path, "rb") as f:
+                journal = f.read()
+
+            persistence = FilePersistence(persistence.file_path)
+            self.assertEqual(b"state1", persistence.load_state())
+            self.assertEqual([b"delta1"], persistence.load_deltas())
+            # loading does not write to the journal
+            with open(persistence.deltas_file_path, "rb") as f:
+                self.assertEqual(journal, f.read())
+            # deltas appended after the partial record are loaded
+            persistence.append_delta(b"delta2")
+            self.assertEqual([b"delta1", b"delta2"], persistence.load_deltas())
+
+    def test_journal_of_older_state_is_ignored(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = FilePersistence(os.path.join(temp_dir, "state.bin"))
+            persistence.save_state(b"state1")
+            persistence.append_delta(b"delta1")
+            # a crash after the state was replaced, but before the journal was
+            persistence.write_atomic(persistence.file_path, b"state2")
+
+            persistence = FilePersistence(persistence.file_path)
+            self.assertEqual(b"state2", persistence.load_state())
+            self.assertEqual([], persistence.load_deltas())
+
+    def test_delta_is_appended_after_journal_of_older_state(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = FilePersistence(os.path.join(temp_dir, "state.bin"))
+            persistence.save_state(b"state1")
+            persistence.append_delta(b"delta1")
+            with open(persistence.deltas_file_path, "rb") as f:
+                journal = f.read()
+            persistence.save_state(b"state2")
+            # a crash after the state was replaced, but before the journal was removed
+            persistence.write_atomic(persistence.deltas_file_path, journal)
+
+            persistence = FilePersistence(persistence.file_path)
+            self.assertEqual(b"state2", persistence.load_state())
+            self.assertEqual([], persistence.load_deltas())
+            self.assertTrue(persistence.append_delta(b"delta2"))
+
+            persistence = FilePersistence(persistence.file_path)
+            self.assertEqual(b"state2", persistence.load_state())
+            self.assertEqual([b"delta2"], persistence.load_deltas())
+
+    def test_delta_is_appended_without_loading_deltas(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = FilePersistence(os.path.join(temp_dir, "state.bin"))
+            persistence.save_state(b"state1")
+            persistence.append_delta(b"delta1")
+
+            persistence = FilePersistence(persistence.file_path)
+            self.assertEqual(b"state1", persistence.load_state())
+            self.assertTrue(persistence.append_delta(b"delta2"))
+            self.assertEqual([b"delta1", b"delta2"], persistence.load_deltas())
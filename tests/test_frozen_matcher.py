@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import random
+import tempfile
+import unittest
+
+from drain3 import TemplateMiner
+from drain3.frozen_matcher import FrozenMatcher, dump_frozen_matcher
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class FrozenMatcherTest(unittest.TestCase):
+
+    def test_match(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc", "<*>", "ünï"]
+        strategies = ["never", "fallback", "always", "backtrack"]
+        for max_clusters in [None, 20]:
+            with self.subTest(max_clusters=max_clusters):
+                config = TemplateMinerConfig()
+                config.drain_max_clusters = max_clusters
+                config.drain_depth = 5
+                template_miner = TemplateMiner(config=config)
+                rnd = random.Random(0)
+                for _ in range(500):
+                    words_count = rnd.randint(0, 6)
+                    template_miner.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                matcher = FrozenMatcher(dump_frozen_matcher(template_miner.drain), config)
+
+                for _ in range(500):
+                    words_count = rnd.randint(0, 7)
+                    log_message = " ".join(rnd.choice(words + ["new"]) for _ in range(words_count))
+                    for strategy in strategies:
+                        expected = template_miner.match(log_message, strategy)
+                        actual = matcher.match(log_message, strategy)
+                        if expected is None:
+                            self.assertIsNone(actual, (log_message, strategy))
+                        else:
+                            self.assertEqual((expected.cluster_id, expected.size, expected.log_template_tokens),
+                                             (actual.cluster_id, actual.size, actual.log_template_tokens),
+                                             (log_message, strategy))
+
+    def test_load_file(self):
+        config = TemplateMinerConfig()
+        config.load(f"{os.path.dirname(__file__)}/drain3_test.ini")
+        template_miner = TemplateMiner(config=config)
+        template_miner.add_log_message("user alice logged in from 10.0.0.1")
+        template_miner.add_log_message("user bob logged in from 10.0.0.2")
+        template_miner.add_log_message("disk_full on host1")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "drain3.frozen")
+            with open(file_path, "wb") as f:
+                f.write(dump_frozen_matcher(template_miner.drain))
+            matcher = FrozenMatcher.load(file_path, config)
+
+            cluster = matcher.match("user carol logged in from 10.0.0.3")
+            self.assertEqual(1, cluster.cluster_id)
+            self.assertEqual(2, cluster.size)
+            self.assertEqual("user <*> logged in from <IP>", cluster.get_template())
+            self.assertIsNone(matcher.match("user carol logged out"))
+            self.assertEqual(2, matcher.match("disk_full on host1").cluster_id)
+
+            log_message = "user carol logged in from 10.0.0.3"
+            self.assertEqual(template_miner.extract_parameters(cluster.get_template(), log_message),
+                             matcher.extract_parameters(cluster.get_template(), log_message))
+            del matcher
+
+        config = TemplateMinerConfig()
+        config.mask_prefix = "{"
+        with self.assertRaises(ValueError):
+            FrozenMatcher(dump_frozen_matcher(template_miner.drain), config)
+        with self.assertRaises(ValueError):
+            FrozenMatcher(b"not a frozen matcher")
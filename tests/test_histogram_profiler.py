@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: MIT
+
+import unittest
+
+from drain3 import TemplateMiner
+from drain3.histogram_profiler import get_bucket_bounds, get_bucket_index, HistogramProfiler, HistogramSectionStats
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class HistogramProfilerTest(unittest.TestCase):
+
+    def test_buckets(self):
+        prev_index = 0
+        for latency_ns in list(range(100000)) + [10 ** 9 + 7, 2 ** 63 - 1]:
+            index = get_bucket_index(latency_ns)
+            lowest, highest = get_bucket_bounds(index)
+            self.assertTrue(lowest <= latency_ns <= highest, latency_ns)
+            self.assertLessEqual(highest - lowest, lowest / 8)
+            self.assertGreaterEqual(index, prev_index)
+            prev_index = index
+
+    def test_percentiles(self):
+        stats = HistogramSectionStats("section")
+        for latency_ns in range(1000, 101000, 1000):
+            stats.add(latency_ns)
+        self.assertEqual(100, stats.sample_count)
+        # within the bucket of the percentile
+        self.assertTrue(50000 <= stats.get_percentile_ns(50) <= 50000 * 9 / 8)
+        self.assertTrue(90000 <= stats.get_percentile_ns(90) <= 90000 * 9 / 8)
+        self.assertTrue(99000 <= stats.get_percentile_ns(99) <= 100000)
+        self.assertEqual(100000, stats.get_percentile_ns(100))
+        report = stats.get_report()
+        self.assertEqual(50.5, report.mean_us)
+        self.assertEqual(100, report.max_us)
+        self.assertEqual(0, HistogramSectionStats("section").get_percentile_ns(50))
+
+    def test_sections(self):
+        profiler = HistogramProfiler(sample_interval=3)
+        for _ in range(9):
+            profiler.start_section("total")
+            profiler.start_section("mask")
+            profiler.end_section()
+            profiler.start_section("drain")
+            profiler.start_section("tree_search")
+            profiler.end_section()
+            profiler.end_section("drain")
+            profiler.end_section("total")
+        # a section which was not ended, and sections which were not started
+        profiler.start_section("total")
+        profiler.start_section("mask")
+        profiler.end_section("total")
+        profiler.end_section("drain")
+        profiler.end_section()
+
+        section_reports = {section_report.section_name: section_report for section_report in profiler.get_report()}
+        self.assertEqual(["drain", "mask", "total", "tree_search"], sorted(section_reports))
+        # calls 1, 4 and 7, and the 10th call without its mask section
+        self.assertEqual(4, section_reports["total"].sample_count)
+        self.assertEqual(3, section_reports["mask"].sample_count)
+        self.assertEqual(3, section_reports["drain"].sample_count)
+        self.assertEqual(3, section_reports["tree_search"].sample_count)
+        self.assertEqual("total", profiler.get_report()[0].section_name)
+        self.assertEqual([], profiler.started_sections)
+
+        profiler.reset()
+        self.assertEqual([], profiler.get_report())
+        with self.assertRaises(ValueError):
+            HistogramProfiler(sample_interval=0)
+
+    def test_template_miner(self):
+        config = TemplateMinerConfig()
+        config.profiling_enabled = True
+        config.profiling_type = "histogram"
+        config.profiling_report_sec = 0
+        template_miner = TemplateMiner(config=config)
+        lines = []
+        template_miner.profiler.printer = lines.append
+        template_miner.add_log_message("connected to 10.0.0.1")
+        template_miner.add_log_message("connected to 10.0.0.2")
+        self.assertIn("p99", lines[-1])
+        section_names = [section_report.section_name for section_report in template_miner.profiler.get_report()]
+        self.assertEqual("total", section_names[0])
+        self.assertIn("tree_search", section_names)
+
+        config.profiling_type = "other"
+        with self.assertRaises(ValueError):
+            TemplateMiner(config=config)
@@ -1,9 +1,11 @@
 # SPDX-License-Identifier: MIT
 
+import random
 import unittest
 
 from drain3.drain import LogCluster
 from drain3.jaccard_drain import JaccardDrain
+from tests.test_drain import full_scan_fast_match
 
 
 class DrainTest(unittest.TestCase):
@@ -285,6 +287,23 @@ class DrainTest(unittest.TestCase):
         c: LogCluster = model.match("nothing")
         self.assertIsNone(c)
 
+    def test_fast_match_same_as_full_scan(self):
+        rnd = random.Random(0)
+        vocabulary = ["a", "b", "c", "d", "e", "f", "<*>"]
+        model = JaccardDrain()
+        for _ in range(50):
+            # the first token is not a parameter, since a template of parameters only can not be compared
+            tokens = [rnd.choice(vocabulary[:-1])] + [rnd.choice(vocabulary) for _ in range(rnd.randint(0, 5))]
+            model.create_cluster(tokens)
+        cluster_ids = list(model.id_to_cluster.keys())
+        for _ in range(500):
+            tokens = [rnd.choice(vocabulary[:-1]) for _ in range(rnd.randint(1, 6))]
+            for sim_th in [0.0, 0.5, 0.8, 1.0]:
+                for include_params in [False, True]:
+                    expected = full_scan_fast_match(model, cluster_ids, tokens, sim_th, include_params)
+                    actual = model.fast_match(cluster_ids, tokens, sim_th, include_params)
+                    self.assertIs(expected, actual)
+
 
 if __name__ == "__main__":
     pass
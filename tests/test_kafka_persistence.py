@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: MIT
+
+import random
+import unittest
+import zlib
+from collections import namedtuple
+
+from drain3 import TemplateMiner
+from drain3.kafka_persistence import KafkaPersistence
+from drain3.template_miner_config import TemplateMinerConfig
+
+ConsumerRecord = namedtuple("ConsumerRecord", ["key", "value", "offset"])
+
+
+class FakeKafkaTopic:
+    """
+    An in-process stand-in for a Kafka topic, without log compaction.
+    """
+
+    def __init__(self, partition_count):
+        self.partitions = [[] for _ in range(partition_count)]
+
+
+class FakeKafkaProducer:
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.pending = []
+        self.flush_count = 0
+
+    def send(self, topic, key=None, value=None):
+        self.pending.append((key, value))
+
+    def flush(self):
+        self.flush_count += 1
+        for key, value in self.pending:
+            partitions = self.topic.partitions
+            partition = partitions[zlib.crc32(key) % len(partitions) if key is not None else 0]
+            partition.append(ConsumerRecord(key, value, len(partition)))
+        self.pending = []
+
+
+class FakeKafkaConsumer:
+
+    def __init__(self, topic, topic_name):
+        self.topic = topic
+        self.topic_name = topic_name
+        self.positions = {}
+
+    def partitions_for_topic(self, topic_name):
+        return set(range(len(self.topic.partitions)))
+
+    def assign(self, partitions):
+        self.positions = {partition: 0 for partition in partitions}
+
+    def seek_to_beginning(self, *partitions):
+        for partition in partitions:
+            self.positions[partition] = 0
+
+    def seek(self, partition, offset):
+        self.positions[partition] = offset
+
+    def position(self, partition):
+        return self.positions[partition]
+
+    def end_offsets(self, partitions):
+        return {partition: len(self.topic.partitions[partition.partition]) for partition in partitions}
+
+    def poll(self, timeout_ms):
+        # a few records of each partition at a time, to return them in several polls
+        records = {}
+        for partition, position in self.positions.items():
+            partition_records = self.topic.partitions[partition.partition][position:position + 5]
+            if partition_records:
+                records[partition] = partition_records
+                self.positions[partition] = position + len(partition_records)
+        return records
+
+    def close(self):
+        pass
+
+
+class FakeKafkaPersistence(KafkaPersistence):
+
+    def __init__(self, topic, **kwargs):
+        self.fake_topic = topic
+        super().__init__("drain3_state", **kwargs)
+
+    def create_producer(self):
+        return FakeKafkaProducer(self.fake_topic)
+
+    def create_consumer(self):
+        return FakeKafkaConsumer(self.fake_topic, self.topic)
+
+
+class KafkaPersistenceTest(unittest.TestCase):
+
+    def test_save_load_state(self):
+        topic = FakeKafkaTopic(1)
+        persistence = FakeKafkaPersistence(topic)
+        self.assertIsNone(persistence.load_state())
+        persistence.save_state(b"state1")
+        persistence.save_state(b"state2")
+        persistence.flush()
+        self.assertEqual(b"state2", persistence.load_state())
+
+    def test_save_load_keyed(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc"]
+        for max_clusters in [None, 10]:
+            with self.subTest(max_clusters=max_clusters):
+                topic = FakeKafkaTopic(1)
+                config = TemplateMinerConfig()
+                config.drain_max_clusters = max_clusters
+                template_miner1 = TemplateMiner(FakeKafkaPersistence(topic, keyed=True), config)
+                rnd = random.Random(0)
+                for _ in range(300):
+                    words_count = rnd.randint(1, 4)
+                    template_miner1.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                template_miner1.save_state("test")
+
+                template_miner2 = TemplateMiner(FakeKafkaPersistence(topic, keyed=True), config)
+                drain1 = template_miner1.drain
+                drain2 = template_miner2.drain
+                self.assertEqual(drain1.clusters_counter, drain2.clusters_counter)
+                self.assertEqual(drain1.get_all_changes()["clusters"], drain2.get_all_changes()["clusters"])
+                self.assertEqual(sorted(drain1.get_all_changes()["nodes"]), sorted(drain2.get_all_changes()["nodes"]))
+
+                # only the new cluster, the prefix tree node it was added to and the meta message are sent,
+                # and a tombstone of the cluster it replaced if the model is full
+                record_count = len(topic.partitions[0])
+                template_miner2.add_log_message("a new message")
+                self.assertEqual(record_count + (3 if max_clusters is None else 4), len(topic.partitions[0]))
+
+                # messages of an older state are ignored, and removed with tombstones
+                template_miner3 = TemplateMiner(config=config)
+                template_miner3.add_log_message("another message")
+                FakeKafkaPersistence(topic, keyed=True).save_changes(template_miner3.drain.get_all_changes(), True)
+                template_miner4 = TemplateMiner(FakeKafkaPersistence(topic, keyed=True), config)
+                self.assertEqual(template_miner3.drain.get_all_changes(), template_miner4.drain.get_all_changes())
+                changes = template_miner3.drain.get_all_changes()
+                self.assertEqual(1 + len(changes["clusters"]) + len(changes["nodes"]),
+                                 len(template_miner4.persistence_handler.load_latest_values()))
+
+    def test_keyed_requires_single_partition(self):
+        persistence = FakeKafkaPersistence(FakeKafkaTopic(3), keyed=True)
+        self.assertRaises(ValueError, TemplateMiner, persistence, TemplateMinerConfig())
+        self.assertRaises(ValueError, persistence.save_changes, TemplateMiner().drain.get_all_changes(), True)
+
+    def test_flush_control(self):
+        topic = FakeKafkaTopic(1)
+        persistence = FakeKafkaPersistence(topic, keyed=True, flush_on_save=False)
+        config = TemplateMinerConfig()
+        template_miner = TemplateMiner(persistence, config)
+        template_miner.add_log_message("hello")
+        self.assertEqual([], topic.partitions[0])
+        persistence.flush()
+        self.assertGreater(len(topic.partitions[0]), 0)
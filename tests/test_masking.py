@@ -1,9 +1,21 @@
 # SPDX-License-Identifier: MIT
 
+import random
 import unittest
 
 from drain3.masking import MaskingInstruction, LogMasker
 
+# the examples at the bottom of masking.py
+example_instructions = [
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(([0-9a-f]{2,}:){3,}([0-9a-f]{2,}))((?=[^A-Za-z0-9])|$)', "ID"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})((?=[^A-Za-z0-9])|$)', "IP"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([0-9a-f]{6,} ?){3,}((?=[^A-Za-z0-9])|$)', "SEQ"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([0-9A-F]{4} ?){4,}((?=[^A-Za-z0-9])|$)', "SEQ"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)(0x[a-f0-9A-F]+)((?=[^A-Za-z0-9])|$)', "HEX"),
+    MaskingInstruction(r'((?<=[^A-Za-z0-9])|^)([\-\+]?\d+)((?=[^A-Za-z0-9])|$)', "NUM"),
+    MaskingInstruction(r'(?<=executed cmd )(".+?")', "CMD"),
+]
+
 
 class MaskingTest(unittest.TestCase):
 
@@ -34,3 +46,92 @@ class MaskingTest(unittest.TestCase):
         masker = LogMasker([mi], "<!", "!>")
         masked = masker.mask(s)
         self.assertEqual("D9 test <!NUM!> <!NUM!> 1A ccc <!NUM!>", masked)
+
+    def test_mask_combined(self):
+        sequential_masker = LogMasker(example_instructions, "<:", ":>")
+        masker = LogMasker(example_instructions, "<:", ":>", combined=True)
+        self.assertIsNotNone(masker.combined_masker)
+
+        s = "Accepted password for root from 10.0.0.1 port 22 ssh2"
+        self.assertEqual("Accepted password for root from <:IP:> port <:NUM:> ssh2", masker.combined_masker.mask(s))
+        self.assertEqual("nothing to mask", masker.combined_masker.mask("nothing to mask"))
+
+        # after the IP is masked, "-5" is preceded by a non-alphanumeric character and becomes a NUM
+        s = "1.2.3.4-5"
+        self.assertEqual("<:IP:><:NUM:>", masker.mask(s))
+        self.assertEqual(1, masker.combined_masker.fallback_count)
+
+        # NUM comes before CMD, so it masks the number in the command first
+        s = 'executed cmd "sleep 5"'
+        self.assertEqual(sequential_masker.mask(s), masker.mask(s))
+        self.assertEqual(2, masker.combined_masker.fallback_count)
+
+    def test_mask_combined_same_as_sequential(self):
+        rnd = random.Random(0)
+        words = ["0", "1", "5", "a", "f", "x", "0x", "A", "F", "ab", "ff", ".", ":", "-", "+", " ", " ", '"', "<", ">",
+                 "1.2.3.4", "aa:bb:cc:dd", "executed cmd "]
+        sequential_masker = LogMasker(example_instructions, "<", ">")
+        masker = LogMasker(example_instructions, "<", ">", combined=True)
+        count = 3000
+        for _ in range(count):
+            s = "".join(rnd.choice(words) for _ in range(rnd.randrange(20)))
+            self.assertEqual(sequential_masker.mask(s), masker.mask(s), s)
+        self.assertLess(masker.combined_masker.fallback_count, count / 2)
+
+    def test_mask_with_spans(self):
+        rnd = random.Random(0)
+        words = ["0", "5", "a", "f", "x", "0x", "A", "ab", ".", ":", "-", " ", " ", '"', "<", ">",
+                 "1.2.3.4", "aa:bb:cc:dd", "executed cmd "]
+        for combined in [False, True]:
+            masker = LogMasker(example_instructions, "<", ">", combined=combined)
+            for _ in range(1000):
+                s = "".join(rnd.choice(words) for _ in range(rnd.randrange(20)))
+                masked_content, spans = masker.mask_with_spans(s)
+                self.assertEqual(masker.mask(s), masked_content, s)
+                # replacing each mask with the text it replaced restores the content
+                unmasked_content = masked_content
+                for span in reversed(spans):
+                    self.assertEqual(f"<{span.mask_name}>", masked_content[span.start:span.end], s)
+                    unmasked_content = unmasked_content[:span.start] + span.value + unmasked_content[span.end:]
+                self.assertEqual(s, unmasked_content)
+
+        # NUM masks the number in the command first, and the text of CMD includes it
+        masker = LogMasker(example_instructions, "<", ">")
+        masked_content, spans = masker.mask_with_spans('executed cmd "sleep 5" 7 times')
+        self.assertEqual("executed cmd <CMD> <NUM> times", masked_content)
+        self.assertEqual([(13, 18, "CMD", '"sleep 5"'), (19, 24, "NUM", "7")], spans)
+
+    def test_mask_combined_not_possible(self):
+        # back references and global flags are not supported, sequential masking is used instead
+        for pattern in [r"(\d)\1", r"(?i)abc"]:
+            mi = MaskingInstruction(pattern, "X")
+            with self.assertLogs("drain3.masking", "WARNING"):
+                masker = LogMasker([mi], "<", ">", combined=True)
+            self.assertIsNone(masker.combined_masker)
+            self.assertEqual(mi.mask("x 11 abc", "<", ">"), masker.mask("x 11 abc"))
+
+    def test_prefilter(self):
+        self.assertEqual([(":", ""), (".", ""), ("", "0123456789abcdef"), ("", "0123456789ABCDEF"), ("0x", ""),
+                          ("", "0123456789"), ("executed cmd ", "")],
+                         [(mi.required_literal, mi.required_chars) for mi in example_instructions])
+        # no prefilter for case-insensitive patterns, or without a required literal or small character set
+        for pattern in [r"(?i)abc", r"(?i:a)", r"ab|c", r"\w+", r"[^a]"]:
+            mi = MaskingInstruction(pattern, "X")
+            self.assertEqual(("", ""), (mi.required_literal, mi.required_chars))
+            self.assertTrue(mi.may_match(""))
+
+        mi = MaskingInstruction(r"\d+", "NUM")
+        self.assertTrue(mi.may_match("a1"))
+        self.assertFalse(mi.may_match("ab"))
+        # non-ASCII digits also match \d
+        self.assertTrue(mi.may_match("a٣"))
+        mi = MaskingInstruction(r"\d+", "NUM", required_literal="=")
+        self.assertFalse(mi.may_match("a1"))
+        self.assertEqual("", mi.required_chars)
+
+    def test_mask_prefilter_counts(self):
+        masker = LogMasker(example_instructions, "<:", ":>")
+        self.assertEqual("connected to <:IP:>:<:NUM:>", masker.mask("connected to 10.0.0.1:22"))
+        self.assertEqual("nothing to mask", masker.mask("nothing to mask"))
+        self.assertEqual([1, 1, 0, 1, 2, 1, 2], masker.prefilter_skip_counts)
+        self.assertEqual([1, 1, 2, 1, 0, 1, 0], masker.prefilter_hit_counts)
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: MIT
+
+import unittest
+import urllib.error
+import urllib.request
+
+from drain3 import TemplateMiner
+from drain3.memory_buffer_persistence import MemoryBufferPersistence
+from drain3.metrics import MetricsRegistry, MetricsServer, PROMETHEUS_CONTENT_TYPE
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_render_prometheus(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests.")
+        counter.inc()
+        counter.inc(2)
+        registry.gauge("temperature", "Temperature.").set(21.5)
+        registry.gauge("queue_size", "Queue size.", lambda: 7)
+        self.assertEqual("# HELP requests_total Requests.\n"
+                         "# TYPE requests_total counter\n"
+                         "requests_total 3\n"
+                         "# HELP temperature Temperature.\n"
+                         "# TYPE temperature gauge\n"
+                         "temperature 21.5\n"
+                         "# HELP queue_size Queue size.\n"
+                         "# TYPE queue_size gauge\n"
+                         "queue_size 7\n",
+                         registry.render_prometheus())
+
+    def test_template_miner_metrics(self):
+        config = TemplateMinerConfig()
+        config.drain_max_clusters = 2
+        config.profiling_enabled = True
+        config.profiling_type = "histogram"
+        config.profiling_report_sec = 3600
+        template_miner = TemplateMiner(MemoryBufferPersistence(), config)
+        template_miner.add_log_message("connected to host1")
+        template_miner.add_log_message("connected to host2")
+        template_miner.add_log_messages(["disk full", "user alice logged in", "disk full"])
+        registry = MetricsRegistry()
+        registry.add_collector(template_miner.collect_metrics)
+
+        text = registry.render_prometheus()
+        lines = text.splitlines()
+        self.assertIn("drain3_messages_total 5", lines)
+        self.assertIn("drain3_clusters 2", lines)
+        self.assertIn("drain3_clusters_created_total 3", lines)
+        self.assertIn("drain3_cluster_template_changes_total 1", lines)
+        self.assertIn("drain3_clusters_evicted_total 1", lines)
+        self.assertIn('drain3_snapshots_total{type="full"} 3', lines)
+        self.assertIn("# TYPE drain3_section_duration_seconds summary", lines)
+        self.assertIn('drain3_section_duration_seconds_count{section="total"} 3', lines)
+        self.assertTrue(any(line.startswith('drain3_section_duration_seconds{section="mask",quantile="0.99"} ')
+                            for line in lines))
+        snapshot_bytes = [line for line in lines if line.startswith("drain3_snapshot_bytes_total ")]
+        self.assertGreater(int(snapshot_bytes[0].split()[1]), 0)
+
+    def test_server(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests.").inc()
+        with MetricsServer(registry, port=0) as server:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=10) as response:
+                self.assertEqual(PROMETHEUS_CONTENT_TYPE, response.headers["Content-Type"])
+                self.assertIn("requests_total 1\n", response.read().decode("utf-8"))
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other", timeout=10)
+            self.assertEqual(404, context.exception.code)
+            context.exception.close()
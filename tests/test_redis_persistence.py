@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+
+import random
+import unittest
+
+from drain3 import TemplateMiner
+from drain3.redis_persistence import RedisPersistence
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+def to_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class FakeRedis:
+    """
+    An in-process stand-in for the commands of a Redis client used by RedisPersistence.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.hset_field_count = 0
+
+    def get(self, key):
+        return self.data.get(to_bytes(key))
+
+    def set(self, key, value):
+        self.data[to_bytes(key)] = to_bytes(value)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(to_bytes(key), None)
+
+    def hset(self, key, mapping):
+        self.hset_field_count += len(mapping)
+        fields = self.data.setdefault(to_bytes(key), {})
+        fields.update((to_bytes(field), to_bytes(value)) for field, value in mapping.items())
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(to_bytes(key), {}).pop(to_bytes(field), None)
+
+    def hscan_iter(self, key, count):
+        # in a different order than the fields were set, as in Redis
+        items = list(self.data.get(to_bytes(key), {}).items())
+        random.Random(0).shuffle(items)
+        return iter(items)
+
+    def rpush(self, key, value):
+        self.data.setdefault(to_bytes(key), []).append(to_bytes(value))
+
+    def lrange(self, key, start, end):
+        return list(self.data.get(to_bytes(key), []))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.r, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+def create_persistence(r):
+    persistence = RedisPersistence("localhost", 6379, 0, None, False, "drain3_state", per_cluster=True, chunk_size=3)
+    persistence.r = r
+    return persistence
+
+
+class RedisPersistenceTest(unittest.TestCase):
+
+    def test_save_load_per_cluster(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc"]
+        for max_clusters in [None, 10]:
+            with self.subTest(max_clusters=max_clusters):
+                r = FakeRedis()
+                config = TemplateMinerConfig()
+                config.drain_max_clusters = max_clusters
+                template_miner1 = TemplateMiner(create_persistence(r), config)
+                self.assertTrue(template_miner1.drain.track_changes)
+                rnd = random.Random(0)
+                for _ in range(300):
+                    words_count = rnd.randint(1, 4)
+                    template_miner1.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                template_miner1.save_state("test")
+
+                template_miner2 = TemplateMiner(create_persistence(r), config)
+                drain1 = template_miner1.drain
+                drain2 = template_miner2.drain
+                self.assertEqual(drain1.clusters_counter, drain2.clusters_counter)
+                self.assertEqual(drain1.get_all_changes()["clusters"], drain2.get_all_changes()["clusters"])
+                self.assertEqual(sorted(drain1.get_all_changes()["nodes"]), sorted(drain2.get_all_changes()["nodes"]))
+
+                # only the new cluster and the prefix tree node it was added to are written
+                r.hset_field_count = 0
+                template_miner2.add_log_message("a new message")
+                self.assertEqual(2, r.hset_field_count)
+                template_miner3 = TemplateMiner(create_persistence(r), config)
+                self.assertEqual(drain2.get_all_changes()["clusters"],
+                                 template_miner3.drain.get_all_changes()["clusters"])
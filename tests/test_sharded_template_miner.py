@@ -0,0 +1,95 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+
+from drain3 import TemplateMiner
+from drain3.memory_buffer_persistence import MemoryBufferPersistence
+from drain3.sharded_template_miner import ShardedTemplateMiner
+from drain3.sqlite_persistence import SqlitePersistence
+from drain3.template_miner_config import TemplateMinerConfig
+
+entries = """
+Dec 10 07:07:38 LabSZ sshd[24206]: input_userauth_request: invalid user test9 [preauth]
+Dec 10 07:08:28 LabSZ sshd[24208]: input_userauth_request: invalid user webmaster [preauth]
+Dec 10 09:12:32 LabSZ sshd[24490]: Failed password for invalid user ftpuser from 0.0.0.0 port 62891 ssh2
+Dec 10 09:12:35 LabSZ sshd[24492]: Failed password for invalid user pi from 0.0.0.0 port 49289 ssh2
+Dec 10 09:12:44 LabSZ sshd[24501]: Failed password for invalid user ftpuser from 0.0.0.0 port 60836 ssh2
+Dec 10 07:28:03 LabSZ sshd[24245]: input_userauth_request: invalid user pgadmin [preauth]
+connected to 10.0.0.1
+connected to 10.0.0.2
+session closed
+""".strip().splitlines()
+
+
+class ShardedTemplateMinerTest(unittest.TestCase):
+
+    def test_same_templates_as_template_miner(self):
+        for engine in ["Drain", "JaccardDrain"]:
+            config = TemplateMinerConfig()
+            config.engine = engine
+            template_miner = TemplateMiner(config=config)
+            with ShardedTemplateMiner(config=config, shard_count=3) as sharded_template_miner:
+                sharded_results = [sharded_template_miner.add_log_message(entry) for entry in entries[:3]]
+                sharded_results += [{"cluster_id": cluster_id, "change_type": change_type} for cluster_id, change_type
+                                    in sharded_template_miner.add_log_messages(entries[3:])]
+                results = [template_miner.add_log_message(entry) for entry in entries]
+
+                # cluster IDs differ, but messages are grouped to clusters with the same templates
+                cluster_id_map = {}
+                for result, sharded_result in zip(results, sharded_results):
+                    self.assertEqual(result["change_type"], sharded_result["change_type"])
+                    cluster_id = cluster_id_map.setdefault(sharded_result["cluster_id"], result["cluster_id"])
+                    self.assertEqual(result["cluster_id"], cluster_id)
+
+                sharded_templates = {cluster_id_map[c.cluster_id]: c.get_template()
+                                     for c in sharded_template_miner.clusters}
+                templates = {c.cluster_id: c.get_template() for c in template_miner.drain.clusters}
+                self.assertEqual(templates, sharded_templates)
+                self.assertEqual(len(templates), sharded_template_miner.add_log_message(entries[0])["cluster_count"])
+
+                cluster = sharded_template_miner.match("connected to 10.0.0.3")
+                self.assertEqual("connected to <*>", cluster.get_template())
+                self.assertIsNone(sharded_template_miner.match("disconnected from 10.0.0.3"))
+
+    def test_save_load_state(self):
+        for snapshot_format in ["json", "binary"]:
+            with self.subTest(snapshot_format=snapshot_format):
+                self.save_load_state(snapshot_format)
+
+    def save_load_state(self, snapshot_format):
+        persistence = MemoryBufferPersistence()
+        config = TemplateMinerConfig()
+        config.snapshot_format = snapshot_format
+        with ShardedTemplateMiner(persistence, config, shard_count=2) as sharded_template_miner:
+            results = sharded_template_miner.add_log_messages(entries)
+            self.assertIsNotNone(persistence.state)
+
+        with ShardedTemplateMiner(persistence, config, shard_count=2) as sharded_template_miner:
+            for entry, (cluster_id, _) in zip(entries, results):
+                self.assertEqual(cluster_id, sharded_template_miner.match(entry).cluster_id)
+            result = sharded_template_miner.add_log_message("session closed")
+            self.assertEqual("none", result["change_type"])
+            self.assertEqual(len(set(cluster_id for cluster_id, _ in results)), result["cluster_count"])
+
+        with ShardedTemplateMiner(config=config, shard_count=3) as sharded_template_miner:
+            self.assertRaises(ValueError, sharded_template_miner.restore_state, persistence.state)
+
+    def test_close_saves_pending_changes(self):
+        persistence = MemoryBufferPersistence()
+        config = TemplateMinerConfig()
+        config.snapshot_min_interval_sec = 3600
+        with ShardedTemplateMiner(persistence, config, shard_count=2) as sharded_template_miner:
+            results = sharded_template_miner.add_log_messages(entries)
+            self.assertIsNone(persistence.state)
+        self.assertIsNotNone(persistence.state)
+
+        with ShardedTemplateMiner(persistence, config, shard_count=2) as sharded_template_miner:
+            self.assertEqual(len(set(cluster_id for cluster_id, _ in results)), len(sharded_template_miner.clusters))
+
+    def test_persistence_of_separate_clusters_is_rejected(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = SqlitePersistence(os.path.join(temp_dir, "drain3.db"))
+            self.assertRaises(ValueError, ShardedTemplateMiner, persistence, TemplateMinerConfig(), shard_count=2)
+            persistence.close()
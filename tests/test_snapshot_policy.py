@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: MIT
+
+import unittest
+
+from drain3 import TemplateMiner
+from drain3.memory_buffer_persistence import MemoryBufferPersistence
+from drain3.snapshot_policy import SnapshotPolicy
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class SnapshotPolicyTest(unittest.TestCase):
+
+    def test_default_saves_every_change(self):
+        policy = SnapshotPolicy(TemplateMinerConfig())
+        self.assertIsNone(policy.get_snapshot_reason(100, 100))
+        policy.add_changes(1, "cluster_created (1)", 100)
+        self.assertEqual("cluster_created (1)", policy.get_snapshot_reason(100, 100))
+        policy.reset()
+        self.assertEqual("periodic", policy.get_snapshot_reason(100, 100 + 5 * 60))
+
+    def test_min_interval(self):
+        config = TemplateMinerConfig()
+        config.snapshot_min_interval_sec = 10
+        policy = SnapshotPolicy(config)
+        policy.add_changes(1, "cluster_created (1)", 101)
+        self.assertIsNone(policy.get_snapshot_reason(100, 101))
+        policy.add_changes(3, "batch with 3 changes", 105)
+        policy.add_changes(1, "cluster_template_changed (1)", 109)
+        self.assertIsNone(policy.get_snapshot_reason(100, 109))
+        self.assertEqual("5 coalesced changes, last: cluster_template_changed (1)",
+                         policy.get_snapshot_reason(100, 110))
+
+    def test_max_pending_changes(self):
+        config = TemplateMinerConfig()
+        config.snapshot_min_interval_sec = 10
+        config.snapshot_max_pending_changes = 3
+        policy = SnapshotPolicy(config)
+        policy.add_changes(2, "batch with 2 changes", 101)
+        self.assertIsNone(policy.get_snapshot_reason(100, 101))
+        policy.add_changes(1, "cluster_created (3)", 102)
+        self.assertEqual("3 coalesced changes, last: cluster_created (3)", policy.get_snapshot_reason(100, 102))
+
+    def test_max_staleness(self):
+        config = TemplateMinerConfig()
+        config.snapshot_min_interval_sec = 60
+        config.snapshot_max_staleness_sec = 5
+        policy = SnapshotPolicy(config)
+        policy.add_changes(1, "cluster_created (1)", 101)
+        policy.add_changes(1, "cluster_created (2)", 105)
+        self.assertIsNone(policy.get_snapshot_reason(100, 105))
+        self.assertEqual("2 coalesced changes, last: cluster_created (2)", policy.get_snapshot_reason(100, 106))
+
+    def test_template_miner_coalesces_snapshots(self):
+        class CountingPersistence(MemoryBufferPersistence):
+            def __init__(self):
+                super().__init__()
+                self.save_count = 0
+
+            def save_state(self, state):
+                self.save_count += 1
+                super().save_state(state)
+
+        config = TemplateMinerConfig()
+        config.snapshot_min_interval_sec = 3600
+        config.snapshot_max_pending_changes = 10
+        persistence = CountingPersistence()
+        template_miner = TemplateMiner(persistence, config)
+        change_count = 0
+        for i in range(50):
+            result = template_miner.add_log_message(f"event{i % 25}")
+            if result["change_type"] != "none":
+                change_count += 1
+        self.assertGreater(change_count, 10)
+        self.assertEqual(change_count // 10, persistence.save_count)
+        self.assertEqual(change_count % 10, template_miner.snapshot_policy.pending_change_count)
+
+        template_miner.save_state("shutdown")
+        self.assertEqual(0, template_miner.snapshot_policy.pending_change_count)
+        template_miner2 = TemplateMiner(persistence, config)
+        self.assertEqual(len(template_miner.drain.clusters), len(template_miner2.drain.clusters))
+
+    def test_close_saves_pending_changes(self):
+        for background in [False, True]:
+            for max_deltas in [0, 5]:
+                with self.subTest(background=background, max_deltas=max_deltas):
+                    config = TemplateMinerConfig()
+                    config.snapshot_min_interval_sec = 3600
+                    config.snapshot_background = background
+                    config.snapshot_max_deltas = max_deltas
+                    persistence = MemoryBufferPersistence()
+                    with TemplateMiner(persistence, config) as template_miner:
+                        template_miner.add_log_message("connection from sender1 accepted")
+                        template_miner.flush()
+                        self.assertEqual(0, template_miner.snapshot_policy.pending_change_count)
+                        # within min_interval_sec of the last snapshot, the changes are held back
+                        template_miner.add_log_message("connection from sender2 accepted")
+                        template_miner.add_log_message("disk full")
+                        self.assertEqual(2, template_miner.snapshot_policy.pending_change_count)
+
+                    self.assertEqual(0, template_miner.snapshot_policy.pending_change_count)
+                    template_miner2 = TemplateMiner(persistence, config)
+                    self.assertEqual(["connection from <*> accepted", "disk full"],
+                                     [cluster.get_template() for cluster in template_miner2.drain.clusters])
+                    self.assertEqual(3, template_miner2.drain.get_total_cluster_size())
+                    template_miner2.close()
+
+    def test_get_pending_reason(self):
+        policy = SnapshotPolicy(TemplateMinerConfig())
+        self.assertIsNone(policy.get_pending_reason())
+        policy.add_changes(1, "cluster_created (1)", 100)
+        self.assertEqual("cluster_created (1)", policy.get_pending_reason())
+        policy.add_changes(2, "batch with 2 changes", 100)
+        self.assertEqual("3 coalesced changes, last: batch with 2 changes", policy.get_pending_reason())
@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from drain3 import TemplateMiner
+from drain3.sqlite_persistence import SqlitePersistence
+from drain3.template_miner_config import TemplateMinerConfig
+
+
+class SqlitePersistenceTest(unittest.TestCase):
+
+    def test_save_load_state(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            persistence = SqlitePersistence(os.path.join(temp_dir, "drain3.db"))
+            self.assertIsNone(persistence.load_state())
+            persistence.save_state(b"state1")
+            persistence.save_state(b"state2")
+            self.assertEqual(b"state2", persistence.load_state())
+            persistence.close()
+
+    def test_save_load_changes(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc"]
+        for max_clusters in [None, 10]:
+            with self.subTest(max_clusters=max_clusters), tempfile.TemporaryDirectory() as temp_dir:
+                file_path = os.path.join(temp_dir, "drain3.db")
+                config = TemplateMinerConfig()
+                config.drain_max_clusters = max_clusters
+                persistence1 = SqlitePersistence(file_path)
+                template_miner1 = TemplateMiner(persistence1, config)
+                rnd = random.Random(0)
+                for _ in range(300):
+                    words_count = rnd.randint(1, 4)
+                    template_miner1.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                template_miner1.save_state("test")
+
+                persistence2 = SqlitePersistence(file_path)
+                template_miner2 = TemplateMiner(persistence2, config)
+                drain1 = template_miner1.drain
+                drain2 = template_miner2.drain
+                self.assertEqual(drain1.clusters_counter, drain2.clusters_counter)
+                self.assertEqual(drain1.get_all_changes()["clusters"], drain2.get_all_changes()["clusters"])
+                self.assertEqual(sorted(drain1.get_all_changes()["nodes"]), sorted(drain2.get_all_changes()["nodes"]))
+
+                # only the rows of the new cluster, the prefix tree node it was added to and the meta data are written
+                total_changes = persistence2.connection.total_changes
+                template_miner2.add_log_message("a new message")
+                self.assertEqual(1 + 1 + 2 + (0 if max_clusters is None else 1),
+                                 persistence2.connection.total_changes - total_changes)
+
+                # the clusters can be queried by another connection
+                connection = sqlite3.connect(file_path)
+                rows = connection.execute("SELECT cluster_id, size, template FROM clusters ORDER BY cluster_id")
+                self.assertEqual(sorted((cluster.cluster_id, cluster.size, cluster.get_template())
+                                        for cluster in drain2.clusters), list(rows))
+                connection.close()
+                persistence1.close()
+                persistence2.close()
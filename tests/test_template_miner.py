@@ -1,11 +1,17 @@
 # SPDX-License-Identifier: MIT
 
+import importlib.util
 import io
 import logging
+import random
 import sys
+import threading
+import time
 import unittest
 from os.path import dirname
 
+import jsonpickle
+
 from drain3 import TemplateMiner
 from drain3.masking import MaskingInstruction
 from drain3.memory_buffer_persistence import MemoryBufferPersistence
@@ -60,6 +66,324 @@ class TemplateMinerTest(unittest.TestCase):
         print(template_miner2.add_log_message("hello yyy"))
         print(template_miner2.add_log_message("goodbye ABC"))
 
+    def test_add_log_messages(self):
+        saved_states = []
+
+        class RecordingPersistence(MemoryBufferPersistence):
+            def save_state(self, state):
+                saved_states.append(state)
+                super().save_state(state)
+
+        persistence = RecordingPersistence()
+        config = TemplateMinerConfig()
+        mi = MaskingInstruction("((?<=[^A-Za-z0-9])|^)([\\-\\+]?\\d+)((?=[^A-Za-z0-9])|$)", "NUM")
+        config.masking_instructions.append(mi)
+        template_miner = TemplateMiner(persistence, config)
+
+        results = template_miner.add_log_messages([
+            "request took 123 ms",
+            "request took 456 ms",
+            "user alice logged in",
+            "user bob logged in",
+        ])
+        self.assertListEqual([(1, "cluster_created"), (1, "none"),
+                              (2, "cluster_created"), (2, "cluster_template_changed")], results)
+        self.assertEqual("request took <NUM> ms", template_miner.drain.id_to_cluster[1].get_template())
+        self.assertEqual("user <*> logged in", template_miner.drain.id_to_cluster[2].get_template())
+        # snapshot trigger is evaluated once per batch
+        self.assertEqual(1, len(saved_states))
+
+        results = template_miner.add_log_messages(iter(["user carol logged in"]))
+        self.assertListEqual([(2, "none")], results)
+        self.assertEqual(1, len(saved_states))
+
+        template_miner2 = TemplateMiner(persistence, config)
+        self.assertEqual(4, template_miner2.drain.get_total_cluster_size())
+
+    def test_save_load_snapshot_intern_tokens(self):
+        persistence = MemoryBufferPersistence()
+        config = TemplateMinerConfig()
+        template_miner1 = TemplateMiner(persistence, config)
+        template_miner1.add_log_message("connection from sender1 accepted")
+        template_miner1.add_log_message("connection from sender2 accepted")
+
+        config.drain_intern_tokens = True
+        template_miner2 = TemplateMiner(persistence, config)
+        cluster = template_miner2.drain.id_to_cluster[1]
+        self.assertEqual("connection from <*> accepted", cluster.get_template())
+        for token in cluster.log_template_tokens:
+            self.assertIs(sys.intern(token), token)
+        self.assertEqual("none", template_miner2.add_log_message("connection from sender3 accepted")["change_type"])
+
+    def test_save_load_delta_snapshots(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc"]
+        for engine in ["Drain", "JaccardDrain"]:
+            for max_clusters in [None, 10]:
+                with self.subTest(engine=engine, max_clusters=max_clusters):
+                    persistence = MemoryBufferPersistence()
+                    config = TemplateMinerConfig()
+                    config.engine = engine
+                    config.drain_max_clusters = max_clusters
+                    config.drain_repeat_cache_size = 10
+                    config.snapshot_max_deltas = 5
+                    template_miner1 = TemplateMiner(persistence, config)
+                    rnd = random.Random(0)
+                    for i in range(300):
+                        words_count = rnd.randint(1, 4)
+                        template_miner1.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                        if i % 50 == 0:
+                            template_miner1.save_state("test")
+                    # save the sizes of clusters added to since the last change
+                    template_miner1.save_state("test")
+                    # at most 5 deltas after each full snapshot
+                    self.assertLessEqual(len(persistence.deltas), 5)
+
+                    template_miner2 = TemplateMiner(persistence, config)
+                    self.assertEqual(jsonpickle.dumps(template_miner1.drain, keys=True),
+                                     jsonpickle.dumps(template_miner2.drain, keys=True))
+                    self.assertEqual(len(persistence.deltas), template_miner2.snapshot_delta_count)
+
+                    # restored model continues to track changes
+                    template_miner1.add_log_message("new message")
+                    template_miner2.add_log_message("new message")
+                    template_miner2.save_state("test")
+                    template_miner3 = TemplateMiner(persistence, config)
+                    self.assertEqual(jsonpickle.dumps(template_miner2.drain, keys=True),
+                                     jsonpickle.dumps(template_miner3.drain, keys=True))
+
+    def test_rejected_delta_saves_full_snapshot(self):
+        class RejectingPersistence(MemoryBufferPersistence):
+            def __init__(self):
+                super().__init__()
+                self.reject_deltas = False
+                self.state_count = 0
+
+            def save_state(self, state):
+                self.state_count += 1
+                super().save_state(state)
+
+            def append_delta(self, delta):
+                return not self.reject_deltas and super().append_delta(delta)
+
+        for background in [False, True]:
+            with self.subTest(background=background):
+                config = TemplateMinerConfig()
+                config.snapshot_max_deltas = 10
+                config.snapshot_background = background
+                persistence = RejectingPersistence()
+                template_miner1 = TemplateMiner(persistence, config)
+                template_miner1.add_log_message("connection from sender1 accepted")
+                template_miner1.add_log_message("connection from sender2 accepted")
+                template_miner1.flush()
+                self.assertEqual(1, persistence.state_count)
+                self.assertEqual(1, len(persistence.deltas))
+
+                persistence.reject_deltas = True
+                template_miner1.add_log_message("disk full")
+                template_miner1.flush()
+                # the full snapshot includes the rejected delta
+                self.assertEqual(2, persistence.state_count)
+                self.assertEqual([], persistence.deltas)
+                self.assertTrue(template_miner1.drain.track_changes)
+                self.assertFalse(template_miner1.is_delta_rejected())
+                template_miner1.close()
+
+                template_miner2 = TemplateMiner(persistence, config)
+                self.assertEqual(2, len(template_miner2.drain.clusters))
+
+        # a delta rejected in the background after a full snapshot was submitted needs no other full snapshot
+        class BlockingPersistence(RejectingPersistence):
+            def __init__(self):
+                super().__init__()
+                self.delta_started = threading.Event()
+                self.delta_released = threading.Event()
+
+            def append_delta(self, delta):
+                self.delta_started.set()
+                self.delta_released.wait()
+                return super().append_delta(delta)
+
+        config = TemplateMinerConfig()
+        config.snapshot_max_deltas = 1
+        config.snapshot_background = True
+        persistence = BlockingPersistence()
+        with TemplateMiner(persistence, config) as template_miner:
+            template_miner.add_log_message("connection from sender1 accepted")
+            template_miner.add_log_message("disk full")
+            persistence.delta_started.wait()
+            # a full snapshot, since max_deltas deltas were saved
+            template_miner.add_log_message("user logged out")
+            persistence.reject_deltas = True
+            persistence.delta_released.set()
+            template_miner.flush()
+            self.assertFalse(template_miner.is_delta_rejected())
+            self.assertEqual(2, persistence.state_count)
+
+        # handlers without deltas always save full snapshots
+        class FullStatePersistence(MemoryBufferPersistence):
+            def supports_deltas(self):
+                return False
+
+        config = TemplateMinerConfig()
+        config.snapshot_max_deltas = 10
+        self.assertFalse(TemplateMiner(FullStatePersistence(), config).drain.track_changes)
+
+    def test_save_load_background_snapshots(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc"]
+        for max_deltas in [0, 3]:
+            with self.subTest(max_deltas=max_deltas):
+                config = TemplateMinerConfig()
+                config.drain_max_clusters = 10
+                config.snapshot_max_deltas = max_deltas
+                config.snapshot_background = True
+                persistence = MemoryBufferPersistence()
+                with TemplateMiner(persistence, config) as template_miner1:
+                    self.assertIsNotNone(template_miner1.snapshot_writer)
+                    rnd = random.Random(0)
+                    for i in range(300):
+                        words_count = rnd.randint(1, 4)
+                        template_miner1.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                        if i % 50 == 0:
+                            template_miner1.save_state("test")
+                    template_miner1.save_state("test")
+                    template_miner1.flush()
+                self.assertIsNone(template_miner1.snapshot_writer)
+
+                template_miner2 = TemplateMiner(persistence, config)
+                self.assertEqual(jsonpickle.dumps(template_miner1.drain, keys=True),
+                                 jsonpickle.dumps(template_miner2.drain, keys=True))
+                template_miner2.close()
+
+    def test_background_snapshots_replace_pending(self):
+        class SlowPersistence(MemoryBufferPersistence):
+            def __init__(self):
+                super().__init__()
+                self.save_count = 0
+
+            def save_state(self, state):
+                time.sleep(0.05)
+                self.save_count += 1
+                super().save_state(state)
+
+        config = TemplateMinerConfig()
+        config.snapshot_background = True
+        persistence = SlowPersistence()
+        template_miner = TemplateMiner(persistence, config)
+        for i in range(10):
+            template_miner.add_log_message(f"message {i} of {i % 3} parts")
+            template_miner.save_state("test")
+        template_miner.close()
+        # the snapshot being saved and the last one are saved, the ones in between are skipped
+        self.assertLess(persistence.save_count, 10)
+        template_miner2 = TemplateMiner(persistence, config)
+        self.assertEqual(jsonpickle.dumps(template_miner.drain, keys=True),
+                         jsonpickle.dumps(template_miner2.drain, keys=True))
+        template_miner2.close()
+
+    def test_background_snapshot_error(self):
+        class FailingPersistence(MemoryBufferPersistence):
+            def save_state(self, state):
+                raise IOError("disk full")
+
+        config = TemplateMinerConfig()
+        config.snapshot_background = True
+        template_miner = TemplateMiner(FailingPersistence(), config)
+        template_miner.add_log_message("hello")
+        with self.assertRaises(RuntimeError):
+            template_miner.flush()
+        # the error is raised once
+        template_miner.flush()
+        template_miner.close()
+
+    def test_save_load_binary_snapshot(self):
+        words = ["foo", "bar", "baz", "qux", "1", "22", "abc", "h\u00e9llo", "\ud800"]
+        for engine in ["Drain", "JaccardDrain"]:
+            for max_clusters in [None, 10]:
+                for compress_state in [False, True]:
+                    with self.subTest(engine=engine, max_clusters=max_clusters, compress_state=compress_state):
+                        config = TemplateMinerConfig()
+                        config.engine = engine
+                        config.drain_max_clusters = max_clusters
+                        config.snapshot_compress_state = compress_state
+                        config.snapshot_format = "binary"
+                        template_miner1 = TemplateMiner(config=config)
+                        rnd = random.Random(0)
+                        for _ in range(300):
+                            words_count = rnd.randint(0, 4)
+                            template_miner1.add_log_message(" ".join(rnd.choice(words) for _ in range(words_count)))
+                        state = template_miner1.dump_state()
+                        self.assertFalse(state.startswith(b"{"))
+
+                        template_miner2 = TemplateMiner(config=config)
+                        template_miner2.restore_state(state)
+                        self.assertEqual(jsonpickle.dumps(template_miner1.drain, keys=True),
+                                         jsonpickle.dumps(template_miner2.drain, keys=True))
+
+    def test_load_json_snapshot(self):
+        # json snapshots, compressed or not, are loaded regardless of the configured snapshot format
+        for compress_state in [False, True]:
+            with self.subTest(compress_state=compress_state):
+                config = TemplateMinerConfig()
+                config.snapshot_compress_state = compress_state
+                template_miner1 = TemplateMiner(config=config)
+                template_miner1.add_log_message("connected to 10.0.0.1")
+                template_miner1.add_log_message("connected to 10.0.0.2")
+                state = template_miner1.dump_state()
+
+                config = TemplateMinerConfig()
+                config.snapshot_compress_state = not compress_state
+                config.snapshot_format = "binary"
+                template_miner2 = TemplateMiner(config=config)
+                template_miner2.restore_state(state)
+                self.assertEqual(["connected to <*>"], [c.get_template() for c in template_miner2.drain.clusters])
+                self.assertEqual(2, template_miner2.drain.get_total_cluster_size())
+
+    def test_snapshot_compression(self):
+        for snapshot_format in ["json", "binary"]:
+            for compression in ["none", "zlib", "lzma", "bz2"]:
+                for base64 in [False, True]:
+                    with self.subTest(snapshot_format=snapshot_format, compression=compression, base64=base64):
+                        config = TemplateMinerConfig()
+                        config.snapshot_format = snapshot_format
+                        config.snapshot_compression = compression
+                        config.snapshot_compression_level = 1
+                        config.snapshot_base64 = base64
+                        config.snapshot_max_deltas = 5
+                        persistence = MemoryBufferPersistence()
+                        template_miner1 = TemplateMiner(persistence, config)
+                        template_miner1.add_log_message("connected to 10.0.0.1")
+                        template_miner1.add_log_message("connected to 10.0.0.2")
+                        template_miner1.add_log_message("disconnected")
+                        if snapshot_format == "json" and compression != "none" and not base64:
+                            codec = config.compression_codecs[compression]
+                            self.assertTrue(persistence.state.startswith(codec.magic))
+                            self.assertTrue(persistence.deltas[-1].startswith(codec.magic))
+
+                        # loaded regardless of the configured compression
+                        template_miner2 = TemplateMiner(persistence, TemplateMinerConfig())
+                        self.assertEqual(["connected to <*>", "disconnected"],
+                                         [c.get_template() for c in template_miner2.drain.clusters])
+
+    def test_snapshot_compression_negotiation(self):
+        class TextPersistence(MemoryBufferPersistence):
+            def is_binary_safe(self):
+                return False
+
+        config = TemplateMinerConfig()
+        config.snapshot_base64 = False
+        persistence = TextPersistence()
+        template_miner = TemplateMiner(persistence, config)
+        template_miner.add_log_message("hello")
+        persistence.state.decode("ascii")
+
+        config.snapshot_format = "binary"
+        with self.assertRaises(ValueError):
+            TemplateMiner(persistence, config)
+        config.snapshot_format = "json"
+        config.snapshot_compression = "zstd"
+        with self.assertRaises(ValueError):
+            TemplateMiner(persistence, config)
+
     def test_extract_parameters(self):
         config = TemplateMinerConfig()
         mi = MaskingInstruction("((?<=[^A-Za-z0-9])|^)([\\-\\+]?\\d+)((?=[^A-Za-z0-9])|$)", "NUM")
@@ -304,6 +628,156 @@ class TemplateMinerTest(unittest.TestCase):
                     self.assertListEqual([parameter.mask_name for parameter in extracted_parameters],
                                          expected_mask_names)
 
+    def test_extract_parameters_cache(self):
+        config = TemplateMinerConfig()
+        config.drain_extra_delimiters = ["_"]
+        config.parameter_extraction_cache_capacity = 2
+        template_miner = TemplateMiner(None, config)
+
+        def extract(template, msg):
+            return [parameter.value for parameter in template_miner.extract_parameters(template, msg)]
+
+        # parameters with several tokens are extracted by the regex of the template
+        self.assertListEqual(["1 a"], extract("job <*> done", "job_1 a done"))
+        self.assertListEqual(["2 b"], extract("job <*> done", "job 2 b done"))
+        self.assertListEqual(["a b"], extract("task <*> failed", "task a b failed"))
+        self.assertListEqual(["x y", "z"], extract("<*> to <*>", "x y to z"))
+        # the least recently used template was evicted
+        self.assertListEqual(["3 c"], extract("job <*> done", "job 3 c done"))
+        self.assertEqual(1, template_miner.parameter_extraction_cache_hits)
+        self.assertEqual(4, template_miner.parameter_extraction_cache_misses)
+        self.assertEqual(5, template_miner.parameter_extraction_fallback_count)
+
+        config.parameter_extraction_cache_capacity = 0
+        template_miner = TemplateMiner(None, config)
+        self.assertListEqual(["1 a"], extract("job <*> done", "job 1 a done"))
+        self.assertListEqual(["1 a"], extract("job <*> done", "job 1 a done"))
+        self.assertEqual(2, template_miner.parameter_extraction_cache_misses)
+
+    def test_extract_parameters_by_tokens(self):
+        config = TemplateMinerConfig()
+        config.load(f"{dirname(__file__)}/drain3_test.ini")
+        config.masking_instructions.append(MaskingInstruction(r"\d+ ?ms", "DURATION"))
+        config.masking_instructions.append(MaskingInstruction(r"(?<=took )\d+", "TOOK"))
+        template_miner = TemplateMiner(None, config)
+        mask_strs = [f"<{mask_name}>" for mask_name in list(template_miner.masker.mask_names) + ["*"]]
+        words = ["took", "abc", "12", "0x1f", "10.0.0.1", "5 ms", "5ms", "a_b", "<NUM>", ""]
+        rnd = random.Random(0)
+        for _ in range(3000):
+            template_tokens = [rnd.choice(mask_strs + words[:3]) for _ in range(rnd.randint(1, 4))]
+            template = " ".join(template_tokens)
+            if rnd.random() < 0.1:
+                template = template.replace(" ", rnd.choice(["x", "  ", "\t"]), 1)
+            # mostly messages of the template, with parameters replaced by words
+            message_tokens = [token if token in words and rnd.random() < 0.9 else rnd.choice(words)
+                              for token in template_tokens]
+            separators = [rnd.choice([" "] * 20 + ["  ", "\t", "_", ""]) for _ in message_tokens]
+            separators[0] = rnd.choice([""] * 9 + [" "])
+            log_message = "".join(separator + token for separator, token in zip(separators, message_tokens))
+            log_message += rnd.choice([""] * 9 + [" "])
+            for exact_matching in [True, False]:
+                expected = template_miner._extract_parameters_by_regex(
+                    template, log_message.replace("_", " "), exact_matching)
+                self.assertEqual(expected, template_miner.extract_parameters(template, log_message, exact_matching),
+                                 (template, log_message, exact_matching))
+        # both the tokens and the regex of templates were used
+        self.assertGreater(template_miner.parameter_extraction_fallback_count, 1000)
+        self.assertLess(template_miner.parameter_extraction_fallback_count, 5000)
+
+    def test_add_log_message_with_parameters(self):
+        config = TemplateMinerConfig()
+        config.load(f"{dirname(__file__)}/drain3_test.ini")
+        template_miner = TemplateMiner(None, config)
+        template_miner.add_log_message("user alice_1 logged in from 10.0.0.1 after 3 tries")
+        result = template_miner.add_log_message_with_parameters("user bob_2 logged in from 10.0.0.2 after 5 tries")
+        self.assertEqual("user <*> <NUM> logged in from <IP> after <NUM> tries", result["template_mined"])
+        self.assertEqual([("bob", "*"), ("2", "NUM"), ("10.0.0.2", "IP"), ("5", "NUM")], result["parameters"])
+        self.assertEqual("cluster_template_changed", result["change_type"])
+        # extracted from the masks and tokens, without the templates
+        self.assertEqual(0, len(template_miner.aligned_template_cache))
+        self.assertEqual(0, template_miner.parameter_extraction_fallback_count)
+
+        words = ["abc", "12", "0x1f", "10.0.0.1", "id=7", "a_b", "<*>", "x<NUM>", 'executed cmd "ls -l"']
+        rnd = random.Random(0)
+        for _ in range(2000):
+            separators = [rnd.choice([" "] * 20 + ["  ", "\t", "_"]) for _ in range(5)]
+            log_message = "".join(rnd.choice(words) + separator for separator in separators)[:-1]
+            result = template_miner.add_log_message_with_parameters(log_message)
+            self.assertEqual(template_miner.extract_parameters(result["template_mined"], log_message),
+                             result["parameters"], log_message)
+
+    def test_add_log_message_with_parameters_extra_delimiters(self):
+        config = TemplateMinerConfig()
+        config.masking_instructions = [MaskingInstruction(r"user=(?P<u>\w+)", "USER"),
+                                       MaskingInstruction(r"\d+", "NUM")]
+        config.drain_extra_delimiters = ["=", ":"]
+        template_miner = TemplateMiner(None, config)
+        # the text of the mask has an extra delimiter, which extract_parameters() replaces before matching it
+        result = template_miner.add_log_message_with_parameters("user=bob")
+        self.assertEqual("<USER>", result["template_mined"])
+        self.assertIsNone(template_miner.extract_parameters("<USER>", "user=bob"))
+        self.assertIsNone(result["parameters"])
+
+        words = ["user=bob", "user=x:y", "a:b", "k=v", "12", "3:4", "abc", "=", ":"]
+        rnd = random.Random(0)
+        for _ in range(2000):
+            log_message = " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 5)))
+            result = template_miner.add_log_message_with_parameters(log_message)
+            self.assertEqual(template_miner.extract_parameters(result["template_mined"], log_message),
+                             result["parameters"], log_message)
+
+    def test_extract_parameter_columns(self):
+        config = TemplateMinerConfig()
+        config.load(f"{dirname(__file__)}/drain3_test.ini")
+        template_miner = TemplateMiner(None, config)
+        template_miner.add_log_message("user alice logged in from 10.0.0.1 after 3 tries")
+        cluster_id = template_miner.add_log_message("user bob logged in from 10.0.0.2 after 5 tries")["cluster_id"]
+        log_messages = [f"user u{i} logged in from 10.0.{i % 256}.{i // 256} after {i % 7} tries" for i in range(5000)]
+        log_messages[10] = "user carol logged out"
+        log_messages[4999] = "user dave logged in from 10.0.0.3 after many tries"
+        # extracted by the regex of the template
+        log_messages[20] = "user  eve logged in from 10.0.0.4 after 2 tries"
+
+        columns = template_miner.extract_parameter_columns(cluster_id, log_messages)
+        self.assertEqual("user <*> logged in from <IP> after <NUM> tries", columns.template)
+        self.assertEqual(["*", "IP", "NUM"], columns.mask_names)
+        self.assertEqual(5000, columns.row_count)
+        self.assertEqual([0, 1], [columns.matched[10], columns.matched[11]])
+        self.assertEqual(4998, sum(columns.matched))
+        for i, log_message in enumerate(log_messages):
+            extracted_parameters = template_miner.extract_parameters(columns.template, log_message)
+            if extracted_parameters is None:
+                self.assertIsNone(columns.get_row(i))
+                self.assertEqual(["", "", ""], [column[i] for column in columns.columns])
+            else:
+                self.assertEqual([parameter.value for parameter in extracted_parameters], columns.get_row(i))
+        self.assertEqual(["u11", "u12"], columns.columns[0][11:13])
+        self.assertEqual("6", columns.columns[2][-3])
+        self.assertEqual(list(columns.columns[1]), [column_value for column_value in columns.columns[1]])
+
+        with self.assertRaises(ValueError):
+            template_miner.extract_parameter_columns(100, log_messages)
+
+        # templates with one or no parameters
+        cluster_id = template_miner.add_log_message("connected to host1")["cluster_id"]
+        template_miner.add_log_message("connected to host2")
+        columns = template_miner.extract_parameter_columns(cluster_id, ["connected to host3", "connected  to host4",
+                                                                        "disconnected"])
+        self.assertEqual([["host3"], ["host4"], None], [columns.get_row(i) for i in range(3)])
+        cluster_id = template_miner.add_log_message("session closed")["cluster_id"]
+        columns = template_miner.extract_parameter_columns(cluster_id, ["session closed", "session  closed", "closed"])
+        self.assertEqual([[], [], None], [columns.get_row(i) for i in range(3)])
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "NumPy is not installed")
+    def test_extract_parameter_columns_numpy(self):
+        template_miner = TemplateMiner()
+        cluster_id = template_miner.add_log_message("connected to host1")["cluster_id"]
+        template_miner.add_log_message("connected to host2")
+        columns = template_miner.extract_parameter_columns(cluster_id, ["connected to host3", "disconnected"])
+        arrays, matched = columns.to_numpy(dtype=str)
+        self.assertEqual(["host3", ""], arrays[0].tolist())
+        self.assertEqual([True, False], matched.tolist())
+
     def test_match_only(self):
         config = TemplateMinerConfig()
         config.drain_extra_delimiters = ["_"]